@@ -29,7 +29,9 @@ import time
 import math
 fullscreen = True
 
-# sys.path.append("../shared")
+sys.path.append("./shared")
+
+from sbmath import m3dTranslation44, m3dRotation44, m3dMultiply44, m3dChain44
 
 # from math3d import m3dDegToRad, m3dRotationMatrix44, M3DMatrix44f, m3dLoadIdentity44, \
                                             # m3dTranslateMatrix44, m3dScaleMatrix44, \
@@ -170,6 +172,12 @@ proj_matrix = (GLfloat * 16)(*identityMatrix)
 
 many_cubes = False
 
+# Per frame matrices of the 24 cubes, allocated once
+cube_index = np.arange(24, dtype=np.float32)
+cube_offsets = np.empty((24, 3), dtype=np.float32)
+cube_W = np.empty((24, 4, 4), dtype=np.float32)
+cube_mv = np.empty((24, 4, 4), dtype=np.float32)
+
 # Vertex program
 vs_source = '''
     #version 410 core                                                  
@@ -347,39 +355,21 @@ class Scene:
 
         if (many_cubes == True):
 
-            for i in range(0, 24):
-                f = i + currentTime * 0.3;
-
-                mv_matrix = (GLfloat * 16)(*identityMatrix)
-
-                T = (GLfloat * 16)(*identityMatrix)
-                m3dTranslateMatrix44(T, 0, 0, -4)
-
-                W = (GLfloat * 16)(*identityMatrix)
-                m3dTranslateMatrix44(W, sin(2.1 * f) * 0.5, cos(1.7 * f) * 0.5, sin(1.3 * f) * cos(1.5 * f) * 2.0)
-
-                RX = (GLfloat * 16)(*identityMatrix)
-                m3dRotationMatrix44(RX, currentTime * m3dDegToRad(45.0), 0.0, 1.0, 0.0)
+            # All 24 model-view matrices at once: the rotations and T are
+            # the same for every cube, only the offset W differs
+            f = cube_index + currentTime * 0.3
+            cube_offsets[:, 0] = np.sin(2.1 * f) * 0.5
+            cube_offsets[:, 1] = np.cos(1.7 * f) * 0.5
+            cube_offsets[:, 2] = np.sin(1.3 * f) * np.cos(1.5 * f) * 2.0
+            m3dTranslation44(cube_offsets, out=cube_W)
 
-                RY = (GLfloat * 16)(*identityMatrix)
-                m3dRotationMatrix44(RY, currentTime * m3dDegToRad(81.0), 1.0, 0.0, 0.0)
+            RX = m3dRotation44(currentTime * m3dDegToRad(45.0), [0.0, 1.0, 0.0])
+            RY = m3dRotation44(currentTime * m3dDegToRad(81.0), [1.0, 0.0, 0.0])
+            TR = m3dChain44([m3dTranslation44([0.0, 0.0, -4.0]), RY, RX])
+            m3dMultiply44(cube_W, TR, out=cube_mv)
 
-
-                mv_matrix = m3dMultiply(W, m3dMultiply(T, m3dMultiply(RY, RX)))
-
-                # or can multiply with numpy
-                #R = np.matmul(np.array(W).reshape(4,4) , np.matmul(np.array(RX).reshape(4,4), np.array(RY).reshape(4,4)))
-                #mv_matrix = np.matmul(R, np.array(T).reshape(4,4))
-
-
-                # third way this could be done
-                # T  = np.matrix(translate(0.0, 0.0, -4.0)).reshape(4,4)
-                # W  = np.matrix(translate(sin(2.1 * f) * 0.5, cos(1.7 * f) * 0.5, sin(1.3 * f) * cos(1.5 * f) * 2.0)).reshape(4,4)
-                # RX = np.matrix(rotation_matrix( [1.0, 0.0, 0.0], currentTime * m3dDegToRad(17.0)))
-                # RY = np.matrix(rotation_matrix( [0.0, 1.0, 0.0], currentTime * m3dDegToRad(13.0)))
-                # mv_matrix = RX * RY * T * W
-
-                glUniformMatrix4fv(mv_location, 1, GL_FALSE, mv_matrix)
+            for i in range(0, 24):
+                glUniformMatrix4fv(mv_location, 1, GL_FALSE, cube_mv[i])
 
                 glDrawArrays(GL_TRIANGLES, 0, 36)
 
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+
+# Frames updated per second, one GLFrame at a time versus a FrameBatch. Every
+# object turns about its up vector and moves forward each frame, then hands
+# its matrix to the renderer: RotateLocalY, MoveForward and GetMatrix per
+# GLFrame, against FrameBatch.step and matrices for all objects at once,
+# written into arrays allocated up front. After the runs both are checked
+# against each other, and the drift of GLFrame's forward vector from unit
+# length is shown next to the batch's quaternions.
+#
+# usage: python benchmark_frames.py [--max-n 100000]
+
+import sys
+import time
+import argparse
+
+sys.path.append("./shared")
+sys.path.append("../shared")
+
+from quatframe import FrameBatch
+from glframe import GLFrame
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+import numpy as np
+
+# The GLFrame loop is not run past this many objects
+LOOP_MAX = 10000
+MIN_SECONDS = 0.25
+DT = 0.016
+
+
+def make_objects(n):
+    rng = np.random.RandomState(0x13371337)
+    return rng.uniform(-2.0, 2.0, n).astype(np.float32), rng.uniform(0.5, 5.0, n).astype(np.float32)
+
+
+class GLFrameObjects:
+    def __init__(self, n):
+        self.spin, self.speed = make_objects(n)
+        self.frames = [GLFrame() for _ in range(n)]
+        self.matrices = [None] * n
+
+    def __call__(self):
+        for i, frame in enumerate(self.frames):
+            frame.RotateLocalY(float(self.spin[i]) * DT)
+            frame.MoveForward(float(self.speed[i]) * DT)
+            self.matrices[i] = frame.GetMatrix()
+
+
+class BatchObjects:
+    def __init__(self, n):
+        spin, speed = make_objects(n)
+        self.frames = FrameBatch(n)
+        self.frames.angular[:, 1] = spin
+        self.frames.speed[:] = speed
+        self.matrices = np.empty((n, 4, 4), dtype=np.float32)
+
+    def __call__(self):
+        self.frames.step(DT)
+        self.frames.matrices(out=self.matrices)
+
+
+def measure(objects, n):
+    steps = 0
+    start = time.perf_counter()
+    while True:
+        objects()
+        steps += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_SECONDS:
+            return n * steps / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Frame updates per second, GLFrame versus FrameBatch.')
+    parser.add_argument('--max-n', type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    print('{:>9} {:>16} {:>16} {:>9}'.format('N', 'GLFrame/s', 'FrameBatch/s', 'speedup'))
+    n = 1
+    while n <= args.max_n:
+        batched = measure(BatchObjects(n), n)
+        looped = measure(GLFrameObjects(n), n) if n <= LOOP_MAX else None
+        print('{:>9} {:>16} {:>16.0f} {:>9}'.format(
+            n, '{:.0f}'.format(looped) if looped else '-', batched,
+            '{:.1f}x'.format(batched / looped) if looped else '-'))
+        n *= 10
+
+    # The same 1000 steps both ways
+    loop, batch = GLFrameObjects(100), BatchObjects(100)
+    for _ in range(1000):
+        loop()
+        batch()
+    reference = np.array([list(m) for m in loop.matrices], dtype=np.float32).reshape(-1, 4, 4)
+    forward = np.array([list(frame.vForward) for frame in loop.frames])
+    print('largest difference after 1000 steps: {:.2e}'.format(np.abs(batch.matrices - reference).max()))
+    print('largest |forward| - 1: GLFrame {:.2e}, FrameBatch {:.2e}'.format(
+        np.abs(np.sqrt((forward * forward).sum(axis=1)) - 1.0).max(),
+        np.abs(np.sqrt((batch.frames.orientation ** 2).sum(axis=1)) - 1.0).max()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
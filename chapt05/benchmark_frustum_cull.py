@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+
+# Objects culled per millisecond at growing object counts. The objects are
+# scattered through a box around the camera of the asteroid field sample
+# (Figure 7.9): a 50 degree perspective from 1 to 2000 looking at the field,
+# so about a tenth of them are in view. Runs:
+#
+#   loop       the six plane tests in Python, one sphere at a time
+#   spheres    cull_spheres, the visible mask
+#   indices    cull_spheres and visible_indices
+#   aabbs      cull_aabbs
+#   commands   cull_spheres and compact_commands into a preallocated
+#              indirect command array, what a multi draw indirect needs
+#
+# usage: python benchmark_frustum_cull.py [--max-n 1000000]
+
+import sys
+import time
+import argparse
+
+sys.path.append("./shared")
+
+from sbmath import m3dDegToRad, m3dLookAt44, m3dPerspective44, m3dMultiply44
+from frustumcull import frustum_planes, cull_spheres, cull_aabbs, visible_indices, compact_commands
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+import numpy as np
+
+# The Python loop is not run past this many objects
+LOOP_MAX = 10000
+MIN_SECONDS = 0.25
+FIELD = 1500.0
+
+
+def make_objects(n):
+    rng = np.random.RandomState(0x13371337)
+    centers = rng.uniform(-FIELD, FIELD, (n, 3)).astype(np.float32)
+    radii = rng.uniform(1.0, 20.0, n).astype(np.float32)
+    extents = rng.uniform(1.0, 15.0, (n, 3)).astype(np.float32)
+    commands = np.zeros((n, 4), dtype=np.uint32)
+    commands[:, 0] = 36
+    commands[:, 1] = 1
+    commands[:, 3] = np.arange(n)
+    return centers, radii, centers - extents, centers + extents, commands
+
+
+def loop_cull(planes, centers, radii):
+    planes = planes.tolist()
+    visible = []
+    for i, (x, y, z) in enumerate(centers.tolist()):
+        r = float(radii[i])
+        for a, b, c, d in planes:
+            if a * x + b * y + c * z + d < -r:
+                break
+        else:
+            visible.append(i)
+    return visible
+
+
+def measure(cull, n):
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        cull()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_SECONDS:
+            return n * runs / elapsed / 1000.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Objects culled per millisecond.')
+    parser.add_argument('--max-n', type=int, default=1000000)
+    args = parser.parse_args(argv)
+
+    view = m3dLookAt44([100.0, 100.0, -600.0], [0.0, 0.0, 260.0], [0.1, 1.0, 0.0])
+    proj = m3dPerspective44(m3dDegToRad(50.0), 4.0 / 3.0, 1.0, 2000.0)
+    planes = frustum_planes(m3dMultiply44(proj, view))
+
+    names = ('loop', 'spheres', 'indices', 'aabbs', 'commands')
+    print('objects culled per millisecond')
+    print('{:>9} {:>8}'.format('N', 'visible') + ''.join('{:>11}'.format(name) for name in names))
+    n = 10
+    while n <= args.max_n:
+        centers, radii, mins, maxs, commands = make_objects(n)
+        mask = np.empty(n, dtype=bool)
+        scratch = np.empty_like(commands)
+        visible = cull_spheres(planes, centers, radii)
+        assert loop_cull(planes, centers[:LOOP_MAX], radii[:LOOP_MAX]) == list(np.flatnonzero(visible[:LOOP_MAX]))
+
+        runs = [
+            (lambda: loop_cull(planes, centers, radii)) if n <= LOOP_MAX else None,
+            lambda: cull_spheres(planes, centers, radii, out=mask),
+            lambda: visible_indices(cull_spheres(planes, centers, radii, out=mask)),
+            lambda: cull_aabbs(planes, mins, maxs, out=mask),
+            lambda: compact_commands(commands, cull_spheres(planes, centers, radii, out=mask), out=scratch),
+        ]
+        rates = [measure(cull, n) if cull else None for cull in runs]
+        print('{:>9} {:>7.1f}%'.format(n, 100.0 * np.count_nonzero(visible) / n) +
+              ''.join('{:>11.0f}'.format(rate) if rate else '{:>11}'.format('-') for rate in rates))
+        n *= 10
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
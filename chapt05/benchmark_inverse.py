@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+
+# Matrices inverted per second at growing batch sizes. The matrices are
+# model matrices (translation, rotation, non uniform scale), so the affine
+# path applies; the rigid path gets the same matrices without the scale.
+#
+#   math3d      m3dInvertMatrix44 of ../shared/math3d.py, one at a time
+#   linalg      numpy.linalg.inv on the whole batch
+#   general     m3dGeneralInverse44, the full cofactor expansion
+#   inverse     m3dInverse44, which takes the affine path for these
+#   rigid       m3dInverse44(rigid=True) on the unscaled matrices
+#   normal      m3dNormalMatrix into std140 mat3s
+#
+# usage: python benchmark_inverse.py [--max-n 1000000]
+
+import sys
+import time
+import argparse
+
+sys.path.append("./shared")
+sys.path.append("../shared")
+
+from sbmath import m3dQuaternion, m3dTRS44, m3dGeneralInverse44, m3dInverse44, m3dNormalMatrix
+from math3d import M3DMatrix44f, m3dInvertMatrix44
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+import numpy as np
+
+# math3d is not run past this many matrices
+LOOP_MAX = 10000
+MIN_SECONDS = 0.25
+
+
+def make_matrices(n):
+    rng = np.random.RandomState(0x13371337)
+    translation = rng.uniform(-100.0, 100.0, (n, 3))
+    rotation = m3dQuaternion(rng.uniform(0.0, 6.28, n), rng.randn(n, 3))
+    return m3dTRS44(translation, rotation, rng.uniform(0.5, 2.0, (n, 3))), m3dTRS44(translation, rotation, 1.0)
+
+
+def measure(invert, n):
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        invert()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_SECONDS:
+            return n * runs / elapsed
+
+
+def run_math3d(matrices):
+    sources = [M3DMatrix44f(*m.ravel()) for m in matrices]
+    dst = M3DMatrix44f()
+
+    def invert():
+        for src in sources:
+            m3dInvertMatrix44(dst, src)
+    return invert
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batched matrix inverses per second.')
+    parser.add_argument('--max-n', type=int, default=1000000)
+    args = parser.parse_args(argv)
+
+    names = ('math3d', 'linalg', 'general', 'inverse', 'rigid', 'normal')
+    print('{:>9}'.format('N') + ''.join('{:>12}'.format(name) for name in names))
+    n = 1
+    while n <= args.max_n:
+        model, rigid = make_matrices(n)
+        out = np.empty_like(model)
+        normal = np.empty((n, 3, 4), dtype=np.float32)
+        runs = [
+            run_math3d(model) if n <= LOOP_MAX else None,
+            lambda: np.linalg.inv(model),
+            lambda: m3dGeneralInverse44(model, out=out),
+            lambda: m3dInverse44(model, out=out),
+            lambda: m3dInverse44(rigid, out=out, rigid=True),
+            lambda: m3dNormalMatrix(model, out=normal),
+        ]
+        rates = [measure(invert, n) if invert else None for invert in runs]
+        print('{:>9}'.format(n) + ''.join('{:>12.0f}'.format(rate) if rate else '{:>12}'.format('-') for rate in rates))
+        n *= 10
+
+    model, rigid = make_matrices(1000)
+    reference = np.linalg.inv(model.astype(np.float64))
+    print('largest difference from linalg: general {:.2e}, inverse {:.2e}, rigid {:.2e}'.format(
+        np.abs(m3dGeneralInverse44(model) - reference).max(), np.abs(m3dInverse44(model) - reference).max(),
+        np.abs(m3dInverse44(rigid, rigid=True) - np.linalg.inv(rigid.astype(np.float64))).max()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
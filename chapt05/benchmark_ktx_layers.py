@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+
+# Load time of a big texture array, whole levels at a time on the GL thread
+# versus a task per layer on a thread pool. The test file is a LAYERS layer
+# half float array written big endian, so every layer has to be byte swapped
+# before GL can take it, the case where ktx_load does all the work in one
+# thread. Runs:
+#
+#   ktx_load     read, swap and upload every level on the GL thread
+#   load_ktx     AssetLoader: read and parse on the pool, one upload per level
+#   layers xN    AssetLoader.load_ktx_layers with N workers: each layer is
+#                swapped on the pool and uploaded as soon as it is done
+#
+# Every run ends with glFinish, and reports milliseconds and MB/s of file
+# data. The file is read once before timing, so all runs see a warm page
+# cache; with more cores the swaps of the layers run side by side.
+#
+# usage: python benchmark_ktx_layers.py [--layers 256] [--size 256] [texture.ktx]
+
+import sys
+import os
+import time
+import tempfile
+import argparse
+import contextlib
+import io
+
+sys.path.append("./shared")
+
+from ktxloader import KTXObject, ktx_read, KTX_HEADER_SIZE
+from ktxwriter import ktx_format_header, ktx_write
+from assetloader import AssetLoader
+
+try:
+    from OpenGL.GLUT import *
+    from OpenGL.GL import *
+    from OpenGL.GLU import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+import numpy as np
+
+LAYERS = 256
+SIZE = 256
+RUNS = 3
+
+
+# Writes a RGBA16F array and rewrites it in big endian order
+def make_array(filename, layers, size):
+    rng = np.random.RandomState(0x13371337)
+    h = ktx_format_header(GL_RGBA16F, size, size, layers=layers)
+    ktx_write(filename, h, [list(rng.rand(layers, size, size, 4).astype(np.float16))])
+
+    image = ktx_read(filename)
+    data = np.array(image.data)
+    data[12:KTX_HEADER_SIZE] = data[12:KTX_HEADER_SIZE].view('<u4').byteswap().view(np.uint8)
+    for lv in image.levels:
+        data[lv.offset - 4:lv.offset] = data[lv.offset - 4:lv.offset].view('<u4').byteswap().view(np.uint8)
+        data[lv.offset:lv.offset + lv.size] = data[lv.offset:lv.offset + lv.size].view('<u2').byteswap().view(np.uint8)
+    data.tofile(filename)
+
+
+def timed(load):
+    start = time.perf_counter()
+    # The loaders print what they find in every header
+    with contextlib.redirect_stdout(io.StringIO()):
+        tex = load()
+    glFinish()
+    elapsed = time.perf_counter() - start
+    glDeleteTextures(1, [tex])
+    return elapsed
+
+
+def report(name, times, megabytes):
+    best = min(times)
+    print('{:<12} {:>10.1f} {:>10.1f}'.format(name, best * 1000.0, megabytes / best))
+
+
+def run(filename):
+    megabytes = os.path.getsize(filename) / 1e6
+    with contextlib.redirect_stdout(io.StringIO()):
+        image = ktx_read(filename)
+    np.asarray(image.data).sum()
+    print('{}: {} layers of {}x{}, {:.1f} MB{}'.format(
+        os.path.basename(filename), max(image.h.arrayelements, 1), image.h.pixelwidth, image.h.pixelheight,
+        megabytes, ', byte swapped' if image.h.swapped else ''))
+    print('{:<12} {:>10} {:>10}'.format('loader', 'ms', 'MB/s'))
+
+    report('ktx_load', [timed(lambda: KTXObject().ktx_load(filename)) for _ in range(RUNS)], megabytes)
+
+    loader = AssetLoader()
+    report('load_ktx', [timed(lambda: loader.wait([loader.load_ktx(filename)])[0]) for _ in range(RUNS)], megabytes)
+    loader.shutdown()
+
+    for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+        loader = AssetLoader(max_workers=workers)
+        times = [timed(lambda: loader.wait([loader.load_ktx_layers(filename)])[0]) for _ in range(RUNS)]
+        report('layers x{}'.format(workers), times, megabytes)
+        loader.shutdown()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Load time of texture arrays with per-layer decoding.')
+    parser.add_argument('--layers', type=int, default=LAYERS)
+    parser.add_argument('--size', type=int, default=SIZE)
+    parser.add_argument('texture', nargs='?')
+    args = parser.parse_args()
+
+    glutInit()
+    glutInitDisplayMode(GLUT_RGBA | GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(512, 512)
+    glutCreateWindow('OpenGL SuperBible - KTX layer loading benchmark')
+
+    if args.texture:
+        run(args.texture)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'layers.ktx')
+            make_array(filename, args.layers, args.size)
+            run(filename)
@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+
+# Cold versus warm load times for SBM models going through the preprocessed
+# cache. For every model this times a plain load of the chunk stream, a cold
+# load that has to build the cache entry first and the median of a number of
+# warm loads served from the cache. The default model list is the one the
+# shadow mapping scene loads.
+#
+# usage: python benchmark_sbm_cache.py [model.sbm ...]
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+
+sys.path.append("./shared")
+
+from sbmloader import SBMObject
+
+try:
+    from OpenGL.GLUT import *
+    from OpenGL.GL import *
+    from OpenGL.GLU import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+import numpy as np
+
+WARM_RUNS = 20
+
+models = ["dragon.sbm", "sphere.sbm", "cube.sbm", "torus.sbm"]
+
+
+def timed_load(filename, cache_dir=None):
+    obj = SBMObject()
+    start = time.perf_counter()
+    obj.load(filename, cache_dir)
+    glFinish()
+    return time.perf_counter() - start
+
+
+def run():
+    cache_dir = tempfile.mkdtemp(prefix='sbmcache')
+
+    print('{:<20} {:>10} {:>10} {:>10} {:>10}'.format('model', 'size KB', 'plain ms', 'cold ms', 'warm ms'))
+
+    totals = np.zeros(3)
+    try:
+        for filename in models:
+            plain = timed_load(filename)
+            cold = timed_load(filename, cache_dir)
+            warm = np.median([timed_load(filename, cache_dir) for _ in range(WARM_RUNS)])
+            totals += (plain, cold, warm)
+
+            print('{:<20} {:>10.1f} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+                filename, os.path.getsize(filename) / 1024.0, plain * 1000.0, cold * 1000.0, warm * 1000.0))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print('{:<20} {:>10} {:>10.2f} {:>10.2f} {:>10.2f}'.format('total', '', *(totals * 1000.0)))
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        models = sys.argv[1:]
+
+    glutInit()
+    glutInitDisplayMode(GLUT_RGBA | GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(512, 512)
+    glutCreateWindow('OpenGL SuperBible - SBM cache benchmark')
+
+    run()
@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+
+# Compares indexed and non-indexed drawing of SBM models. Each model is loaded
+# once through SBMObject (indexed when it ships an INDX chunk) and once
+# expanded into plain vertex arrays, then both are drawn for a number of frames
+# while counting vertex shader invocations and timing every frame.
+#
+# usage: python benchmark_sbm_indexed.py [model.sbm ...]
+
+import sys
+import time
+import ctypes
+
+sys.path.append("./shared")
+
+from sbmloader import SBMObject, SB6M_CHUNKS, SB6M_INDEX_DTYPE, SB6M_VERTEX_ATTRIB_FLAG_NORMALIZED, \
+    sb6m_attrib_size, sb6m_attrib_stride, sb6m_payload
+
+try:
+    from OpenGL.GLUT import *
+    from OpenGL.GL import *
+    from OpenGL.GLU import *
+    from OpenGL.GL.ARB.pipeline_statistics_query import GL_VERTEX_SHADER_INVOCATIONS_ARB
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+import numpy as np
+
+FRAMES = 200
+INSTANCES = 16
+
+models = ["dragon.sbm", "ladybug.sbm"]
+
+
+vertex_shader_source = '''
+#version 450 core
+
+layout (location = 0) in vec4 position;
+
+void main(void)
+{
+    // Spread the instances out a little so they don't all land on the same pixels
+    vec4 offset = vec4(float(gl_InstanceID % 4) - 1.5, float(gl_InstanceID / 4) - 1.5, 0.0, 0.0);
+    gl_Position = vec4(position.xyz * 0.05, 1.0) + offset * 0.4;
+}
+'''
+
+fragment_shader_source = '''
+#version 450 core
+
+out vec4 color;
+
+void main(void)
+{
+    color = vec4(1.0);
+}
+'''
+
+
+def compile_program():
+    vs = glCreateShader(GL_VERTEX_SHADER)
+    glShaderSource(vs, vertex_shader_source)
+    glCompileShader(vs)
+
+    fs = glCreateShader(GL_FRAGMENT_SHADER)
+    glShaderSource(fs, fragment_shader_source)
+    glCompileShader(fs)
+
+    program = glCreateProgram()
+    glAttachShader(program, vs)
+    glAttachShader(program, fs)
+    glLinkProgram(program)
+    if not glGetProgramiv(program, GL_LINK_STATUS):
+        print( 'link error:' )
+        print( glGetProgramInfoLog(program) )
+
+    glDeleteShader(vs)
+    glDeleteShader(fs)
+    return program
+
+
+# Build a VAO holding one copy of every vertex each index refers to, so the
+# mesh can be drawn with glDrawArrays and gets no post-transform cache reuse
+def load_unindexed(filename):
+    data = np.memmap(filename, dtype=np.uint8, mode='r')
+    chunks = SB6M_CHUNKS(data)
+    data = sb6m_payload(data, chunks)
+
+    vertex_data_chunk = chunks.vertex_data_chunk
+    index_data_chunk = chunks.index_data_chunk
+
+    start = vertex_data_chunk.data_offset
+    vertex_data = data[start:start + vertex_data_chunk.data_size]
+
+    if index_data_chunk:
+        start = index_data_chunk.index_data_offset
+        index_dtype = SB6M_INDEX_DTYPE[index_data_chunk.index_type]
+        indices = data[start:start + index_data_chunk.index_count * index_dtype.itemsize].view(index_dtype).astype(np.int64)
+    else:
+        indices = np.arange(vertex_data_chunk.total_vertices, dtype=np.int64)
+
+    vao = glGenVertexArrays(1)
+    glBindVertexArray(vao)
+
+    for attrib_i, attrib in enumerate(chunks.vertex_attrib_chunk.attrib_data):
+        size = sb6m_attrib_size(attrib)
+        offsets = attrib.data_offset + indices * sb6m_attrib_stride(attrib)
+        expanded = np.ascontiguousarray(vertex_data[offsets[:, None] + np.arange(size)])
+
+        buf = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, buf)
+        glBufferData(GL_ARRAY_BUFFER, expanded.nbytes, expanded, GL_STATIC_DRAW)
+        glVertexAttribPointer(attrib_i, attrib.size, attrib.type,
+                              GL_TRUE if (attrib.flags & SB6M_VERTEX_ATTRIB_FLAG_NORMALIZED) != 0 else GL_FALSE,
+                              0, None)
+        glEnableVertexAttribArray(attrib_i)
+
+    return vao, len(indices)
+
+
+def measure(draw):
+    query_invocations, query_time = glGenQueries(2)
+
+    frame_times = []
+    gpu_times = []
+    invocations = 0
+
+    for frame in range(FRAMES):
+        start = time.perf_counter()
+
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+
+        glBeginQuery(GL_VERTEX_SHADER_INVOCATIONS_ARB, query_invocations)
+        glBeginQuery(GL_TIME_ELAPSED, query_time)
+        draw()
+        glEndQuery(GL_TIME_ELAPSED)
+        glEndQuery(GL_VERTEX_SHADER_INVOCATIONS_ARB)
+
+        glFinish()
+        frame_times.append(time.perf_counter() - start)
+
+        invocations += int(glGetQueryObjectui64v(query_invocations, GL_QUERY_RESULT))
+        gpu_times.append(int(glGetQueryObjectui64v(query_time, GL_QUERY_RESULT)) * 1e-9)
+
+    glDeleteQueries(2, [query_invocations, query_time])
+
+    return invocations // FRAMES, np.median(frame_times), np.median(gpu_times)
+
+
+def run():
+    program = compile_program()
+    glUseProgram(program)
+    glEnable(GL_DEPTH_TEST)
+
+    print('{:<16} {:<10} {:>10} {:>14} {:>12} {:>12}'.format(
+        'model', 'mode', 'vertices', 'vs invocations', 'frame ms', 'gpu ms'))
+
+    for filename in models:
+        indexed = SBMObject()
+        indexed.load(filename)
+        unindexed_vao, unindexed_count = load_unindexed(filename)
+
+        def draw_indexed():
+            indexed.render(INSTANCES)
+
+        def draw_unindexed():
+            glBindVertexArray(unindexed_vao)
+            glDrawArraysInstancedBaseInstance(GL_TRIANGLES, 0, unindexed_count, INSTANCES, 0)
+
+        mode = 'indexed' if indexed.index_type != GL_NONE else 'arrays'
+
+        for name, draw in ((mode, draw_indexed), ('unindexed', draw_unindexed)):
+            invocations, frame_time, gpu_time = measure(draw)
+            print('{:<16} {:<10} {:>10} {:>14} {:>12.3f} {:>12.3f}'.format(
+                filename, name, unindexed_count * INSTANCES, invocations, frame_time * 1000.0, gpu_time * 1000.0))
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        models = sys.argv[1:]
+
+    glutInit()
+    glutInitDisplayMode(GLUT_RGBA | GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(512, 512)
+    glutCreateWindow('OpenGL SuperBible - SBM indexed drawing benchmark')
+
+    run()
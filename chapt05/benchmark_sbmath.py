@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+
+# Matrices per second for the spinning cube transforms of Figure 5.2 at
+# growing object counts, computed one object at a time with the ctypes m3d
+# functions versus all objects at once with the batched (N, 4, 4) ones.
+# Every object gets W * T * RY * RX: its own offset W, the shared T, and
+# rotations whose angles differ per object. The batched version writes into
+# arrays allocated once up front, as a frame loop would.
+#
+# usage: python benchmark_sbmath.py [--max-n 1000000]
+
+import sys
+import time
+import argparse
+from math import sin, cos
+
+sys.path.append("./shared")
+
+from sbmath import identityMatrix, m3dDegToRad, m3dTranslateMatrix44, m3dRotationMatrix44, m3dMultiply, \
+    m3dTranslation44, m3dRotation44, m3dMultiply44
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+import numpy as np
+
+# The ctypes loop is not run past this many objects
+LOOP_MAX = 10000
+# Each measurement repeats until it has taken this long
+MIN_SECONDS = 0.25
+
+
+def loop_frame(n, t):
+    out = []
+    for i in range(n):
+        f = i + t * 0.3
+
+        T = (GLfloat * 16)(*identityMatrix)
+        m3dTranslateMatrix44(T, 0, 0, -4)
+
+        W = (GLfloat * 16)(*identityMatrix)
+        m3dTranslateMatrix44(W, sin(2.1 * f) * 0.5, cos(1.7 * f) * 0.5, sin(1.3 * f) * cos(1.5 * f) * 2.0)
+
+        RX = (GLfloat * 16)(*identityMatrix)
+        m3dRotationMatrix44(RX, f * m3dDegToRad(45.0), 0.0, 1.0, 0.0)
+
+        RY = (GLfloat * 16)(*identityMatrix)
+        m3dRotationMatrix44(RY, f * m3dDegToRad(81.0), 1.0, 0.0, 0.0)
+
+        out.append(m3dMultiply(W, m3dMultiply(T, m3dMultiply(RY, RX))))
+    return out
+
+
+class BatchFrame:
+    def __init__(self, n):
+        self.i = np.arange(n, dtype=np.float32)
+        self.offsets = np.empty((n, 3), dtype=np.float32)
+        self.T = m3dTranslation44([0.0, 0.0, -4.0])
+        self.W = np.empty((n, 4, 4), dtype=np.float32)
+        self.RX = np.empty((n, 4, 4), dtype=np.float32)
+        self.RY = np.empty((n, 4, 4), dtype=np.float32)
+        self.mv = np.empty((n, 4, 4), dtype=np.float32)
+
+    def __call__(self, n, t):
+        f = self.i + np.float32(t * 0.3)
+        self.offsets[:, 0] = np.sin(2.1 * f) * 0.5
+        self.offsets[:, 1] = np.cos(1.7 * f) * 0.5
+        self.offsets[:, 2] = np.sin(1.3 * f) * np.cos(1.5 * f) * 2.0
+        m3dTranslation44(self.offsets, out=self.W)
+        m3dRotation44(f * np.float32(m3dDegToRad(45.0)), [0.0, 1.0, 0.0], out=self.RX)
+        m3dRotation44(f * np.float32(m3dDegToRad(81.0)), [1.0, 0.0, 0.0], out=self.RY)
+        m3dMultiply44(self.RY, self.RX, out=self.mv)
+        m3dMultiply44(self.T, self.mv, out=self.mv)
+        m3dMultiply44(self.W, self.mv, out=self.mv)
+        return self.mv
+
+
+def measure(frame, n):
+    frames = 0
+    start = time.perf_counter()
+    while True:
+        frame(n, frames * 0.016)
+        frames += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_SECONDS:
+            return n * frames / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Matrices per second, ctypes m3d functions versus batched sbmath.')
+    parser.add_argument('--max-n', type=int, default=1000000)
+    args = parser.parse_args(argv)
+
+    # Both ways give the same matrices
+    check = BatchFrame(24)(24, 1.0)
+    reference = np.array([list(m) for m in loop_frame(24, 1.0)], dtype=np.float32).reshape(24, 4, 4)
+    print('largest difference over 24 objects: {:.2e}'.format(np.abs(check - reference).max()))
+
+    print('{:>9} {:>16} {:>16} {:>9}'.format('N', 'm3d matrices/s', 'batch matrices/s', 'speedup'))
+    n = 1
+    while n <= args.max_n:
+        batched = measure(BatchFrame(n), n)
+        looped = measure(loop_frame, n) if n <= LOOP_MAX else None
+        print('{:>9} {:>16} {:>16.0f} {:>9}'.format(
+            n, '{:.0f}'.format(looped) if looped else '-', batched,
+            '{:.1f}x'.format(batched / looped) if looped else '-'))
+        n *= 10
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+
+# Texture binds and draw throughput of a scene with many materials, drawn
+# from separate 2D textures and from the arrays ktxpack makes of them. Every
+# material is a small textured quad on a grid. Three ways to draw it:
+#
+#   textures   bind the material's texture, set the object, draw: a bind and
+#              a draw per material
+#   arrays     bind each array once and draw its materials with the layer
+#              in a uniform: a bind per array, a draw per material
+#   instanced  bind each array once and draw all of its materials with one
+#              instanced draw, objects and layers read from a buffer
+#
+# The materials are made up (MATERIAL_SIZES cycles through the sizes, so the
+# packer makes one array per size) unless KTX or PNG files are given. The
+# report gives binds and draws per frame, the CPU time to submit a frame, the
+# whole frame time and materials drawn per second.
+#
+# usage: python benchmark_texture_arrays.py [--materials 512] [texture.ktx|texture.png ...]
+
+import sys
+import os
+import time
+import tempfile
+import argparse
+
+sys.path.append("./shared")
+
+from ktxloader import KTXObject
+from ktxwriter import ktx_make_header, ktx_write
+from ktxmipmap import mip_chain
+from ktxpack import pack, load_texture_arrays
+
+try:
+    from OpenGL.GLUT import *
+    from OpenGL.GL import *
+    from OpenGL.GLU import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+import numpy as np
+
+FRAMES = 50
+MATERIALS = 512
+MATERIAL_SIZES = (64, 128)
+
+
+vertex_shader_source = '''
+#version 450 core
+
+layout (location = 0) uniform ivec2 object;
+layout (location = 1) uniform int grid;
+layout (location = 2) uniform int base;
+
+// Object and layer of every instance, from base on, when base >= 0
+layout (std430, binding = 0) readonly buffer instances
+{
+    ivec2 instance[];
+};
+
+out vec2 uv;
+flat out int layer;
+
+void main(void)
+{
+    const vec2 corners[4] = vec2[4](vec2(0.0, 0.0), vec2(1.0, 0.0), vec2(0.0, 1.0), vec2(1.0, 1.0));
+    ivec2 o = base < 0 ? object : instance[base + gl_InstanceID];
+    vec2 cell = vec2(o.x % grid, o.x / grid);
+    uv = corners[gl_VertexID];
+    layer = o.y;
+    gl_Position = vec4((cell + uv) / float(grid) * 2.0 - 1.0, 0.0, 1.0);
+}
+'''
+
+texture_fragment_shader_source = '''
+#version 450 core
+
+layout (binding = 0) uniform sampler2D tex;
+
+in vec2 uv;
+flat in int layer;
+out vec4 color;
+
+void main(void)
+{
+    color = texture(tex, uv);
+}
+'''
+
+array_fragment_shader_source = '''
+#version 450 core
+
+layout (binding = 0) uniform sampler2DArray tex;
+
+in vec2 uv;
+flat in int layer;
+out vec4 color;
+
+void main(void)
+{
+    color = texture(tex, vec3(uv, float(layer)));
+}
+'''
+
+
+def compile_program(fragment_shader_source):
+    vs = glCreateShader(GL_VERTEX_SHADER)
+    glShaderSource(vs, vertex_shader_source)
+    glCompileShader(vs)
+
+    fs = glCreateShader(GL_FRAGMENT_SHADER)
+    glShaderSource(fs, fragment_shader_source)
+    glCompileShader(fs)
+
+    program = glCreateProgram()
+    glAttachShader(program, vs)
+    glAttachShader(program, fs)
+    glLinkProgram(program)
+    if not glGetProgramiv(program, GL_LINK_STATUS):
+        print( 'link error:' )
+        print( glGetProgramInfoLog(program) )
+
+    glDeleteShader(vs)
+    glDeleteShader(fs)
+    return program
+
+
+# Writes count small RGBA8 textures with mip chains; returns their file names
+def make_materials(directory, count):
+    rng = np.random.RandomState(0x13371337)
+    filenames = []
+    for i in range(count):
+        size = MATERIAL_SIZES[i % len(MATERIAL_SIZES)]
+        y, x = np.mgrid[:size, :size]
+        checker = ((x // 8 + y // 8) % 2)[..., None]
+        colour = rng.randint(64, 256, 4)
+        image = np.zeros((1, size, size, 4), dtype=np.uint8)
+        image[0] = np.where(checker, colour, colour // 2)
+        image[0, ..., 3] = 255
+        chain = mip_chain(image)
+        h = ktx_make_header(GL_UNSIGNED_BYTE, GL_RGBA, GL_RGBA8, size, size, miplevels=len(chain))
+        filename = os.path.join(directory, 'material{:04}.ktx'.format(i))
+        ktx_write(filename, h, [[level] for level in chain])
+        filenames.append(filename)
+    return filenames
+
+
+def frame(draw):
+    start = time.perf_counter()
+    glClear(GL_COLOR_BUFFER_BIT)
+    binds, draws = draw()
+    submitted = time.perf_counter()
+    glFinish()
+    return binds, draws, submitted - start, time.perf_counter() - start
+
+
+def report(name, draw, objects):
+    frame(draw)
+    times = [frame(draw) for _ in range(FRAMES)]
+    binds, draws = times[0][:2]
+    submit = np.median([t[2] for t in times])
+    whole = np.median([t[3] for t in times])
+    print('{:<10} {:>7} {:>7} {:>10.2f} {:>10.2f} {:>14.0f}'.format(
+        name, binds, draws, submit * 1000.0, whole * 1000.0, objects / whole))
+
+
+def run(filenames, directory):
+    names = [os.path.splitext(os.path.basename(filename))[0] for filename in filenames]
+    objects = len(names)
+    grid = int(np.ceil(np.sqrt(objects)))
+
+    glBindVertexArray(glGenVertexArrays(1))
+    texture_program = compile_program(texture_fragment_shader_source)
+    array_program = compile_program(array_fragment_shader_source)
+
+    textures = [KTXObject().ktx_load(filename) for filename in filenames]
+    table = pack(filenames, os.path.join(directory, 'packed'))
+    arrays, lookup = load_texture_arrays(os.path.join(directory, 'packed', 'textures.json'))
+
+    # Objects sorted by array, for the array passes
+    by_array = {}
+    for i, name in enumerate(names):
+        texture, layer = lookup[name]
+        by_array.setdefault(texture, []).append((i, layer))
+
+    instances = np.array([entry for texture in arrays for entry in by_array[texture]], dtype=np.int32)
+    bases = np.cumsum([0] + [len(by_array[texture]) for texture in arrays])
+    buffer = glGenBuffers(1)
+    glBindBuffer(GL_SHADER_STORAGE_BUFFER, buffer)
+    glBufferData(GL_SHADER_STORAGE_BUFFER, instances.nbytes, instances, GL_STATIC_DRAW)
+    glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 0, buffer)
+
+    def draw_textures():
+        glUseProgram(texture_program)
+        glUniform1i(1, grid)
+        glUniform1i(2, -1)
+        for i, texture in enumerate(textures):
+            glBindTexture(GL_TEXTURE_2D, texture)
+            glUniform2i(0, i, 0)
+            glDrawArrays(GL_TRIANGLE_STRIP, 0, 4)
+        return len(textures), len(textures)
+
+    def draw_arrays():
+        glUseProgram(array_program)
+        glUniform1i(1, grid)
+        glUniform1i(2, -1)
+        draws = 0
+        for texture in arrays:
+            glBindTexture(GL_TEXTURE_2D_ARRAY, texture)
+            for i, layer in by_array[texture]:
+                glUniform2i(0, i, layer)
+                glDrawArrays(GL_TRIANGLE_STRIP, 0, 4)
+                draws += 1
+        return len(arrays), draws
+
+    def draw_instanced():
+        glUseProgram(array_program)
+        glUniform1i(1, grid)
+        for texture, base in zip(arrays, bases):
+            glBindTexture(GL_TEXTURE_2D_ARRAY, texture)
+            glUniform1i(2, int(base))
+            glDrawArraysInstanced(GL_TRIANGLE_STRIP, 0, 4, len(by_array[texture]))
+        return len(arrays), len(arrays)
+
+    print('{} materials packed into {} arrays'.format(objects, len(table['arrays'])))
+    print('{:<10} {:>7} {:>7} {:>10} {:>10} {:>14}'.format('draw', 'binds', 'draws', 'submit ms', 'frame ms', 'materials/s'))
+    report('textures', draw_textures, objects)
+    report('arrays', draw_arrays, objects)
+    report('instanced', draw_instanced, objects)
+
+    glDeleteTextures(len(textures), textures)
+    glDeleteTextures(len(arrays), arrays)
+    glDeleteBuffers(1, [buffer])
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Texture binds and draw throughput with and without texture arrays.')
+    parser.add_argument('--materials', type=int, default=MATERIALS, help='number of made up materials')
+    parser.add_argument('textures', nargs='*')
+    args = parser.parse_args()
+
+    glutInit()
+    glutInitDisplayMode(GLUT_RGBA | GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(512, 512)
+    glutCreateWindow('OpenGL SuperBible - texture array benchmark')
+
+    with tempfile.TemporaryDirectory() as directory:
+        filenames = args.textures or make_materials(directory, args.materials)
+        run(filenames, directory)
@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+
+# Frame times while textures load, with ktx_load on the frame loop versus
+# TextureStreamer. Every frame draws a textured full screen quad and waits
+# for it to finish. The scene first runs idle to get a baseline, then loads
+# the texture set COPIES times over: once with ktx_load from inside a single
+# frame, the way the samples do it, and once through the streamer with a
+# per-frame byte budget. The report gives upload MB/s and the worst frame of
+# each run against the idle median.
+#
+# usage: python benchmark_texture_streaming.py [--budget-mb 8] [texture.ktx ...]
+
+import sys
+import os
+import time
+import argparse
+
+sys.path.append("./shared")
+
+from ktxloader import KTXObject
+from texturestreamer import TextureStreamer, STREAM_SLOT_SIZE
+
+try:
+    from OpenGL.GLUT import *
+    from OpenGL.GL import *
+    from OpenGL.GLU import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+import numpy as np
+
+IDLE_FRAMES = 60
+COPIES = 8
+
+textures = ["brick.ktx", "ceiling.ktx", "floor.ktx", "rightarrows.ktx"]
+
+
+vertex_shader_source = '''
+#version 450 core
+
+out vec2 uv;
+
+void main(void)
+{
+    const vec2 corners[4] = vec2[4](vec2(-1.0, -1.0), vec2(1.0, -1.0), vec2(-1.0, 1.0), vec2(1.0, 1.0));
+    uv = corners[gl_VertexID] * 0.5 + 0.5;
+    gl_Position = vec4(corners[gl_VertexID], 0.0, 1.0);
+}
+'''
+
+fragment_shader_source = '''
+#version 450 core
+
+layout (binding = 0) uniform sampler2D tex;
+
+in vec2 uv;
+out vec4 color;
+
+void main(void)
+{
+    color = texture(tex, uv * 4.0);
+}
+'''
+
+
+def compile_program():
+    vs = glCreateShader(GL_VERTEX_SHADER)
+    glShaderSource(vs, vertex_shader_source)
+    glCompileShader(vs)
+
+    fs = glCreateShader(GL_FRAGMENT_SHADER)
+    glShaderSource(fs, fragment_shader_source)
+    glCompileShader(fs)
+
+    program = glCreateProgram()
+    glAttachShader(program, vs)
+    glAttachShader(program, fs)
+    glLinkProgram(program)
+    if not glGetProgramiv(program, GL_LINK_STATUS):
+        print( 'link error:' )
+        print( glGetProgramInfoLog(program) )
+
+    glDeleteShader(vs)
+    glDeleteShader(fs)
+    return program
+
+
+def frame(tex, work=None):
+    start = time.perf_counter()
+    if work is not None:
+        work()
+    glClear(GL_COLOR_BUFFER_BIT)
+    glBindTexture(GL_TEXTURE_2D, tex)
+    glDrawArrays(GL_TRIANGLE_STRIP, 0, 4)
+    glFinish()
+    return time.perf_counter() - start
+
+
+def report(name, frame_times, idle, megabytes, seconds):
+    frame_times = np.array(frame_times)
+    print('{:<12} {:>8} {:>10.2f} {:>10.2f} {:>12.2f} {:>10.1f}'.format(
+        name, len(frame_times), np.median(frame_times) * 1000.0, frame_times.max() * 1000.0,
+        (frame_times.max() - idle) * 1000.0, megabytes / max(seconds, 1e-9)))
+
+
+def run(budget):
+    program = compile_program()
+    glUseProgram(program)
+    glBindVertexArray(glGenVertexArrays(1))
+
+    placeholder = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D, placeholder)
+    glTexStorage2D(GL_TEXTURE_2D, 1, GL_RGBA8, 1, 1)
+
+    files = textures * COPIES
+    idle = np.median([frame(placeholder) for _ in range(IDLE_FRAMES)])
+
+    print('{:<12} {:>8} {:>10} {:>10} {:>12} {:>10}'.format('loader', 'frames', 'median ms', 'worst ms', 'worst-idle', 'MB/s'))
+    report('idle', [idle], idle, 0.0, 1.0)
+
+    # Everything from inside one frame, as the samples load textures
+    loaded = []
+    def load_all():
+        for filename in files:
+            loaded.append(KTXObject().ktx_load(filename))
+    megabytes = sum(os.path.getsize(filename) for filename in files) / 1e6
+    start = time.perf_counter()
+    times = [frame(placeholder, load_all)]
+    report('ktx_load', times, idle, megabytes, time.perf_counter() - start)
+    glDeleteTextures(len(loaded), loaded)
+
+    # A slot always goes up whole, so none may be larger than the budget
+    streamer = TextureStreamer(slot_size=min(STREAM_SLOT_SIZE, budget), frame_budget=budget)
+    handles = [streamer.load(filename) for filename in files]
+
+    stream_times = []
+    shown = placeholder
+    while not all(handle.done() for handle in handles):
+        stream_times.append(frame(shown, streamer.pump))
+        done = [handle for handle in handles if handle.done() and handle.error is None]
+        if done:
+            shown = done[-1].result
+    stats = streamer.stats
+    report('streamer', stream_times, idle, stats.bytes / 1e6, stats.last_done - stats.first_request)
+    print(stats)
+
+    streamer.shutdown()
+    glDeleteTextures(len(handles), [handle.result for handle in handles if handle.result])
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Frame times of synchronous and streamed texture loads.')
+    parser.add_argument('--budget-mb', type=float, default=8.0, help='streamer upload budget per frame')
+    parser.add_argument('textures', nargs='*')
+    args = parser.parse_args()
+    if args.textures:
+        textures = args.textures
+
+    glutInit()
+    glutInitDisplayMode(GLUT_RGBA | GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(512, 512)
+    glutCreateWindow('OpenGL SuperBible - texture streaming benchmark')
+
+    run(int(args.budget_mb * (1 << 20)))
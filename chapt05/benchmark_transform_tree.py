@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+
+# Per frame cost of keeping the world matrices of a big scene graph in an
+# SSBO. The scene is GROUPS groups of PARTS parts with PIECES pieces each, a
+# tree of three levels like a field of machines with moving arms. Every
+# frame some of it moves, and TransformTree.update() plus upload() bring the
+# buffer up to date:
+#
+#   everything     every node flagged, as a scene without dirty tracking
+#                  rebuilds and uploads every frame
+#   pieces N%      N% of the leaves move: only those are recomputed
+#   groups N%      N% of the groups move: their whole subtrees are
+#                  recomputed
+#   still          nothing moves
+#
+# Each run reports the world matrices recomputed and the MB uploaded per
+# frame, and the frame time with glFinish.
+#
+# usage: python benchmark_transform_tree.py [--groups 1000] [--parts 10] [--pieces 10]
+
+import sys
+import time
+import argparse
+
+sys.path.append("./shared")
+
+from sbmath import m3dQuaternion
+from transformtree import TransformTree
+
+try:
+    from OpenGL.GLUT import *
+    from OpenGL.GL import *
+    from OpenGL.GLU import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+import numpy as np
+
+GROUPS = 1000
+PARTS = 10
+PIECES = 10
+FRAMES = 50
+
+
+def make_scene(groups, parts, pieces):
+    rng = np.random.RandomState(0x13371337)
+    tree = TransformTree()
+    roots = tree.add_nodes(np.full(groups, -1), translations=rng.uniform(-100.0, 100.0, (groups, 3)))
+    arms = tree.add_nodes(np.repeat(roots, parts), translations=rng.uniform(-2.0, 2.0, (groups * parts, 3)))
+    leaves = tree.add_nodes(np.repeat(arms, pieces), translations=rng.uniform(-0.5, 0.5, (groups * parts * pieces, 3)),
+                            scales=rng.uniform(0.5, 1.5, (groups * parts * pieces, 3)))
+    tree.update()
+    tree.upload()
+    return tree, roots, leaves
+
+
+def frame(tree, move, t):
+    start = time.perf_counter()
+    before = tree.stats.worlds, tree.stats.uploaded_bytes
+    move(t)
+    tree.update()
+    tree.upload()
+    glFinish()
+    elapsed = time.perf_counter() - start
+    return elapsed, tree.stats.worlds - before[0], tree.stats.uploaded_bytes - before[1]
+
+
+def report(name, tree, move):
+    times = [frame(tree, move, i * 0.016) for i in range(FRAMES)]
+    elapsed = np.median([t[0] for t in times])
+    worlds = np.mean([t[1] for t in times])
+    megabytes = np.mean([t[2] for t in times]) / 1e6
+    print('{:<14} {:>10.0f} {:>10.2f} {:>10.2f}'.format(name, worlds, megabytes, elapsed * 1000.0))
+
+
+def run(groups, parts, pieces):
+    tree, roots, leaves = make_scene(groups, parts, pieces)
+    rng = np.random.RandomState(7)
+    every = np.arange(tree.count)
+    axis = np.array([0.0, 1.0, 0.0], dtype=np.float32)
+
+    def spin(nodes):
+        def move(t):
+            tree.set_rotation(nodes, m3dQuaternion(t + nodes * 0.01, axis))
+        return move
+
+    print('{} nodes in {} levels'.format(tree.count, 3))
+    print('{:<14} {:>10} {:>10} {:>10}'.format('moving', 'matrices', 'MB', 'frame ms'))
+    report('everything', tree, spin(every))
+    for percent in (10, 1):
+        picked = np.sort(rng.choice(leaves, max(leaves.size * percent // 100, 1), replace=False))
+        report('pieces {}%'.format(percent), tree, spin(picked))
+    for percent in (10, 1):
+        picked = np.sort(rng.choice(roots, max(roots.size * percent // 100, 1), replace=False))
+        report('groups {}%'.format(percent), tree, spin(picked))
+    report('still', tree, lambda t: None)
+    print(tree.stats)
+    tree.delete()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Scene graph update and upload cost with dirty tracking.')
+    parser.add_argument('--groups', type=int, default=GROUPS)
+    parser.add_argument('--parts', type=int, default=PARTS)
+    parser.add_argument('--pieces', type=int, default=PIECES)
+    args = parser.parse_args()
+
+    glutInit()
+    glutInitDisplayMode(GLUT_RGBA | GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(512, 512)
+    glutCreateWindow('OpenGL SuperBible - transform tree benchmark')
+
+    run(args.groups, args.parts, args.pieces)
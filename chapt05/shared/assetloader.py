@@ -0,0 +1,265 @@
+#!/usr/bin/python3
+
+# Concurrent asset loading.
+#
+# SBM and KTX files are read and parsed on a thread pool. Every file that has
+# been parsed queues its GL upload, and the uploads only ever run on the
+# thread that calls pump() or wait(), which has to be the one owning the GL
+# context. A scene starts all of its loads up front, does any other setup it
+# has (compiling shaders, creating framebuffers), then waits on the handles:
+# disk I/O and parsing overlap each other and the GL work, so the time to the
+# first frame is roughly that of the slowest single asset.
+#
+#   loader = AssetLoader()
+#   model = loader.load_sbm("dragon.sbm", myobject)
+#   texture = loader.load_ktx("pattern1.ktx")
+#   load_shaders()
+#   loader.wait()
+#   tex_dragon = texture.result
+#
+# load_ktx_layers splits big textures further: every layer, face and 3D
+# slice is paged in and byte swapped as its own task on the pool, and goes up
+# to GL as soon as it is ready, while the rest are still being decoded. If
+# one of them fails the rest are dropped and the texture, unless the caller
+# passed it in, is deleted.
+
+import sys
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+from sbmloader import SBMObject, sbm_read
+from ktxloader import KTXObject, ktx_read, ktx_storage, ktx_native, ktx_slices, ktx_slice_data, ktx_upload_slice
+
+# Touch one byte per page of a mapped array so the worker thread, not the GL
+# thread, is the one that waits for the disk
+PAGE_SIZE = 4096
+
+def prefetch(array):
+    if array is not None and array.size:
+        array.reshape(-1).view(np.uint8)[::PAGE_SIZE].sum()
+
+
+class KTXLayerLoad:
+    # One load_ktx_layers call, shared by its tasks
+    def __init__(self, tex):
+        self.tex = tex
+        self.created = False
+        self.failed = False
+        self.image = None
+        self.remaining = 0
+        self.lock = threading.Lock()
+
+    # GL thread: names the texture and allocates every level
+    def storage(self, image):
+        if self.tex == 0:
+            self.tex = glGenTextures(1)
+            self.created = True
+        glBindTexture(image.target, self.tex)
+        ktx_storage(image.h, image.target)
+        return self.tex
+
+    # Pool: pages one slice in and swaps its bytes if the file needs it
+    def decode(self, s):
+        pixels = ktx_native(self.image.h, ktx_slice_data(self.image, s))
+        prefetch(pixels)
+        return s, pixels
+
+    # GL thread
+    def upload(self, decoded):
+        s, pixels = decoded
+        glBindTexture(self.image.target, self.tex)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, self.image.alignment)
+        ktx_upload_slice(self.image, s, pixels)
+        return self.tex
+
+    def finish(self, decoded):
+        self.upload(decoded)
+        if self.image.h.miplevels == 1:
+            glGenerateMipmap(self.image.target)
+        return self.tex
+
+    # GL thread, once a slice has failed: slices not decoded yet are skipped
+    # and the texture goes, unless the caller passed it in
+    def discard(self):
+        self.failed = True
+        if self.created:
+            glDeleteTextures(1, [self.tex])
+            self.tex = 0
+            self.created = False
+
+
+class AssetHandle:
+    # result is the SBMObject or texture name once the upload has run
+    def __init__(self, filename):
+        self.filename = filename
+        self.result = None
+        self.error = None
+        # Called on the GL thread if the load fails
+        self.discard = None
+        self.uploaded = threading.Event()
+
+    def done(self):
+        return self.uploaded.is_set()
+
+    def get(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class AssetLoader:
+
+    def __init__(self, max_workers=None):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='assetloader')
+        self.uploads = queue.Queue()
+        self.pending = []
+
+    def load_sbm(self, filename, obj=None, cache_dir=None):
+        if obj is None:
+            obj = SBMObject()
+
+        def read():
+            mesh = sbm_read(filename, cache_dir)
+            if mesh:
+                prefetch(mesh.buffer_data)
+                prefetch(mesh.index_data)
+            return mesh
+
+        def upload(mesh):
+            if mesh:
+                obj.upload(mesh)
+            return obj
+
+        return self.submit(filename, read, upload)
+
+    def load_ktx(self, filename, tex=0):
+        ktxobject = KTXObject()
+
+        # ktx_read maps the file; touch its pages here so the upload does not
+        # fault them in on the GL thread
+        def read():
+            image = ktx_read(filename)
+            prefetch(image.data)
+            return image
+
+        def upload(image):
+            return ktxobject.ktx_upload(image, tex)
+
+        return self.submit(filename, read, upload)
+
+    # Like load_ktx, with a task per layer, face or 3D slice. Texture storage
+    # is created once the header is read; each slice is decoded on the pool
+    # and uploaded on the GL thread as soon as it is done. The handle is done
+    # after the last slice
+    def load_ktx_layers(self, filename, tex=0):
+        handle = AssetHandle(filename)
+        self.pending.append(handle)
+        load = KTXLayerLoad(tex)
+        handle.discard = load.discard
+
+        def work_slice(s):
+            if load.failed:
+                return
+            try:
+                decoded = load.decode(s)
+            except BaseException as e:
+                load.failed = True
+                self.uploads.put((handle, None, None, e, True))
+                return
+            # The last slice queued is the one that finishes the handle
+            with load.lock:
+                load.remaining -= 1
+                last = load.remaining == 0
+                self.uploads.put((handle, load.finish if last else load.upload, decoded, None, last))
+
+        def work():
+            try:
+                load.image = ktx_read(filename)
+                slices = ktx_slices(load.image)
+            except BaseException as e:
+                self.uploads.put((handle, None, None, e, True))
+                return
+            load.remaining = len(slices)
+            self.uploads.put((handle, load.storage, load.image, None, False))
+            for s in slices:
+                self.pool.submit(work_slice, s)
+
+        self.pool.submit(work)
+        return handle
+
+    # read runs on the pool, upload(read()) on the GL thread
+    def submit(self, filename, read, upload):
+        handle = AssetHandle(filename)
+        self.pending.append(handle)
+
+        def work():
+            try:
+                self.uploads.put((handle, upload, read(), None, True))
+            except BaseException as e:
+                self.uploads.put((handle, None, None, e, True))
+
+        self.pool.submit(work)
+        return handle
+
+    # Runs one queued upload. Only the last upload of a handle, or an error,
+    # finishes it; uploads for a handle that already failed are dropped
+    def run_upload(self, item):
+        handle, upload, parsed, error, last = item
+        if handle.done():
+            return
+        if error is None:
+            try:
+                handle.result = upload(parsed)
+            except BaseException as e:
+                error = e
+        if error is not None:
+            print("error loading {}: {}".format(handle.filename, error))
+            handle.error = error
+            handle.result = None
+            if handle.discard is not None:
+                handle.discard()
+            last = True
+        if last:
+            handle.uploaded.set()
+            self.pending = [h for h in self.pending if not h.done()]
+
+    # Runs the uploads that are ready without blocking; GL thread only.
+    # max_uploads limits how many go in one call so a frame loop can spread
+    # them out. Returns the number of uploads run.
+    def pump(self, max_uploads=None):
+        count = 0
+        while max_uploads is None or count < max_uploads:
+            try:
+                item = self.uploads.get_nowait()
+            except queue.Empty:
+                break
+            self.run_upload(item)
+            count += 1
+        return count
+
+    # Blocks until the given handles (default: everything submitted so far)
+    # are uploaded, running uploads as they arrive; GL thread only
+    def wait(self, handles=None):
+        if handles is None:
+            handles = list(self.pending)
+        for handle in handles:
+            while not handle.done():
+                self.run_upload(self.uploads.get())
+        for handle in handles:
+            handle.get()
+        return [handle.result for handle in handles]
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+        self.pump()
@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+
+# View frustum culling of whole arrays of bounding spheres and boxes.
+#
+# frustum_planes() takes the six planes out of a view-projection matrix
+# (sbmath layout, m3dMultiply44(proj, view)); each plane is a, b, c, d with
+# a unit normal pointing into the frustum, so a * x + b * y + c * z + d is
+# the signed distance of a point. cull_spheres() and cull_aabbs() test N
+# bounds against all six planes in one NumPy pass per plane and return a
+# mask of the ones that may be visible. Bounds that straddle a plane count
+# as visible, and a few near the corners of the frustum pass without being
+# inside it, as with any plane test.
+#
+# The mask drives drawing in one of two ways: visible_indices() gives the
+# indices to draw, and compact_commands() packs the DrawArraysIndirectCommand
+# (count, instanceCount, first, baseInstance) records of the visible objects
+# to the front of an array, ready for a GL_DRAW_INDIRECT_BUFFER and
+# glMultiDrawArraysIndirect with the number it returns as the draw count.
+# baseInstance still names the object, so per object data keeps working.
+#
+#   planes = frustum_planes(m3dMultiply44(proj_matrix, view_matrix))
+#   visible = cull_spheres(planes, centers, radii)
+#   commands, count = compact_commands(all_commands, visible, out=scratch)
+#   glBufferSubData(GL_DRAW_INDIRECT_BUFFER, 0, commands.nbytes, commands)
+#   glMultiDrawArraysIndirect(GL_TRIANGLES, None, count, 0)
+#
+# world_spheres() places one object space sphere with N model matrices, for
+# bounds that move with a TransformTree or a FrameBatch.
+
+import sys
+
+import numpy as np
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+# Left, right, bottom, top, near, far: the clip space axis of each plane and
+# the sign it is added to w with
+FRUSTUM_PLANES = ((0, 1.0), (0, -1.0), (1, 1.0), (1, -1.0), (2, 1.0), (2, -1.0))
+# GLuint count, instanceCount, first, baseInstance
+CULL_COMMAND_FIELDS = 4
+
+
+# Planes (..., 6, 4) of view-projection matrices (..., 4, 4)
+def frustum_planes(view_proj, out=None):
+    m = np.asarray(view_proj, dtype=np.float32)
+    if out is None:
+        out = np.empty(m.shape[:-2] + (6, 4), dtype=np.float32)
+    # Rows of the matrix as GL multiplies it are the columns of the array
+    w = m[..., :, 3]
+    for i, (axis, sign) in enumerate(FRUSTUM_PLANES):
+        out[..., i, :] = w + sign * m[..., :, axis]
+    out /= np.sqrt((out[..., :3] * out[..., :3]).sum(axis=-1, keepdims=True))
+    return out
+
+
+# Mask of the spheres (centers (N, 3), radii (N,) or one radius) that are
+# not wholly outside any plane
+def cull_spheres(planes, centers, radii, out=None):
+    centers = np.asarray(centers, dtype=np.float32)
+    radii = np.broadcast_to(np.asarray(radii, dtype=np.float32), centers.shape[:1])
+    x, y, z = centers[:, 0], centers[:, 1], centers[:, 2]
+    if out is None:
+        out = np.empty(centers.shape[0], dtype=bool)
+    out[...] = True
+    distance = np.empty(centers.shape[0], dtype=np.float32)
+    term = np.empty(centers.shape[0], dtype=np.float32)
+    for a, b, c, d in planes:
+        np.add(radii, d, out=distance)
+        distance += np.multiply(x, a, out=term)
+        distance += np.multiply(y, b, out=term)
+        distance += np.multiply(z, c, out=term)
+        out &= distance >= 0.0
+    return out
+
+
+# Mask of the axis aligned boxes (mins and maxs (N, 3)) that are not wholly
+# outside any plane
+def cull_aabbs(planes, mins, maxs, out=None):
+    mins = np.asarray(mins, dtype=np.float32)
+    maxs = np.asarray(maxs, dtype=np.float32)
+    centers = mins + maxs
+    centers *= 0.5
+    extents = maxs - mins
+    extents *= 0.5
+    x, y, z = centers[:, 0], centers[:, 1], centers[:, 2]
+    ex, ey, ez = extents[:, 0], extents[:, 1], extents[:, 2]
+    if out is None:
+        out = np.empty(centers.shape[0], dtype=bool)
+    out[...] = True
+    distance = np.empty(centers.shape[0], dtype=np.float32)
+    term = np.empty(centers.shape[0], dtype=np.float32)
+    for a, b, c, d in planes:
+        # Distance of the box corner furthest along the plane normal
+        np.multiply(x, a, out=distance)
+        distance += d
+        distance += np.multiply(y, b, out=term)
+        distance += np.multiply(z, c, out=term)
+        distance += np.multiply(ex, abs(a), out=term)
+        distance += np.multiply(ey, abs(b), out=term)
+        distance += np.multiply(ez, abs(c), out=term)
+        out &= distance >= 0.0
+    return out
+
+
+def visible_indices(mask):
+    return np.flatnonzero(mask).astype(np.uint32)
+
+
+# The commands (N, 4) of the visible objects packed into the front of out
+# (or a new array); returns them and their count
+def compact_commands(commands, mask, out=None):
+    commands = np.asarray(commands, dtype=np.uint32)
+    if commands.ndim != 2 or commands.shape[1] != CULL_COMMAND_FIELDS:
+        raise ValueError("commands are {}, expected (N, {})".format(commands.shape, CULL_COMMAND_FIELDS))
+    count = int(np.count_nonzero(mask))
+    if out is None:
+        out = np.empty((count, CULL_COMMAND_FIELDS), dtype=np.uint32)
+    elif out.shape[0] < count or out.shape[1:] != commands.shape[1:] or out.dtype != np.uint32:
+        raise ValueError("out is {} {}, too small for {} commands".format(out.dtype, out.shape, count))
+    np.compress(mask, commands, axis=0, out=out[:count])
+    return out[:count], count
+
+
+# Bounding spheres of an object space sphere (center (3,), radius) placed by
+# model matrices (N, 4, 4): centers (N, 3) and radii (N,) grown by the
+# largest scale of each matrix
+def world_spheres(matrices, center, radius):
+    m = np.asarray(matrices, dtype=np.float32)
+    center = np.asarray(center, dtype=np.float32)
+    centers = m[:, 3, :3] + center[0] * m[:, 0, :3] + center[1] * m[:, 1, :3] + center[2] * m[:, 2, :3]
+    scale = np.sqrt((m[:, :3, :3] * m[:, :3, :3]).sum(axis=-1).max(axis=-1))
+    return centers, scale * np.float32(radius)
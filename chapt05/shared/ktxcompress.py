@@ -0,0 +1,381 @@
+#!/usr/bin/python3
+
+# Block compression of KTX textures to BC1 (S3TC DXT1), BC4 (RGTC1) and BC5
+# (RGTC2), with NumPy. Every level is cut into 4x4 blocks (edges repeat to
+# fill partial blocks) and all blocks of the level, across every layer and
+# face, are encoded together: the endpoint search, index selection and bit
+# packing are each a handful of array operations over an (n, 16) or
+# (n, 16, 3) array rather than a loop over blocks.
+#
+#   bc4   one channel, 8 bytes a block. Each block is encoded both with the
+#         8 value palette between its minimum and maximum and with the 6
+#         value palette plus exact 0 and 255, and keeps whichever is closer
+#   bc5   two channels, two BC4 blocks
+#   bc1   RGB, 8 bytes a block. Endpoints lie on the principal axis of the
+#         block's colours and are refined once by least squares
+#   bc1a  as bc1 with 1 bit alpha: blocks with pixels below alpha 128 use
+#         the 3 colour palette and make those pixels transparent
+#
+# The output is a KTX file with the compressed glInternalFormat whose levels
+# ktx_load uploads with glCompressedTexSubImage*. --mipmaps builds a full
+# chain first (see ktxmipmap). The report gives encode throughput in
+# Mpixels/s, the PSNR of the decoded result and the size before and after.
+#
+# usage: python ktxcompress.py input.ktx output.ktx --format bc1|bc1a|bc4|bc5 [--channel 0] [--mipmaps]
+
+import sys
+import copy
+import time
+import argparse
+
+import numpy as np
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+from ktxloader import ktx_read, ktx_image_array, ktx_gpu_size
+from ktxwriter import ktx_make_header, ktx_write
+from ktxmipmap import mip_chain, MIP_SRGB_FORMATS
+
+GL_COMPRESSED_RGB_S3TC_DXT1 = 0x83F0
+GL_COMPRESSED_RGBA_S3TC_DXT1 = 0x83F1
+GL_COMPRESSED_SRGB_S3TC_DXT1 = 0x8C4C
+GL_COMPRESSED_SRGB_ALPHA_S3TC_DXT1 = 0x8C4D
+
+# glInternalFormat, sRGB glInternalFormat, glBaseInternalFormat, channels
+# read from the image
+KTX_COMPRESS_FORMATS = {
+    'bc1': (GL_COMPRESSED_RGB_S3TC_DXT1, GL_COMPRESSED_SRGB_S3TC_DXT1, GL_RGB, 3),
+    'bc1a': (GL_COMPRESSED_RGBA_S3TC_DXT1, GL_COMPRESSED_SRGB_ALPHA_S3TC_DXT1, GL_RGBA, 4),
+    'bc4': (GL_COMPRESSED_RED_RGTC1, None, GL_RED, 1),
+    'bc5': (GL_COMPRESSED_RG_RGTC2, None, GL_RG, 2),
+}
+
+
+# (height, width, channels) -> (blocks, 16, channels), blocks in the order
+# they are stored: left to right, then top to bottom
+def image_blocks(image):
+    height, width, channels = image.shape
+    padded = np.pad(image, ((0, -height % 4), (0, -width % 4), (0, 0)), mode='edge')
+    rows, cols = padded.shape[0] // 4, padded.shape[1] // 4
+    return padded.reshape(rows, 4, cols, 4, channels).transpose(0, 2, 1, 3, 4).reshape(-1, 16, channels)
+
+# The inverse of image_blocks, cropped to height x width
+def blocks_image(blocks, height, width):
+    rows, cols = (height + 3) // 4, (width + 3) // 4
+    channels = blocks.shape[-1]
+    image = blocks.reshape(rows, cols, 4, 4, channels).transpose(0, 2, 1, 3, 4).reshape(rows * 4, cols * 4, channels)
+    return image[:height, :width]
+
+
+# Nearest palette entry of every pixel: values (n, 16, c), palette (n, p, c).
+# Returns the indices and the squared error of every block
+def nearest(values, palette):
+    # A channel at a time: summing over a short last axis is slow in NumPy
+    distance = np.zeros(values.shape[:2] + palette.shape[1:2], dtype=np.float32)
+    for c in range(values.shape[2]):
+        d = values[:, :, None, c] - palette[:, None, :, c]
+        distance += d * d
+    index = distance.argmin(axis=2)
+    return index, np.take_along_axis(distance, index[:, :, None], axis=2)[:, :, 0].sum(axis=1)
+
+# Packs (n, 16) indices of bits each, pixel 0 in the lowest bits
+def pack_indices(index, bits):
+    shifts = np.arange(16, dtype=np.uint64) * np.uint64(bits)
+    return (index.astype(np.uint64) << shifts).sum(axis=1, dtype=np.uint64)
+
+
+def bc4_palette(r0, r1):
+    r0 = r0.astype(np.float32)[:, None]
+    r1 = r1.astype(np.float32)[:, None]
+    i = np.arange(8, dtype=np.float32)[None, :]
+    eight = np.where(i == 0, r0, np.where(i == 1, r1, ((8.0 - i) * r0 + (i - 1.0) * r1) / 7.0))
+    six = np.where(i == 0, r0, np.where(i == 1, r1, ((6.0 - i) * r0 + (i - 1.0) * r1) / 5.0))
+    six = np.where(i == 6, 0.0, np.where(i == 7, 255.0, six))
+    return np.where(r0 > r1, eight, six)
+
+
+# The palettes are evenly spaced, so the nearest entry is found by rounding:
+# steps + 1 values from start to end, stored under the indices in order.
+# Returns the indices and the values they decode to
+def bc4_quantize(v, start, end, steps, order):
+    span = (end - start)[:, None].astype(np.float32)
+    t = (v - start[:, None]) / np.where(span == 0.0, 1.0, span)
+    pos = np.clip(np.rint(t * steps), 0, steps).astype(np.int64)
+    value = start[:, None] + pos * span / steps
+    return np.array(order)[pos], value
+
+
+# (n, 16) uint8 -> (n, 8) BC4 blocks
+def encode_bc4(values):
+    v = values.astype(np.float32)
+    n = len(v)
+
+    # 8 values from the maximum down to the minimum
+    hi = v.max(axis=1)
+    lo = v.min(axis=1)
+    index8, value8 = bc4_quantize(v, hi, lo, 7, [0, 2, 3, 4, 5, 6, 7, 1])
+    error8 = ((v - value8) ** 2).sum(axis=1)
+
+    # 6 values between the extremes that are not 0 or 255, which are exact
+    inner = (v > 0.0) & (v < 255.0)
+    lo6 = np.where(inner, v, 255.0).min(axis=1)
+    hi6 = np.where(inner, v, 0.0).max(axis=1)
+    lo6, hi6 = np.minimum(lo6, hi6), np.maximum(lo6, hi6)
+    index6, value6 = bc4_quantize(v, lo6, hi6, 5, [0, 2, 3, 4, 5, 1])
+    for extreme, index in ((0.0, 6), (255.0, 7)):
+        closer = np.abs(v - extreme) < np.abs(v - value6)
+        index6 = np.where(closer, index, index6)
+        value6 = np.where(closer, extreme, value6)
+    error6 = ((v - value6) ** 2).sum(axis=1)
+
+    six = error6 < error8
+    r0 = np.where(six, lo6, hi)
+    r1 = np.where(six, hi6, lo)
+    index = np.where(six[:, None], index6, index8)
+
+    out = np.zeros((n, 8), dtype=np.uint8)
+    out[:, 0] = r0.astype(np.uint8)
+    out[:, 1] = r1.astype(np.uint8)
+    out[:, 2:] = pack_indices(index, 3).astype('<u8').view(np.uint8).reshape(n, 8)[:, :6]
+    return out
+
+def decode_bc4(blocks):
+    words = np.zeros((len(blocks), 8), dtype=np.uint8)
+    words[:, :6] = blocks[:, 2:]
+    bits = words.view('<u8').reshape(-1)
+    index = (bits[:, None] >> (np.arange(16, dtype=np.uint64) * np.uint64(3))) & np.uint64(7)
+    palette = bc4_palette(blocks[:, 0], blocks[:, 1])
+    return np.rint(np.take_along_axis(palette, index.astype(np.int64), axis=1)).astype(np.uint8)
+
+
+# (n, 16, 2) uint8 -> (n, 16) BC5 blocks: red then green
+def encode_bc5(values):
+    return np.concatenate((encode_bc4(values[:, :, 0]), encode_bc4(values[:, :, 1])), axis=1)
+
+def decode_bc5(blocks):
+    return np.stack((decode_bc4(blocks[:, :8]), decode_bc4(blocks[:, 8:])), axis=-1)
+
+
+def pack_565(colour):
+    c = np.clip(np.rint(colour * (np.array([31.0, 63.0, 31.0]) / 255.0)), 0, [31, 63, 31]).astype(np.uint32)
+    return (c[..., 0] << 11) | (c[..., 1] << 5) | c[..., 2]
+
+def unpack_565(c):
+    c = c.astype(np.uint32)
+    r, g, b = (c >> 11) & 31, (c >> 5) & 63, c & 31
+    return np.stack(((r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)), axis=-1).astype(np.float32)
+
+# Palettes of the 4 colour (c0 > c1) and 3 colour (c0 <= c1) modes; the
+# fourth entry of the 3 colour one is transparent black
+def bc1_palette(c0, c1):
+    p0, p1 = unpack_565(c0), unpack_565(c1)
+    four = np.stack((p0, p1, (2.0 * p0 + p1) / 3.0, (p0 + 2.0 * p1) / 3.0), axis=1)
+    three = np.stack((p0, p1, (p0 + p1) / 2.0, np.zeros_like(p0)), axis=1)
+    return np.where((c0 > c1)[:, None, None], four, three)
+
+
+# Endpoints along the principal axis of the colours of every block, with
+# weights (n, 16) that leave out transparent pixels
+def principal_endpoints(colours, weights):
+    total = np.maximum(weights.sum(axis=1), 1e-6)[:, None]
+    mean = (colours * weights[:, :, None]).sum(axis=1) / total
+    centred = (colours - mean[:, None, :]) * weights[:, :, None]
+    covariance = np.matmul(centred.transpose(0, 2, 1), centred)
+
+    axis = np.ones((len(colours), 3), dtype=np.float32)
+    for _ in range(8):
+        axis = np.matmul(covariance, axis[:, :, None])[:, :, 0]
+        axis /= np.maximum(np.linalg.norm(axis, axis=1), 1e-12)[:, None]
+
+    t = ((colours - mean[:, None, :]) * axis[:, None, :]).sum(axis=2)
+    t_lo = np.where(weights > 0, t, np.inf).min(axis=1)
+    t_hi = np.where(weights > 0, t, -np.inf).max(axis=1)
+    t_lo = np.where(np.isfinite(t_lo), t_lo, 0.0)
+    t_hi = np.where(np.isfinite(t_hi), t_hi, 0.0)
+    return mean + axis * t_hi[:, None], mean + axis * t_lo[:, None]
+
+
+# Endpoints that best fit the chosen indices of a 4 colour block, by least
+# squares: each pixel is a0 * e0 + a1 * e1 for the weights of its index
+def refine_endpoints(colours, index, weights, e0, e1):
+    a0 = np.array([1.0, 0.0, 2.0 / 3.0, 1.0 / 3.0], dtype=np.float32)[index] * weights
+    a1 = np.array([0.0, 1.0, 1.0 / 3.0, 2.0 / 3.0], dtype=np.float32)[index] * weights
+    aa, ab, bb = (a0 * a0).sum(axis=1), (a0 * a1).sum(axis=1), (a1 * a1).sum(axis=1)
+    ax = (a0[:, :, None] * colours).sum(axis=1)
+    bx = (a1[:, :, None] * colours).sum(axis=1)
+    det = aa * bb - ab * ab
+    ok = np.abs(det) > 1e-6
+    det = np.where(ok, det, 1.0)[:, None]
+    r0 = (ax * bb[:, None] - bx * ab[:, None]) / det
+    r1 = (bx * aa[:, None] - ax * ab[:, None]) / det
+    return np.where(ok[:, None], r0, e0), np.where(ok[:, None], r1, e1)
+
+
+# (n, 16, 3 or 4) uint8 -> (n, 8) BC1 blocks. With alpha (4 channels),
+# pixels below 128 are made transparent
+def encode_bc1(values):
+    n = len(values)
+    colours = values[:, :, :3].astype(np.float32)
+    transparent = values[:, :, 3] < 128 if values.shape[2] == 4 else np.zeros((n, 16), dtype=bool)
+    punch = transparent.any(axis=1)
+    weights = (~transparent).astype(np.float32)
+
+    e0, e1 = principal_endpoints(colours, weights)
+    for refine in (False, True):
+        c0, c1 = pack_565(np.clip(e0, 0.0, 255.0)), pack_565(np.clip(e1, 0.0, 255.0))
+        # The 4 colour mode needs c0 > c1, the 3 colour mode c0 <= c1
+        swap = np.where(punch, c0 > c1, c0 < c1)
+        c0, c1 = np.where(swap, c1, c0), np.where(swap, c0, c1)
+        palette = bc1_palette(c0, c1)
+        # Transparent black is only for transparent pixels
+        usable = palette.copy()
+        usable[punch, 3] = 1e6
+        index, _ = nearest(colours, usable)
+        index = np.where(transparent, 3, index)
+        if refine:
+            break
+        r0, r1 = refine_endpoints(colours, index, weights, np.where(swap[:, None], e1, e0), np.where(swap[:, None], e0, e1))
+        # The 3 colour blocks keep their principal axis endpoints
+        e0 = np.where(punch[:, None], e0, r0)
+        e1 = np.where(punch[:, None], e1, r1)
+
+    out = np.zeros((n, 8), dtype=np.uint8)
+    out[:, 0:2] = c0.astype('<u2').view(np.uint8).reshape(n, 2)
+    out[:, 2:4] = c1.astype('<u2').view(np.uint8).reshape(n, 2)
+    out[:, 4:8] = pack_indices(index, 2).astype('<u4').view(np.uint8).reshape(n, 4)
+    return out
+
+def decode_bc1(blocks):
+    c0 = blocks[:, 0:2].copy().view('<u2').reshape(-1)
+    c1 = blocks[:, 2:4].copy().view('<u2').reshape(-1)
+    bits = blocks[:, 4:8].copy().view('<u4').reshape(-1).astype(np.uint64)
+    index = ((bits[:, None] >> (np.arange(16, dtype=np.uint64) * np.uint64(2))) & np.uint64(3)).astype(np.int64)
+    palette = bc1_palette(c0, c1)
+    alpha = np.where((c0 <= c1)[:, None] & (index == 3), 0, 255)
+    rgb = np.rint(np.take_along_axis(palette, index[:, :, None], axis=1)).astype(np.uint8)
+    return np.concatenate((rgb, alpha[:, :, None].astype(np.uint8)), axis=2)
+
+
+KTX_ENCODERS = { 'bc1': (encode_bc1, decode_bc1), 'bc1a': (encode_bc1, decode_bc1),
+                 'bc4': (lambda v: encode_bc4(v[:, :, 0]), lambda b: decode_bc4(b)[:, :, None]),
+                 'bc5': (encode_bc5, decode_bc5) }
+
+
+class CompressReport:
+    def __init__(self):
+        self.pixels = 0
+        self.seconds = 0.0
+        self.squared_error = 0.0
+        self.samples = 0
+        self.size_before = 0
+        self.size_after = 0
+
+    def psnr(self):
+        if self.squared_error == 0.0:
+            return float('inf')
+        return 10.0 * np.log10(255.0 ** 2 / (self.squared_error / max(self.samples, 1)))
+
+    def __str__(self):
+        return '{:.2f} Mpixels in {:.1f} ms ({:.1f} Mpixels/s); PSNR {:.2f} dB; {:.1f} KB -> {:.1f} KB ({:.1f}x)'.format(
+            self.pixels / 1e6, self.seconds * 1000.0, self.pixels / max(self.seconds, 1e-9) / 1e6, self.psnr(),
+            self.size_before / 1024.0, self.size_after / 1024.0, self.size_before / max(self.size_after, 1))
+
+
+# Image of a KTX file in RGBA channel order as (images, depth, height, width,
+# channels) uint8, per level
+def rgba_levels(image):
+    h = image.h
+    if h.gltype != GL_UNSIGNED_BYTE:
+        raise ValueError("only 8 bit textures can be compressed")
+    levels = []
+    for level in range(h.miplevels):
+        stack = np.stack([ktx_image_array(image, level, layer, face)
+                          for layer in range(max(h.arrayelements, 1)) for face in range(max(h.faces, 1))])
+        if h.glformat in (GL_BGR, GL_BGRA):
+            stack = stack[..., [2, 1, 0] + ([3] if h.glformat == GL_BGRA else [])]
+        levels.append(stack)
+    return levels
+
+
+def compress(input, output, kind, channel=0, mipmaps=False):
+    image = ktx_read(input)
+    h = image.h
+    if h.pixeldepth > 0:
+        raise ValueError("3D textures cannot be block compressed")
+    internalformat, srgb_internalformat, base, channels = KTX_COMPRESS_FORMATS[kind]
+    srgb = h.glinternalformat in MIP_SRGB_FORMATS and srgb_internalformat is not None
+    encode, decode = KTX_ENCODERS[kind]
+
+    levels = rgba_levels(image)
+    if mipmaps:
+        levels = mip_chain(levels[0], 'box', srgb)
+
+    report = CompressReport()
+    # The input format over the levels that are encoded, which --mipmaps
+    # may have added to
+    before = copy.copy(h)
+    before.miplevels = len(levels)
+    report.size_before = ktx_gpu_size(before)
+    out_levels = []
+    for level in levels:
+        count, _, height, width, have = level.shape
+        # Pick the channels the format keeps; missing ones read as 0 (alpha as opaque)
+        if kind in ('bc4', 'bc5'):
+            picked = level[:, 0, :, :, channel:channel + channels]
+            if picked.shape[-1] < channels:
+                raise ValueError("the texture has no channel {}".format(channel + channels - 1))
+        else:
+            picked = np.zeros((count, height, width, channels), dtype=np.uint8)
+            picked[..., :min(have, channels)] = level[:, 0, :, :, :min(have, channels)]
+            if channels == 4 and have < 4:
+                picked[..., 3] = 255
+
+        blocks = np.concatenate([image_blocks(p) for p in picked])
+        start = time.perf_counter()
+        encoded = encode(blocks)
+        report.seconds += time.perf_counter() - start
+        report.pixels += count * height * width
+
+        decoded = decode(encoded)[:, :, :channels].astype(np.float64)
+        per_image = len(blocks) // count
+        for i in range(count):
+            restored = blocks_image(decoded[i * per_image:(i + 1) * per_image], height, width)
+            report.squared_error += ((restored - picked[i]) ** 2).sum()
+            report.samples += restored.size
+        out_levels.append(list(encoded.reshape(count, -1)))
+
+    out = ktx_make_header(GL_NONE, GL_NONE, srgb_internalformat if srgb else internalformat, h.pixelwidth,
+                          h.pixelheight, 0, h.arrayelements, max(h.faces, 1), len(out_levels),
+                          gltypesize=1, glbaseinternalformat=base)
+    ktx_write(output, out, out_levels)
+    report.size_after = ktx_gpu_size(out)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Block compress a KTX texture to BC1, BC4 or BC5.')
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--format', choices=sorted(KTX_COMPRESS_FORMATS), default='bc1')
+    parser.add_argument('--channel', type=int, default=0,
+                        help='first channel (in RGBA order) that bc4 and bc5 compress')
+    parser.add_argument('--mipmaps', action='store_true', help='build a full mip chain before compressing')
+    args = parser.parse_args(argv)
+
+    try:
+        report = compress(args.input, args.output, args.format, args.channel, args.mipmaps)
+    except ValueError as e:
+        print("{}: {}".format(args.input, e))
+        return 1
+    print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,273 @@
+#!/usr/bin/python3
+
+# Builds an index of every KTX texture under some directories and support
+# zips without loading any of them: for each file the header and key/value
+# block are probed (ktx_probe) and the data is hashed, giving
+#
+#   target, format, type and internal format, size, layers, faces, levels,
+#   the estimated video memory of the texture and a SHA-256 of the file
+#
+# Zips given on the command line or found while walking a directory are read
+# member by member. The index is JSON or SQLite, chosen by the extension of
+# the output file. Rebuilding an index reuses the entries of files whose size
+# and modification time have not changed, so only new and changed files are
+# read again.
+#
+# Scene setup can plan texture residency from the index with read_index():
+#
+#   index = read_index('textures.json')
+#   total = sum(e['gpu_bytes'] for e in index.values() if e['gpu_bytes'])
+#
+# usage: python ktxindex.py output.json|output.sqlite path [path ...]
+
+import sys
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import zipfile
+import argparse
+
+try:
+    import OpenGL.GL
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+from ktxloader import ktx_probe
+
+
+KTX_INDEX_VERSION = 1
+KTX_INDEX_HASH_CHUNK = 1 << 20
+
+# Columns of an index entry, in the order of the SQLite table
+KTX_INDEX_FIELDS = [('file', 'TEXT'), ('member', 'TEXT'), ('size', 'INTEGER'), ('mtime', 'REAL'),
+                    ('target', 'TEXT'), ('gltype', 'TEXT'), ('glformat', 'TEXT'), ('glinternalformat', 'TEXT'),
+                    ('width', 'INTEGER'), ('height', 'INTEGER'), ('depth', 'INTEGER'), ('layers', 'INTEGER'),
+                    ('faces', 'INTEGER'), ('levels', 'INTEGER'), ('compressed', 'INTEGER'),
+                    ('gpu_bytes', 'INTEGER'), ('sha256', 'TEXT'), ('keyvalues', 'TEXT')]
+
+GL_VENDOR_SUFFIXES = ('ARB', 'EXT', 'NV', 'ATI', 'AMD', 'SGIX', 'SGIS', 'OES', 'KHR', 'APPLE', 'IBM', 'INTEL', 'MESA')
+
+_gl_enum_names = None
+
+# Name of a GL enum such as 0x8229 -> 'GL_R8'. Core names win over vendor ones
+def gl_enum_name(value):
+    global _gl_enum_names
+    if _gl_enum_names is None:
+        _gl_enum_names = {}
+        # Names with a vendor suffix go last; among the rest the shortest wins
+        names = sorted((n for n in dir(OpenGL.GL) if n.startswith('GL_')),
+                       key=lambda n: (n.rsplit('_', 1)[-1] in GL_VENDOR_SUFFIXES, len(n), n))
+        for name in names:
+            v = getattr(OpenGL.GL, name)
+            if isinstance(v, int) and not isinstance(v, bool):
+                _gl_enum_names.setdefault(int(v), name)
+    if value == 0:
+        return 'GL_NONE'
+    return _gl_enum_names.get(value, hex(value))
+
+
+# Key/value data as JSON: text values become strings, anything else hex
+def keyvalues_json(keyvalues):
+    out = {}
+    for key, value in keyvalues.items():
+        text = value[:-1] if value.endswith(b'\0') else None
+        try:
+            out[key] = text.decode('utf-8') if text is not None and b'\0' not in text else value.hex()
+        except UnicodeDecodeError:
+            out[key] = value.hex()
+    return out
+
+
+def sha256(f):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: f.read(KTX_INDEX_HASH_CHUNK), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def index_entry(f, file, member, size, mtime):
+    info = ktx_probe(f)
+    h = info.h
+    f.seek(0)
+    return {
+        'file': file, 'member': member, 'size': size, 'mtime': mtime,
+        'target': gl_enum_name(int(info.target)), 'gltype': gl_enum_name(h.gltype),
+        'glformat': gl_enum_name(h.glformat), 'glinternalformat': gl_enum_name(h.glinternalformat),
+        'width': h.pixelwidth, 'height': h.pixelheight, 'depth': h.pixeldepth,
+        'layers': h.arrayelements, 'faces': h.faces, 'levels': max(h.miplevels, 1),
+        'compressed': info.compressed, 'gpu_bytes': info.gpu_size, 'sha256': sha256(f),
+        'keyvalues': keyvalues_json(info.keyvalues),
+    }
+
+
+def entry_key(file, member):
+    return file if member is None else file + '/' + member
+
+
+# Every KTX file (file, None) and zip member (zip, member) under paths
+def find_textures(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    full = os.path.join(root, name)
+                    if name.lower().endswith('.ktx'):
+                        yield full, None
+                    elif name.lower().endswith('.zip'):
+                        yield from zip_textures(full)
+        elif path.lower().endswith('.zip'):
+            yield from zip_textures(path)
+        else:
+            yield path, None
+
+def zip_textures(path):
+    try:
+        with zipfile.ZipFile(path) as z:
+            names = [i.filename for i in z.infolist() if i.filename.lower().endswith('.ktx')]
+    except zipfile.BadZipFile:
+        print("{}: not a zip file".format(path))
+        return
+    for name in names:
+        yield path, name
+
+
+class IndexReport:
+    def __init__(self):
+        self.probed = 0
+        self.reused = 0
+        self.failed = 0
+        self.bytes_read = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        return '{} probed, {} unchanged, {} failed; {:.1f} MB hashed in {:.2f} s'.format(
+            self.probed, self.reused, self.failed, self.bytes_read / 1e6, self.seconds)
+
+
+# Index of the textures under paths as a dict of entries keyed by file, or
+# file/member for zips. Entries of old whose size and mtime match are reused
+def build_index(paths, old=None):
+    old = old or {}
+    index = {}
+    report = IndexReport()
+    start = time.perf_counter()
+    zips = {}
+
+    try:
+        for file, member in find_textures(paths):
+            key = entry_key(file, member)
+            try:
+                if member is None:
+                    st = os.stat(file)
+                    size, mtime = st.st_size, st.st_mtime
+                else:
+                    if file not in zips:
+                        zips[file] = zipfile.ZipFile(file)
+                    zinfo = zips[file].getinfo(member)
+                    size, mtime = zinfo.file_size, time.mktime(zinfo.date_time + (0, 0, -1))
+
+                previous = old.get(key)
+                if previous is not None and previous['size'] == size and previous['mtime'] == mtime:
+                    index[key] = previous
+                    report.reused += 1
+                    continue
+
+                if member is None:
+                    with open(file, 'rb') as f:
+                        index[key] = index_entry(f, file, member, size, mtime)
+                else:
+                    # Seeking a member back to the start only decompresses the header again
+                    with zips[file].open(member) as f:
+                        index[key] = index_entry(f, file, member, size, mtime)
+                report.probed += 1
+                report.bytes_read += size
+            except (OSError, ValueError, zipfile.BadZipFile, KeyError) as e:
+                print("{}: {}".format(key, e))
+                report.failed += 1
+    finally:
+        for z in zips.values():
+            z.close()
+
+    report.seconds = time.perf_counter() - start
+    return index, report
+
+
+def is_sqlite(path):
+    return path.lower().endswith(('.sqlite', '.sqlite3', '.db'))
+
+def write_index(path, index):
+    if is_sqlite(path):
+        db = sqlite3.connect(path)
+        try:
+            db.execute('DROP TABLE IF EXISTS ktx')
+            db.execute('CREATE TABLE ktx ({}, PRIMARY KEY (file, member))'.format(
+                ', '.join('{} {}'.format(name, kind) for name, kind in KTX_INDEX_FIELDS)))
+            db.execute('PRAGMA user_version = {}'.format(KTX_INDEX_VERSION))
+            rows = []
+            for e in index.values():
+                row = dict(e, member=e['member'] or '', compressed=int(e['compressed']),
+                           keyvalues=json.dumps(e['keyvalues']))
+                rows.append(tuple(row[name] for name, kind in KTX_INDEX_FIELDS))
+            db.executemany('INSERT INTO ktx VALUES ({})'.format(', '.join('?' * len(KTX_INDEX_FIELDS))), rows)
+            db.commit()
+        finally:
+            db.close()
+    else:
+        with open(path, 'w') as f:
+            json.dump({'version': KTX_INDEX_VERSION, 'textures': list(index.values())}, f, indent=1)
+
+# Reads an index written by write_index. Returns {} if there is none yet
+def read_index(path):
+    if not os.path.exists(path):
+        return {}
+    entries = []
+    if is_sqlite(path):
+        db = sqlite3.connect(path)
+        try:
+            if db.execute('PRAGMA user_version').fetchone()[0] != KTX_INDEX_VERSION:
+                return {}
+            for row in db.execute('SELECT {} FROM ktx'.format(', '.join(name for name, kind in KTX_INDEX_FIELDS))):
+                e = dict(zip((name for name, kind in KTX_INDEX_FIELDS), row))
+                e['member'] = e['member'] or None
+                e['compressed'] = bool(e['compressed'])
+                e['keyvalues'] = json.loads(e['keyvalues'])
+                entries.append(e)
+        except sqlite3.DatabaseError:
+            return {}
+        finally:
+            db.close()
+    else:
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != KTX_INDEX_VERSION:
+            return {}
+        entries = data['textures']
+    return {entry_key(e['file'], e['member']): e for e in entries}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Index the KTX textures in directories and support zips.')
+    parser.add_argument('output', help='index to write; .sqlite, .sqlite3 or .db for SQLite, JSON otherwise')
+    parser.add_argument('paths', nargs='+', help='directories, zips or KTX files')
+    parser.add_argument('--rebuild', action='store_true', help='probe every file even if it has not changed')
+    args = parser.parse_args(argv)
+
+    old = {} if args.rebuild else read_index(args.output)
+    index, report = build_index(args.paths, old)
+    write_index(args.output, index)
+
+    gpu = sum(e['gpu_bytes'] or 0 for e in index.values())
+    print('{} textures, {:.1f} MB on disk, {:.1f} MB estimated video memory'.format(
+        len(index), sum(e['size'] for e in index.values()) / 1e6, gpu / 1e6))
+    print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
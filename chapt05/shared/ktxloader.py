@@ -19,6 +19,14 @@ except:
         ''')
     sys.exit()
 
+# The PyOpenGL wrappers size compressed data from a Python array; these take
+# a size and a pointer like the C functions
+from OpenGL.raw.GL.VERSION.GL_1_3 import glCompressedTexSubImage1D as rawCompressedTexSubImage1D, \
+    glCompressedTexSubImage2D as rawCompressedTexSubImage2D, glCompressedTexSubImage3D as rawCompressedTexSubImage3D
+# The direct state access versions, which treat a cube map as 6 layers
+from OpenGL.raw.GL.VERSION.GL_4_5 import glTextureSubImage3D as rawTextureSubImage3D, \
+    glCompressedTextureSubImage3D as rawCompressedTextureSubImage3D
+
 class header:
     identifier=''    # [12]
     endianness=0     # unsigned int
@@ -40,11 +48,53 @@ class keyvaluepair:
     rawbytes=[]    # unsigned char  [4]
 
 
+# The 64 byte KTX header: the identifier and thirteen 32 bit words, in the
+# byte order given by endianness
+KTX_HEADER_SIZE = 64
+KTX_HEADER_FIELDS = ['endianness', 'gltype', 'gltypesize', 'glformat', 'glinternalformat', 'glbaseinternalformat',
+                     'pixelwidth', 'pixelheight', 'pixeldepth', 'arrayelements', 'faces', 'miplevels', 'keypairbytes']
+
+KTX_ENDIAN_REF = 0x04030201
+KTX_ENDIAN_REF_REV = 0x01020304
+
+
 def swap16(u16):
-    pass
-    
+    return ((u16 & 0xFF) << 8) | ((u16 >> 8) & 0xFF)
+
 def swap32(u32):
-    pass
+    return int.from_bytes(int(u32).to_bytes(4, 'little'), 'big')
+
+# Components per pixel of each glFormat
+KTX_FORMAT_CHANNELS = { GL_RED: 1, GL_GREEN: 1, GL_BLUE: 1, GL_ALPHA: 1, GL_LUMINANCE: 1, GL_DEPTH_COMPONENT: 1,
+                        GL_STENCIL_INDEX: 1, GL_RED_INTEGER: 1, GL_GREEN_INTEGER: 1, GL_BLUE_INTEGER: 1,
+                        GL_RG: 2, GL_RG_INTEGER: 2, GL_LUMINANCE_ALPHA: 2, GL_DEPTH_STENCIL: 2,
+                        GL_RGB: 3, GL_BGR: 3, GL_RGB_INTEGER: 3, GL_BGR_INTEGER: 3,
+                        GL_RGBA: 4, GL_BGRA: 4, GL_RGBA_INTEGER: 4, GL_BGRA_INTEGER: 4 }
+
+# NumPy type of one component of each glType
+KTX_TYPE_DTYPES = { GL_UNSIGNED_BYTE: np.uint8, GL_BYTE: np.int8, GL_UNSIGNED_SHORT: np.uint16, GL_SHORT: np.int16,
+                    GL_UNSIGNED_INT: np.uint32, GL_INT: np.int32, GL_HALF_FLOAT: np.float16, GL_FLOAT: np.float32 }
+
+# Types that hold a whole pixel in one glTypeSize word
+KTX_PACKED_TYPES = ( GL_UNSIGNED_BYTE_3_3_2, GL_UNSIGNED_BYTE_2_3_3_REV, GL_UNSIGNED_SHORT_5_6_5,
+                     GL_UNSIGNED_SHORT_5_6_5_REV, GL_UNSIGNED_SHORT_4_4_4_4, GL_UNSIGNED_SHORT_4_4_4_4_REV,
+                     GL_UNSIGNED_SHORT_5_5_5_1, GL_UNSIGNED_SHORT_1_5_5_5_REV, GL_UNSIGNED_INT_8_8_8_8,
+                     GL_UNSIGNED_INT_8_8_8_8_REV, GL_UNSIGNED_INT_10_10_10_2, GL_UNSIGNED_INT_2_10_10_10_REV,
+                     GL_UNSIGNED_INT_24_8, GL_UNSIGNED_INT_10F_11F_11F_REV, GL_UNSIGNED_INT_5_9_9_9_REV )
+
+# Block width, height and bytes of the compressed internal formats
+KTX_COMPRESSED_BLOCKS = { GL_COMPRESSED_RED_RGTC1: (4, 4, 8), GL_COMPRESSED_SIGNED_RED_RGTC1: (4, 4, 8),
+                          GL_COMPRESSED_RG_RGTC2: (4, 4, 16), GL_COMPRESSED_SIGNED_RG_RGTC2: (4, 4, 16),
+                          0x83F0: (4, 4, 8), 0x83F1: (4, 4, 8), 0x83F2: (4, 4, 16), 0x83F3: (4, 4, 16),    # S3TC DXT1-5
+                          0x8C4C: (4, 4, 8), 0x8C4D: (4, 4, 8), 0x8C4E: (4, 4, 16), 0x8C4F: (4, 4, 16),    # sRGB S3TC
+                          GL_COMPRESSED_RGBA_BPTC_UNORM: (4, 4, 16), GL_COMPRESSED_SRGB_ALPHA_BPTC_UNORM: (4, 4, 16),
+                          GL_COMPRESSED_RGB_BPTC_SIGNED_FLOAT: (4, 4, 16), GL_COMPRESSED_RGB_BPTC_UNSIGNED_FLOAT: (4, 4, 16),
+                          GL_COMPRESSED_R11_EAC: (4, 4, 8), GL_COMPRESSED_SIGNED_R11_EAC: (4, 4, 8),
+                          GL_COMPRESSED_RG11_EAC: (4, 4, 16), GL_COMPRESSED_SIGNED_RG11_EAC: (4, 4, 16),
+                          GL_COMPRESSED_RGB8_ETC2: (4, 4, 8), GL_COMPRESSED_SRGB8_ETC2: (4, 4, 8),
+                          GL_COMPRESSED_RGB8_PUNCHTHROUGH_ALPHA1_ETC2: (4, 4, 8),
+                          GL_COMPRESSED_SRGB8_PUNCHTHROUGH_ALPHA1_ETC2: (4, 4, 8),
+                          GL_COMPRESSED_RGBA8_ETC2_EAC: (4, 4, 16), GL_COMPRESSED_SRGB8_ALPHA8_ETC2_EAC: (4, 4, 16) }
 
 def calculate_stride(h, width, pad = 4):
 
@@ -70,205 +120,485 @@ def calculate_face_size(h):
     return stride * h.pixelheight
 
 
+def align4(value):
+    return (value + 3) & ~3
+
+# Bytes of one width x height x depth image of a face or layer, rows padded
+# to pad bytes (4 as KTX stores them). None if the format is not one we know
+def ktx_image_size(h, width, height, depth, pad = 4):
+    if h.gltype == GL_NONE:
+        if h.glinternalformat not in KTX_COMPRESSED_BLOCKS:
+            return None
+        bw, bh, block_bytes = KTX_COMPRESSED_BLOCKS[h.glinternalformat]
+        return ((width + bw - 1) // bw) * ((height + bh - 1) // bh) * block_bytes * depth
+
+    if h.gltype in KTX_PACKED_TYPES:
+        pixel = h.gltypesize
+    elif h.glformat in KTX_FORMAT_CHANNELS:
+        pixel = h.gltypesize * KTX_FORMAT_CHANNELS[h.glformat]
+    else:
+        return None
+    stride = (pixel * width + (pad - 1)) & ~(pad - 1)
+    return stride * height * depth
+
+
 identifier = 0xAB, 0x4B, 0x54, 0x58, 0x20, 0x31, 0x31, 0xBB, 0x0D, 0x0A, 0x1A, 0x0A
 
 
+# Fills a header from the first 64 bytes of a file. Returns None if the
+# identifier is wrong
+def ktx_parse_header(buf):
+    buf = bytes(buf[:KTX_HEADER_SIZE])
+    if len(buf) < KTX_HEADER_SIZE or tuple(buf[:12]) != identifier:
+        return None
+
+    h = header()
+    h.identifier = ''.join(chr(c) for c in identifier)
+    words = np.frombuffer(buf, dtype='<u4', count=13, offset=12)
+    if int(words[0]) == KTX_ENDIAN_REF_REV:
+        words = words.byteswap()
+    for name, value in zip(KTX_HEADER_FIELDS, words.tolist()):
+        setattr(h, name, value)
+    # Remember whether the file was written the other way round
+    h.swapped = h.endianness != int(np.frombuffer(buf, dtype='<u4', count=1, offset=12)[0])
+    h.endianness = KTX_ENDIAN_REF
+    return h
+
+
+# // Guess target (texture type)
+def ktx_target(h):
+    if (h.pixelheight == 0):
+
+        if (h.arrayelements == 0):
+            target = GL_TEXTURE_1D;
+        else:
+            target = GL_TEXTURE_1D_ARRAY;
+
+    elif (h.pixeldepth == 0):
+
+        if (h.arrayelements == 0):
+
+            if (h.faces == 0 or h.faces == 1):
+                target = GL_TEXTURE_2D;
+            else:
+                target = GL_TEXTURE_CUBE_MAP;
+        else:
+
+            if (h.faces == 0 or h.faces == 1):
+                target = GL_TEXTURE_2D_ARRAY;
+            else:
+                target = GL_TEXTURE_CUBE_MAP_ARRAY;
+    else:
+
+        target = GL_TEXTURE_3D;
+
+    return target
+
+
+class KTXLevel:
+    # One mip level: its size and where each (layer, face) image starts.
+    # images[layer][face] is a byte offset into the file; image_size is the
+    # size of one of them (for 3D textures, the whole volume)
+    def __init__(self, width, height, depth, image_size, images):
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.image_size = image_size
+        self.images = images
+
+    @property
+    def offset(self):
+        return self.images[0][0]
+
+    @property
+    def size(self):
+        return self.images[-1][-1] + self.image_size - self.images[0][0]
+
+
+# Walks the image data of a KTX file and returns its KTXLevels, or None if the
+# data does not fit the header. With image_size_words the layout is the one
+# in the KTX specification: every level starts with an imageSize word (the
+# size of one face for non-array cube maps, of the whole level otherwise) and
+# cube faces and levels are padded to 4 bytes. Without them it is the layout
+# the SuperBible tools write, which has images back to back and no imageSize;
+# those files pad rows to alignment bytes, 4 or (most mipmapped ones) 1.
+def ktx_layout(h, data, start, image_size_words, alignment = 4):
+    layers = max(h.arrayelements, 1)
+    faces = max(h.faces, 1)
+    cube = h.arrayelements == 0 and faces == 6
+    # 1D arrays keep their layers in the height
+    height_is_layers = h.pixelheight == 0
+
+    levels = []
+    ptr = start
+    for level in range(h.miplevels):
+        width = max(h.pixelwidth >> level, 1)
+        height = max(h.pixelheight >> level, 1)
+        depth = max(h.pixeldepth >> level, 1)
+        expected = ktx_image_size(h, width, 1 if height_is_layers else height, depth, alignment)
+
+        if image_size_words:
+            if ptr + 4 > data.size:
+                return None
+            image_size = int(data[ptr:ptr + 4].view('<u4')[0])
+            if h.swapped:
+                image_size = swap32(image_size)
+            ptr += 4
+            if not cube:
+                if image_size % (layers * faces):
+                    return None
+                image_size //= layers * faces
+            if expected is not None and image_size != expected:
+                return None
+        else:
+            if expected is None:
+                return None
+            image_size = expected
+
+        images = []
+        for layer in range(layers):
+            row = []
+            for face in range(faces):
+                row.append(ptr)
+                ptr += align4(image_size) if cube and image_size_words else image_size
+            images.append(row)
+
+        if image_size_words:
+            ptr = align4(ptr)
+        if ptr > data.size:
+            return None
+        levels.append(KTXLevel(width, height, depth, image_size, images))
+
+    return levels
+
+
+class KTXData:
+    # A parsed KTX file, ready for KTXObject.ktx_upload. data is the whole
+    # file, mapped, and the image data starts at data_start. levels is the
+    # table of every (level, layer, face) image in it, whose rows are padded
+    # to alignment bytes
+    def __init__(self, h, target, data, data_start, levels=None, alignment=4):
+        self.h = h
+        self.target = target
+        self.data = data
+        self.data_start = data_start
+        self.levels = levels
+        self.alignment = alignment
+
+    # View of one image in the mapped file
+    def subresource(self, level, layer=0, face=0):
+        lv = self.levels[level]
+        start = lv.images[layer][face]
+        return self.data[start:start + lv.image_size]
+
+    # View of every layer and face of a level, which are contiguous unless a
+    # cube map has face padding
+    def level_data(self, level):
+        lv = self.levels[level]
+        return self.data[lv.offset:lv.offset + lv.size]
+
+
+# Splits the key/value block into a dict of str keys and bytes values. Keys
+# are NUL terminated UTF-8; values keep their bytes, including any NUL at the
+# end of a string value
+def ktx_parse_keyvalues(buf, swapped = False):
+    keyvalues = {}
+    ptr = 0
+    while ptr + 4 <= len(buf):
+        size = int.from_bytes(buf[ptr:ptr + 4], 'big' if swapped else 'little')
+        pair = bytes(buf[ptr + 4:ptr + 4 + size])
+        ptr += 4 + align4(size)
+        if len(pair) != size:
+            break
+        key, nul, value = pair.partition(b'\0')
+        if nul:
+            keyvalues[key.decode('utf-8', 'replace')] = value
+    return keyvalues
+
+
+# Estimated video memory of the texture ktx_load makes: every stored level,
+# layer and face with tightly packed rows
+def ktx_gpu_size(h):
+    layers = max(h.arrayelements, 1) * max(h.faces, 1)
+    total = 0
+    for level in range(max(h.miplevels, 1)):
+        width = max(h.pixelwidth >> level, 1)
+        height = max(h.pixelheight >> level, 1)
+        depth = max(h.pixeldepth >> level, 1)
+        size = ktx_image_size(h, width, height, depth, 1)
+        if size is None:
+            return None
+        total += size * layers
+    return total
+
+
+class KTXInfo:
+    # What ktx_probe finds out about a file: its header, target, key/value
+    # data and the estimated size of the texture it makes
+    def __init__(self, h, target, keyvalues):
+        self.h = h
+        self.target = target
+        self.keyvalues = keyvalues
+        self.gpu_size = ktx_gpu_size(h)
+
+    @property
+    def compressed(self):
+        return self.h.gltype == GL_NONE
+
+
+# Reads only the header and key/value block of a KTX file, given as a
+# filename or a binary file object (such as a zip member). Needs no GL
+# context
+def ktx_probe(source):
+    if isinstance(source, (str, bytes, os.PathLike)):
+        with open(source, 'rb') as f:
+            return ktx_probe(f)
+
+    buf = source.read(KTX_HEADER_SIZE)
+    h = ktx_parse_header(buf)
+    if h is None:
+        raise ValueError("not a KTX file")
+
+    keyvalues = ktx_parse_keyvalues(source.read(h.keypairbytes), h.swapped)
+    return KTXInfo(h, ktx_target(h), keyvalues)
+
+
+# Reads and checks filename without touching GL, so it can run on any thread
+def ktx_read(filename):
+
+    #try:
+
+    # Map the file; the images are handed to GL straight from the page cache
+    data = np.memmap(filename, dtype=np.uint8, mode='r')
+
+    h = ktx_parse_header(data)
+    good = h is not None
+    print ('result, good identifier:', good )
+    if not good:
+        raise ValueError("{} is not a KTX file".format(filename))
+
+    print('data:', hex(h.endianness), 'swapped' if h.swapped else '')
+
+    target = ktx_target(h)
+
+    print ('target:', target)
+
+
+        # // Check for insanity...
+    if (target == GL_NONE or                                   # // Couldn't figure out target
+        (h.pixelwidth == 0) or                                 # // Texture has no width???
+        (h.pixelheight == 0 and h.pixeldepth != 0)):             # // Texture has depth but no height???
+        print ('something wrong with the ktx file, exiting')
+        sys.exit()
+
+    ptr = KTX_HEADER_SIZE + h.keypairbytes
+
+    if (h.miplevels == 0):
+        h.miplevels = 1;
+
+    # Files following the specification carry imageSize words; the ones the
+    # SuperBible ships do not, and pad their rows one way or the other
+    for image_size_words, alignment in ((True, 4), (False, 4), (False, 1)):
+        levels = ktx_layout(h, data, ptr, image_size_words, alignment)
+        if levels is not None:
+            break
+    else:
+        raise ValueError("{}: image data does not match the header".format(filename))
+
+    return KTXData(h, target, data, ptr, levels, alignment)
+
+
+# A pointer into a view for the glTex*Image calls: PyOpenGL would convert a
+# uint8 array to the pixel type, so GL gets the mapped bytes directly instead
+def ktx_pointer(view):
+    return ctypes.c_void_p(view.ctypes.data)
+
+# Pixel data of a view in the byte order GL expects; only files written on a
+# machine of the other endianness need a copy
+def ktx_native(h, view):
+    if h.swapped and h.gltypesize in (2, 4, 8):
+        return view.view('u{}'.format(h.gltypesize)).byteswap().view(np.uint8)
+    return view
+
+
+# One image of an uncompressed, unpacked KTXData as a (depth, height, width,
+# channels) array of its component type, without the row padding. A view of
+# the file unless its byte order needs swapping
+def ktx_image_array(image, level, layer = 0, face = 0):
+    h = image.h
+    if h.gltype not in KTX_TYPE_DTYPES or h.glformat not in KTX_FORMAT_CHANNELS:
+        raise ValueError("no array type for glType {:#x}, glFormat {:#x}".format(h.gltype, h.glformat))
+
+    lv = image.levels[level]
+    height = 1 if h.pixelheight == 0 else lv.height
+    channels = KTX_FORMAT_CHANNELS[h.glformat]
+    row = lv.width * channels * h.gltypesize
+    stride = lv.image_size // (height * lv.depth)
+    rows = ktx_native(h, image.subresource(level, layer, face)).reshape(lv.depth * height, stride)[:, :row]
+    return rows.view(KTX_TYPE_DTYPES[h.gltype]).reshape(lv.depth, height, lv.width, channels)
+
+
+# Allocates every level of the texture bound to target
+def ktx_storage(h, target):
+    if (target == GL_TEXTURE_1D):
+        glTexStorage1D(GL_TEXTURE_1D, h.miplevels, h.glinternalformat, h.pixelwidth);
+    elif (target == GL_TEXTURE_2D or target == GL_TEXTURE_CUBE_MAP):
+        glTexStorage2D(target, h.miplevels, h.glinternalformat, h.pixelwidth, h.pixelheight)
+    elif (target == GL_TEXTURE_1D_ARRAY):
+        glTexStorage2D(GL_TEXTURE_1D_ARRAY, h.miplevels, h.glinternalformat, h.pixelwidth, h.arrayelements);
+    elif (target == GL_TEXTURE_3D):
+        glTexStorage3D(GL_TEXTURE_3D, h.miplevels, h.glinternalformat, h.pixelwidth, h.pixelheight, h.pixeldepth);
+    elif (target == GL_TEXTURE_2D_ARRAY):
+        glTexStorage3D(GL_TEXTURE_2D_ARRAY, h.miplevels, h.glinternalformat, h.pixelwidth, h.pixelheight, h.arrayelements);
+    elif (target == GL_TEXTURE_CUBE_MAP_ARRAY):
+        glTexStorage3D(GL_TEXTURE_CUBE_MAP_ARRAY, h.miplevels, h.glinternalformat, h.pixelwidth, h.pixelheight, h.faces * h.arrayelements);
+
+
+class KTXSlice:
+    # The smallest piece of a texture uploaded on its own: one layer and face
+    # of a level, or one depth slice of a 3D level
+    def __init__(self, level, layer=0, face=0, z=0):
+        self.level = level
+        self.layer = layer
+        self.face = face
+        self.z = z
+
+
+# Every slice of a KTXData, level by level
+def ktx_slices(image):
+    h = image.h
+    slices = []
+    for level, lv in enumerate(image.levels):
+        if image.target == GL_TEXTURE_3D:
+            slices.extend(KTXSlice(level, z=z) for z in range(lv.depth))
+        else:
+            slices.extend(KTXSlice(level, layer, face)
+                          for layer in range(max(h.arrayelements, 1)) for face in range(max(h.faces, 1)))
+    return slices
+
+# View of one slice in the mapped file
+def ktx_slice_data(image, s):
+    view = image.subresource(s.level, s.layer, s.face)
+    if image.target == GL_TEXTURE_3D:
+        size = image.levels[s.level].image_size // image.levels[s.level].depth
+        view = view[s.z * size:(s.z + 1) * size]
+    return view
+
+# Uploads pixels, the decoded data of slice s, to the texture bound to the
+# target of image
+def ktx_upload_slice(image, s, pixels):
+    h = image.h
+    target = image.target
+    lv = image.levels[s.level]
+    width, height = lv.width, lv.height
+    compressed = h.gltype == GL_NONE
+    pointer = ktx_pointer(pixels)
+
+    if (target == GL_TEXTURE_1D):
+        if compressed:
+            rawCompressedTexSubImage1D(target, s.level, 0, width, h.glinternalformat, pixels.nbytes, pointer)
+        else:
+            glTexSubImage1D(target, s.level, 0, width, h.glformat, h.gltype, pointer)
+    elif (target in (GL_TEXTURE_2D, GL_TEXTURE_CUBE_MAP, GL_TEXTURE_1D_ARRAY)):
+        x, y = 0, 0
+        if target == GL_TEXTURE_CUBE_MAP:
+            target = GL_TEXTURE_CUBE_MAP_POSITIVE_X + s.face
+        elif target == GL_TEXTURE_1D_ARRAY:
+            y, height = s.layer, 1
+        if compressed:
+            rawCompressedTexSubImage2D(target, s.level, x, y, width, height, h.glinternalformat, pixels.nbytes, pointer)
+        else:
+            glTexSubImage2D(target, s.level, x, y, width, height, h.glformat, h.gltype, pointer)
+    else:
+        z = s.z if target == GL_TEXTURE_3D else s.layer * max(h.faces, 1) + s.face
+        if compressed:
+            rawCompressedTexSubImage3D(target, s.level, 0, 0, z, width, height, 1, h.glinternalformat, pixels.nbytes, pointer)
+        else:
+            glTexSubImage3D(target, s.level, 0, 0, z, width, height, 1, h.glformat, h.gltype, pointer)
+
+
 class KTXObject:
 
     def __init__(self):
         pass
 
     def ktx_load(self, filename, tex = 0):
-    
-    #try:
+        return self.ktx_upload(ktx_read(filename), tex)
+
+    # The GL half of ktx_load. Every image goes up exactly once, from its
+    # view of the mapped file
+    def ktx_upload(self, image, tex = 0):
+
+        h = image.h
+        target = image.target
 
-        ptr=0
-        
-        temp = GLuint
-        retval = GLuint
-        
-        data_start=0
-        data_end=0
-        data=''
-        target = GL_NONE
-        h = header()
-        data = numpy.fromfile(filename, dtype=np.byte)
-        filesize = data.size
-        
-        int_data = np.array(data[:12], dtype=np.ubyte)
-        ptr = 12
-        
-        good = True
-        for i in range(len(identifier)):
-            if (int_data[i] != identifier[i]):
-                good = False
-            else:
-                print ('identifier', hex(identifier[i]) , " = ", hex(int_data[i]))
-        
-        print ('result, good identifier:', good )
-        
-        a = ''
-        for i in range(len(identifier)):
-            a+=chr(identifier[i])
-
-        h.identifier = a
-        print('id:', h.identifier)
-        
-        
-        int_data = np.frombuffer(np.array(data[12:12+4*13], dtype=np.byte), dtype=np.uint32)
-        ptr += 4*13
-        
-        
-        h.endianness, \
-        h.gltype, \
-        h.gltypesize, \
-        h.glformat, \
-        h.glinternalformat, \
-        h.glbaseinternalformat, \
-        h.pixelwidth, \
-        h.pixelheight, \
-        h.pixeldepth, \
-        h.arrayelements, \
-        h.faces, \
-        h.miplevels, \
-        h.keypairbytes = int_data
-
-        print('data:', hex(h.endianness))
-        
-        if (h.endianness == 0x04030201):
-            
-            # therefore little endian
-            if (data[12] == 1 and data[13] == 2 and data[14] == 3 and data[15] == 4):
-                print ('little endian')
-            else:
-                print ('somethings wrong little endian?')
-            
-            # // No swap needed
-            pass 
-            
-        elif (h.endianness == 0x01020304):
-        
-            # swap needed
-        
-            pass
-            #int.from_bytes(b'\xa3\x8eq\xb5', 'little')
-            #np.frombuffer(b'\xa3\x8eq\xb5', dtype='<u')
-            
-        
-        # // Guess target (texture type)
-        if (h.pixelheight == 0):
-        
-            if (h.arrayelements == 0):
-                target = GL_TEXTURE_1D;
-            else:
-                target = GL_TEXTURE_1D_ARRAY;
-            
-        elif (h.pixeldepth == 0):
-        
-            if (h.arrayelements == 0):
-            
-                if (h.faces == 0):
-                    target = GL_TEXTURE_2D;
-                else:
-                    target = GL_TEXTURE_CUBE_MAP;
-            else:
-            
-                if (h.faces == 0):
-                    target = GL_TEXTURE_2D_ARRAY;
-                else:
-                    target = GL_TEXTURE_CUBE_MAP_ARRAY;
-        else:
-        
-            target = GL_TEXTURE_3D;
-             
-        print ('target:', target)
-        
-        
-            # // Check for insanity...
-        if (target == GL_NONE or                                   # // Couldn't figure out target
-            (h.pixelwidth == 0) or                                 # // Texture has no width???
-            (h.pixelheight == 0 and h.pixeldepth != 0)):             # // Texture has depth but no height???
-            print ('something wrong with the ktx file, exiting')
-            sys.exit()
-        
         if (tex == 0):
             tex = glGenTextures(1)
-        
+
         glBindTexture(target, tex)
 
+        glPixelStorei(GL_UNPACK_ALIGNMENT, image.alignment)
 
-        ptr += h.keypairbytes
-        
-        if (h.miplevels == 0):
-            h.miplevels = 1;
-        
-        if (target == GL_TEXTURE_1D):
-            glTexStorage1D(GL_TEXTURE_1D, h.miplevels, h.glinternalformat, h.pixelwidth);
-            glTexSubImage1D(GL_TEXTURE_1D, 0, 0, h.pixelwidth, h.glformat, h.glinternalformat, data[ptr:]);
-            
-        elif (target == GL_TEXTURE_2D):
-            if (h.gltype == GL_NONE):
-                glCompressedTexImage2D(GL_TEXTURE_2D, 0, h.glinternalformat, h.pixelwidth, h.pixelheight, 0, 420 * 380 / 2, data[ptr:]);
-            else:
-                glTexStorage2D(GL_TEXTURE_2D, h.miplevels, h.glinternalformat, h.pixelwidth, h.pixelheight)
-                
-                height = h.pixelheight
-                width = h.pixelwidth
-                glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
-                
-                for i in range(0, h.miplevels):
-
-                    if h.gltype == GL_FLOAT:
-
-                        float_data = np.frombuffer(data[ptr:], dtype=np.float32)
-                        glTexSubImage2D(GL_TEXTURE_2D, i, 0, 0, width, height, h.glformat, h.gltype, float_data)
-
-                    else: # h.type == GL_UNSIGNED_BYTE
-                        
-                        #a=numpy.array(data[ptr:], dtype=np.ubyte).astype(int)
-                        #ddd = (GLubyte * len(data[ptr:]))(*a)
-                        glTexSubImage2D(GL_TEXTURE_2D, i, 0, 0, width, height, h.glformat, h.gltype, data[ptr:])
-                        
-                    ptr += height * calculate_stride(h, width, 1)
-                    
-                    height >>= 1
-                    width >>= 1
-                    if (height == 0):
-                        height = 1
-                    if (width == 0):
-                        width = 1
-                        
-        elif (target == GL_TEXTURE_3D):
-            glTexStorage3D(GL_TEXTURE_3D, h.miplevels, h.glinternalformat, h.pixelwidth, h.pixelheight, h.pixeldepth);
-            glTexSubImage3D(GL_TEXTURE_3D, 0, 0, 0, 0, h.pixelwidth, h.pixelheight, h.pixeldepth, h.glformat, h.gltype, data[ptr:]);
-        
-        elif (target == GL_TEXTURE_1D_ARRAY):
-            glTexStorage2D(GL_TEXTURE_1D_ARRAY, h.miplevels, h.glinternalformat, h.pixelwidth, h.arrayelements);
-            glTexSubImage2D(GL_TEXTURE_1D_ARRAY, 0, 0, 0, h.pixelwidth, h.arrayelements, h.glformat, h.gltype, data[ptr:]);
-        
-        elif (target == GL_TEXTURE_2D_ARRAY):
-            glTexStorage3D(GL_TEXTURE_2D_ARRAY, h.miplevels, h.glinternalformat, h.pixelwidth, h.pixelheight, h.arrayelements);
-            glTexSubImage3D(GL_TEXTURE_2D_ARRAY, 0, 0, 0, 0, h.pixelwidth, h.pixelheight, h.arrayelements, h.glformat, h.gltype, data[ptr:]);
-            
-        elif (target == GL_TEXTURE_CUBE_MAP):
-            glTexStorage2D(GL_TEXTURE_CUBE_MAP, h.miplevels, h.glinternalformat, h.pixelwidth, h.pixelheight);
-            #// glTexSubImage3D(GL_TEXTURE_CUBE_MAP, 0, 0, 0, 0, h.pixelwidth, h.pixelheight, h.faces, h.glformat, h.gltype, data);
-            
-            face_size = calculate_face_size(h);
-            for i in range(0, h.faces):
-                glTexSubImage2D(GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, 0, 0, 0, h.pixelwidth, h.pixelheight, h.glformat, h.gltype, data[ptr:] + face_size * i);
-
-        elif (target == GL_TEXTURE_CUBE_MAP_ARRAY):
-            glTexStorage3D(GL_TEXTURE_CUBE_MAP_ARRAY, h.miplevels, h.glinternalformat, h.pixelwidth, h.pixelheight, h.arrayelements);
-            glTexSubImage3D(GL_TEXTURE_CUBE_MAP_ARRAY, 0, 0, 0, 0, h.pixelwidth, h.pixelheight, h.faces * h.arrayelements, h.glformat, h.gltype, data[ptr:]);
+        layers = max(h.arrayelements, 1)
+        faces = max(h.faces, 1)
+
+        ktx_storage(h, target)
+
+        compressed = h.gltype == GL_NONE
+        # Whole cubes go up through glTextureSubImage3D, which needs GL 4.5 or
+        # ARB_direct_state_access; older contexts take the faces one by one
+        whole_cube = bool(rawCompressedTextureSubImage3D if compressed else rawTextureSubImage3D)
+
+        for i in range(0, h.miplevels):
+            lv = image.levels[i]
+            width, height, depth = lv.width, lv.height, lv.depth
+
+            # All six faces in one call, unless the file pads between them
+            if (target == GL_TEXTURE_CUBE_MAP and whole_cube and lv.size == faces * lv.image_size):
+                pixels = ktx_native(h, image.level_data(i))
+                if compressed:
+                    rawCompressedTextureSubImage3D(tex, i, 0, 0, 0, width, height, faces, h.glinternalformat, pixels.nbytes, ktx_pointer(pixels))
+                else:
+                    rawTextureSubImage3D(tex, i, 0, 0, 0, width, height, faces, h.glformat, h.gltype, ktx_pointer(pixels))
+                continue
+
+            if (target == GL_TEXTURE_CUBE_MAP):
+                for face in range(0, faces):
+                    pixels = ktx_native(h, image.subresource(i, 0, face))
+                    if compressed:
+                        rawCompressedTexSubImage2D(GL_TEXTURE_CUBE_MAP_POSITIVE_X + face, i, 0, 0, width, height, h.glinternalformat, pixels.nbytes, ktx_pointer(pixels))
+                    else:
+                        glTexSubImage2D(GL_TEXTURE_CUBE_MAP_POSITIVE_X + face, i, 0, 0, width, height, h.glformat, h.gltype, ktx_pointer(pixels))
+                continue
 
+            pixels = ktx_native(h, image.level_data(i))
+
+            if (target == GL_TEXTURE_1D):
+                if compressed:
+                    rawCompressedTexSubImage1D(target, i, 0, width, h.glinternalformat, pixels.nbytes, ktx_pointer(pixels))
+                else:
+                    glTexSubImage1D(target, i, 0, width, h.glformat, h.gltype, ktx_pointer(pixels))
+            elif (target == GL_TEXTURE_2D or target == GL_TEXTURE_1D_ARRAY):
+                if target == GL_TEXTURE_1D_ARRAY:
+                    height = layers
+                if compressed:
+                    rawCompressedTexSubImage2D(target, i, 0, 0, width, height, h.glinternalformat, pixels.nbytes, ktx_pointer(pixels))
+                else:
+                    glTexSubImage2D(target, i, 0, 0, width, height, h.glformat, h.gltype, ktx_pointer(pixels))
+            else:
+                if target != GL_TEXTURE_3D:
+                    depth = layers * faces
+                if compressed:
+                    rawCompressedTexSubImage3D(target, i, 0, 0, 0, width, height, depth, h.glinternalformat, pixels.nbytes, ktx_pointer(pixels))
+                else:
+                    glTexSubImage3D(target, i, 0, 0, 0, width, height, depth, h.glformat, h.gltype, ktx_pointer(pixels))
 
         if (h.miplevels == 1):
             glGenerateMipmap(target);
 
-    
-    
+
+
     #except:
     #    print("error reading file {}".format(filename))
 
-        return tex
\ No newline at end of file
+        return tex
@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+
+# Builds full mip chains on the CPU and bakes them into KTX files, so loading
+# is a plain copy instead of a glGenerateMipmap whose filter depends on the
+# driver.
+#
+# Each level is made from the one above it by a separable filter applied to
+# one axis at a time (width, height and, for 3D textures, depth), every tap
+# as one NumPy operation over the whole image:
+#
+#   box     the area average of the source texels under each new texel; a
+#           plain 2x2 average for even sizes, three weighted texels for odd
+#   kaiser  a Kaiser windowed sinc three texels wide (alpha 4), which keeps
+#           more detail without ringing much
+#
+# With --srgb (the default for sRGB internal formats) colour is converted to
+# linear before filtering and back afterwards; alpha is filtered as it is.
+# Edges clamp, or wrap with --wrap for tiling textures. Normalized integer
+# data is filtered in float and rounded back; half and float data (HDR
+# images) stays in float, and --half stores a float32 input as half floats.
+#
+# usage: python ktxmipmap.py input.ktx output.ktx [--filter box|kaiser] [--srgb|--linear] [--wrap] [--half]
+
+import sys
+import time
+import argparse
+
+import numpy as np
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+from ktxloader import ktx_read, ktx_image_array
+from ktxwriter import ktx_make_header, ktx_write
+
+KAISER_WIDTH = 3.0
+KAISER_ALPHA = 4.0
+
+MIP_SRGB_FORMATS = (GL_SRGB8, GL_SRGB8_ALPHA8, GL_SRGB, GL_SRGB_ALPHA)
+
+# Internal formats of the half float versions of float textures
+MIP_HALF_FORMATS = { GL_R32F: GL_R16F, GL_RG32F: GL_RG16F, GL_RGB32F: GL_RGB16F, GL_RGBA32F: GL_RGBA16F }
+
+
+def mip_levels(*sizes):
+    return int(max(sizes)).bit_length()
+
+
+def kaiser(x, width=KAISER_WIDTH, alpha=KAISER_ALPHA):
+    inside = np.abs(x) < width
+    t = np.where(inside, x / width, 0.0)
+    return np.where(inside, np.i0(alpha * np.sqrt(1.0 - t * t)) / np.i0(alpha), 0.0)
+
+
+# Taps for shrinking n texels to m: (m, k) source indices and weights that
+# sum to 1 along each row
+def filter_taps(n, m, kind, wrap):
+    scale = n / m
+    centres = (np.arange(m) + 0.5) * scale
+
+    if kind == 'box':
+        first = np.floor(centres - 0.5 * scale).astype(np.int64)
+        taps = int(np.ceil(scale)) + 1
+        index = first[:, None] + np.arange(taps)
+        # Overlap of each source texel [j, j + 1) with the footprint of the new one
+        low = np.maximum(index, (centres - 0.5 * scale)[:, None])
+        high = np.minimum(index + 1, (centres + 0.5 * scale)[:, None])
+        weights = np.maximum(high - low, 0.0)
+    elif kind == 'kaiser':
+        radius = KAISER_WIDTH * scale
+        first = np.floor(centres - 0.5 - radius).astype(np.int64)
+        taps = int(np.ceil(2.0 * radius)) + 2
+        index = first[:, None] + np.arange(taps)
+        x = (index + 0.5 - centres[:, None]) / scale
+        weights = np.sinc(x) * kaiser(x)
+    else:
+        raise ValueError("unknown filter {}".format(kind))
+
+    if wrap:
+        index = index % n
+    else:
+        index = np.clip(index, 0, n - 1)
+    weights = weights / weights.sum(axis=1, keepdims=True)
+    return index, weights
+
+
+# Shrinks axis of x to m texels
+def downsample_axis(x, axis, m, kind, wrap):
+    n = x.shape[axis]
+    if n == m:
+        return x
+    index, weights = filter_taps(n, m, kind, wrap)
+    x = np.moveaxis(x, axis, 0)
+    out = np.zeros((m,) + x.shape[1:], dtype=np.float32)
+    shape = (m,) + (1,) * (x.ndim - 1)
+    for k in range(index.shape[1]):
+        out += weights[:, k].astype(np.float32).reshape(shape) * x[index[:, k]]
+    return np.moveaxis(out, 0, axis)
+
+
+def srgb_to_linear(c):
+    return np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+
+def linear_to_srgb(c):
+    c = np.clip(c, 0.0, 1.0)
+    return np.where(c <= 0.0031308, c * 12.92, 1.055 * c ** (1.0 / 2.4) - 0.055)
+
+
+def to_float(image, srgb):
+    if image.dtype.kind == 'f':
+        x = image.astype(np.float32)
+    elif image.dtype.kind == 'u':
+        x = image.astype(np.float32) / np.iinfo(image.dtype).max
+    else:
+        raise ValueError("cannot filter {} data".format(image.dtype))
+    if srgb:
+        colour = min(x.shape[-1], 3)
+        x[..., :colour] = srgb_to_linear(x[..., :colour])
+    return x
+
+def from_float(x, dtype, srgb):
+    if srgb:
+        colour = min(x.shape[-1], 3)
+        x = x.copy()
+        x[..., :colour] = linear_to_srgb(x[..., :colour])
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        return x.astype(dtype)
+    top = np.iinfo(dtype).max
+    return np.rint(np.clip(x, 0.0, 1.0) * top).astype(dtype)
+
+
+# Full mip chain of image, a (depth, height, width, channels) array or a
+# stack of them (layers or faces, all filtered at once); depth shrinks too
+# when volume is set. Returns the levels, level 0 first, in the dtype of
+# image (or dtype)
+def mip_chain(image, kind='box', srgb=False, wrap=False, volume=False, dtype=None, levels=None):
+    dtype = image.dtype if dtype is None else dtype
+    depth, height, width = image.shape[-4:-1]
+    if levels is None:
+        levels = mip_levels(width, height, depth if volume else 1)
+
+    x = to_float(image, srgb)
+    # The negative lobes of the Kaiser filter must not take HDR data below 0
+    non_negative = x.size == 0 or x.min() >= 0.0
+    chain = [image.astype(dtype) if dtype != image.dtype else image]
+    for level in range(1, levels):
+        if volume:
+            x = downsample_axis(x, -4, max(depth >> level, 1), kind, wrap)
+        x = downsample_axis(x, -3, max(height >> level, 1), kind, wrap)
+        x = downsample_axis(x, -2, max(width >> level, 1), kind, wrap)
+        if non_negative:
+            x = np.maximum(x, 0.0)
+        chain.append(from_float(x, dtype, srgb))
+    return chain
+
+
+class MipReport:
+    def __init__(self):
+        self.pixels = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        return '{:.2f} Mpixels filtered in {:.1f} ms ({:.1f} Mpixels/s)'.format(
+            self.pixels / 1e6, self.seconds * 1000.0, self.pixels / max(self.seconds, 1e-9) / 1e6)
+
+
+# Reads level 0 of a KTX file and writes it again with a full chain
+def bake(input, output, kind='box', srgb=None, wrap=False, half=False):
+    image = ktx_read(input)
+    h = image.h
+    if srgb is None:
+        srgb = h.glinternalformat in MIP_SRGB_FORMATS
+
+    gltype, glinternalformat = h.gltype, h.glinternalformat
+    dtype = None
+    if half:
+        if h.gltype != GL_FLOAT or h.glinternalformat not in MIP_HALF_FORMATS:
+            raise ValueError("--half needs a 32 bit float texture")
+        gltype, glinternalformat, dtype = GL_HALF_FLOAT, MIP_HALF_FORMATS[h.glinternalformat], np.float16
+
+    # Every layer and face goes through the filters together
+    base = np.stack([ktx_image_array(image, 0, layer, face)
+                     for layer in range(max(h.arrayelements, 1)) for face in range(max(h.faces, 1))])
+    report = MipReport()
+    start = time.perf_counter()
+    chain = mip_chain(base, kind, srgb, wrap, h.pixeldepth > 0, dtype)
+    report.seconds = time.perf_counter() - start
+    report.pixels = sum(level.size // level.shape[-1] for level in chain[:-1])
+
+    levels = len(chain)
+    out = ktx_make_header(gltype, h.glformat, glinternalformat, h.pixelwidth, h.pixelheight, h.pixeldepth,
+                          h.arrayelements, max(h.faces, 1), levels)
+    ktx_write(output, out, [list(level) for level in chain],
+              {'KTXmipmapFilter': '{}{}'.format(kind, ' srgb' if srgb else '')})
+    return levels, report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bake a full mip chain into a KTX texture.')
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--filter', choices=('box', 'kaiser'), default='box')
+    colour = parser.add_mutually_exclusive_group()
+    colour.add_argument('--srgb', dest='srgb', action='store_const', const=True,
+                        help='filter colour in linear space (default for sRGB internal formats)')
+    colour.add_argument('--linear', dest='srgb', action='store_const', const=False,
+                        help='filter the stored values as they are')
+    parser.add_argument('--wrap', action='store_true', help='wrap at the edges, for tiling textures')
+    parser.add_argument('--half', action='store_true', help='store a 32 bit float texture as half floats')
+    args = parser.parse_args(argv)
+
+    try:
+        levels, report = bake(args.input, args.output, args.filter, args.srgb, args.wrap, args.half)
+    except ValueError as e:
+        print("{}: {}".format(args.input, e))
+        return 1
+    print('{} levels; {}'.format(levels, report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+#!/usr/bin/python3
+
+# Packs many small 2D textures into GL_TEXTURE_2D_ARRAY KTX files, so a
+# scene can draw many materials from a few bound arrays instead of binding a
+# texture per material.
+#
+# Inputs are KTX files (2D textures, or 2D arrays whose layers are packed one
+# by one as name[layer]) and PNG images, which need Pillow. They are grouped
+# by glType, glFormat, glInternalFormat and size; compressed textures group
+# by their block format like any other. Each group becomes one array of at
+# most --max-layers layers, with as many mip levels as its shortest member
+# has, or a full chain built for every member with --mipmaps (uncompressed
+# groups only). PNG rows are flipped to match the bottom-up rows of the KTX
+# files the samples use.
+#
+# Next to the arrays goes a JSON table from texture name to (array, layer):
+#
+#   arrays, lookup = load_texture_arrays('materials/textures.json')
+#   texture, layer = lookup['brick']
+#
+# usage: python ktxpack.py output_dir input.ktx|input.png ... [--prefix array] [--max-layers 256] [--mipmaps]
+
+import sys
+import os
+import json
+import argparse
+
+import numpy as np
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from ktxloader import ktx_read, ktx_target, ktx_image_array, KTXObject, KTX_COMPRESSED_BLOCKS
+from ktxwriter import ktx_make_header, ktx_write
+from ktxmipmap import mip_chain, MIP_SRGB_FORMATS
+
+KTX_PACK_VERSION = 1
+KTX_PACK_TABLE = 'textures.json'
+KTX_PACK_MAX_LAYERS = 256
+
+# Pillow mode -> glFormat, glInternalFormat
+PNG_FORMATS = { 'L': (GL_RED, GL_R8), 'LA': (GL_RG, GL_RG8), 'RGB': (GL_RGB, GL_RGB8), 'RGBA': (GL_RGBA, GL_RGBA8) }
+
+
+# One texture going into an array: its format key and the images of each
+# level, tightly packed
+class PackSource:
+    def __init__(self, name, key, gltypesize, levels):
+        self.name = name
+        self.key = key
+        self.gltypesize = gltypesize
+        self.levels = levels
+
+
+# (glType, glFormat, glInternalFormat, glBaseInternalFormat, width, height)
+def pack_key(h):
+    return (h.gltype, h.glformat, h.glinternalformat, h.glbaseinternalformat, h.pixelwidth, h.pixelheight)
+
+
+def ktx_sources(filename, name):
+    image = ktx_read(filename)
+    h = image.h
+    target = ktx_target(h)
+    if target not in (GL_TEXTURE_2D, GL_TEXTURE_2D_ARRAY):
+        raise ValueError("only 2D textures and 2D arrays can be packed")
+
+    def images(layer):
+        # Compressed images are tight already; everything else drops its row padding
+        if h.glinternalformat in KTX_COMPRESSED_BLOCKS and h.gltype == GL_NONE:
+            return [image.subresource(level, layer) for level in range(h.miplevels)]
+        return [ktx_image_array(image, level, layer) for level in range(h.miplevels)]
+
+    if target == GL_TEXTURE_2D:
+        return [PackSource(name, pack_key(h), h.gltypesize, images(0))]
+    return [PackSource('{}[{}]'.format(name, layer), pack_key(h), h.gltypesize, images(layer))
+            for layer in range(h.arrayelements)]
+
+
+def png_sources(filename, name):
+    if Image is None:
+        raise ValueError("reading PNG files needs Pillow")
+    with Image.open(filename) as png:
+        if png.mode not in PNG_FORMATS:
+            png = png.convert('RGBA' if 'A' in png.getbands() or 'transparency' in png.info else 'RGB')
+        glformat, glinternalformat = PNG_FORMATS[png.mode]
+        pixels = np.asarray(png, dtype=np.uint8)
+    pixels = pixels.reshape(pixels.shape[0], pixels.shape[1], -1)[::-1]
+    key = (GL_UNSIGNED_BYTE, glformat, glinternalformat, glformat, pixels.shape[1], pixels.shape[0])
+    return [PackSource(name, key, 1, [pixels[None]])]
+
+
+def read_sources(filenames):
+    sources = []
+    names = set()
+    for filename in filenames:
+        name, extension = os.path.splitext(os.path.basename(filename))
+        if name in names:
+            raise ValueError("{}: a texture named {} is already packed".format(filename, name))
+        names.add(name)
+        try:
+            if extension.lower() == '.png':
+                sources.extend(png_sources(filename, name))
+            else:
+                sources.extend(ktx_sources(filename, name))
+        except ValueError as e:
+            raise ValueError("{}: {}".format(filename, e))
+    return sources
+
+
+# Sources grouped by format and size, each group split into arrays of at
+# most max_layers
+def group_sources(sources, max_layers=KTX_PACK_MAX_LAYERS):
+    groups = {}
+    for source in sources:
+        groups.setdefault(source.key, []).append(source)
+    arrays = []
+    for key in sorted(groups):
+        members = groups[key]
+        for first in range(0, len(members), max_layers):
+            arrays.append(members[first:first + max_layers])
+    return arrays
+
+
+def write_array(filename, members, mipmaps=False):
+    gltype, glformat, glinternalformat, glbaseinternalformat, width, height = members[0].key
+    if mipmaps and gltype != GL_NONE:
+        srgb = glinternalformat in MIP_SRGB_FORMATS
+        stack = np.stack([np.asarray(member.levels[0]) for member in members])
+        chain = mip_chain(stack, 'box', srgb)
+        levels = [list(level) for level in chain]
+    else:
+        count = min(len(member.levels) for member in members)
+        levels = [[member.levels[level] for member in members] for level in range(count)]
+
+    h = ktx_make_header(gltype, glformat, glinternalformat, width, height, 0, len(members), 1, len(levels),
+                        gltypesize=members[0].gltypesize, glbaseinternalformat=glbaseinternalformat)
+    ktx_write(filename, h, levels)
+    return h
+
+
+# Writes the arrays and their table to output; returns the table
+def pack(filenames, output, prefix='array', max_layers=KTX_PACK_MAX_LAYERS, mipmaps=False):
+    os.makedirs(output, exist_ok=True)
+    table = { 'version': KTX_PACK_VERSION, 'arrays': [], 'textures': {} }
+    for index, members in enumerate(group_sources(read_sources(filenames), max_layers)):
+        name = '{}_{}.ktx'.format(prefix, index)
+        h = write_array(os.path.join(output, name), members, mipmaps)
+        table['arrays'].append({ 'file': name, 'glinternalformat': h.glinternalformat, 'width': h.pixelwidth,
+                                 'height': h.pixelheight, 'layers': len(members), 'levels': h.miplevels })
+        for layer, member in enumerate(members):
+            table['textures'][member.name] = [index, layer]
+    with open(os.path.join(output, KTX_PACK_TABLE), 'w') as f:
+        json.dump(table, f, indent=1)
+    return table
+
+
+def read_table(filename):
+    with open(filename) as f:
+        table = json.load(f)
+    if table.get('version') != KTX_PACK_VERSION:
+        raise ValueError("{}: unknown texture table version".format(filename))
+    return table
+
+
+# Loads every array of a table. Returns the texture names and a lookup from
+# texture name to (texture, layer)
+def load_texture_arrays(filename):
+    table = read_table(filename)
+    directory = os.path.dirname(filename)
+    arrays = [KTXObject().ktx_load(os.path.join(directory, a['file'])) for a in table['arrays']]
+    lookup = { name: (arrays[index], layer) for name, (index, layer) in table['textures'].items() }
+    return arrays, lookup
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pack 2D textures into texture array KTX files.')
+    parser.add_argument('output', help='directory for the arrays and ' + KTX_PACK_TABLE)
+    parser.add_argument('inputs', nargs='+')
+    parser.add_argument('--prefix', default='array', help='file name prefix of the arrays')
+    parser.add_argument('--max-layers', type=int, default=KTX_PACK_MAX_LAYERS)
+    parser.add_argument('--mipmaps', action='store_true', help='build a full mip chain for every layer')
+    args = parser.parse_args(argv)
+
+    try:
+        table = pack(args.inputs, args.output, args.prefix, args.max_layers, args.mipmaps)
+    except ValueError as e:
+        print(e)
+        return 1
+    for a in table['arrays']:
+        print('{}: {}x{} {:#06x}, {} layers, {} levels'.format(
+            a['file'], a['width'], a['height'], a['glinternalformat'], a['layers'], a['levels']))
+    print('{} textures in {} arrays'.format(len(table['textures']), len(table['arrays'])))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,338 @@
+#!/usr/bin/python3
+
+# Writes KTX 1.1 files in the layout of the specification, which ktx_read
+# loads directly: every level starts with its imageSize, rows are padded to
+# 4 bytes and cube faces and levels to 4 byte boundaries. Files are written
+# in native (little endian) byte order.
+#
+#   h = ktx_make_header(GL_UNSIGNED_BYTE, GL_RGBA, GL_RGBA8, 256, 256, miplevels=len(chain))
+#   ktx_write("out.ktx", h, [[level] for level in chain])
+#
+# KTXStreamWriter writes the same files an image or a strip of rows at a
+# time, and ktx_dump_texture uses it to save a GL texture (render targets,
+# HDR intermediates) one layer of one level at a time.
+
+import sys
+import ctypes
+
+import numpy as np
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+from ktxloader import header, identifier, align4, ktx_target, ktx_image_size, \
+    KTX_ENDIAN_REF, KTX_HEADER_FIELDS, KTX_HEADER_SIZE, KTX_TYPE_DTYPES, KTX_FORMAT_CHANNELS, KTX_COMPRESSED_BLOCKS
+
+# Reads into a pointer rather than returning a new array
+from OpenGL.raw.GL.VERSION.GL_4_5 import glGetTextureSubImage as rawGetTextureSubImage
+
+# Bytes a stream writer converts and writes at a time
+KTX_WRITE_CHUNK = 4 << 20
+
+# glType, glFormat and glBaseInternalFormat of the sized internal formats
+# ktx_format_header and ktx_dump_texture know
+KTX_SIZED_FORMATS = { GL_R8: (GL_UNSIGNED_BYTE, GL_RED, GL_RED), GL_RG8: (GL_UNSIGNED_BYTE, GL_RG, GL_RG),
+                      GL_RGB8: (GL_UNSIGNED_BYTE, GL_RGB, GL_RGB), GL_RGBA8: (GL_UNSIGNED_BYTE, GL_RGBA, GL_RGBA),
+                      GL_R16: (GL_UNSIGNED_SHORT, GL_RED, GL_RED), GL_RG16: (GL_UNSIGNED_SHORT, GL_RG, GL_RG),
+                      GL_RGBA16: (GL_UNSIGNED_SHORT, GL_RGBA, GL_RGBA),
+                      GL_R16F: (GL_HALF_FLOAT, GL_RED, GL_RED), GL_RG16F: (GL_HALF_FLOAT, GL_RG, GL_RG),
+                      GL_RGB16F: (GL_HALF_FLOAT, GL_RGB, GL_RGB), GL_RGBA16F: (GL_HALF_FLOAT, GL_RGBA, GL_RGBA),
+                      GL_R32F: (GL_FLOAT, GL_RED, GL_RED), GL_RG32F: (GL_FLOAT, GL_RG, GL_RG),
+                      GL_RGB32F: (GL_FLOAT, GL_RGB, GL_RGB), GL_RGBA32F: (GL_FLOAT, GL_RGBA, GL_RGBA),
+                      GL_R8UI: (GL_UNSIGNED_BYTE, GL_RED_INTEGER, GL_RED), GL_R8I: (GL_BYTE, GL_RED_INTEGER, GL_RED),
+                      GL_RG8UI: (GL_UNSIGNED_BYTE, GL_RG_INTEGER, GL_RG), GL_RG8I: (GL_BYTE, GL_RG_INTEGER, GL_RG),
+                      GL_RGBA8UI: (GL_UNSIGNED_BYTE, GL_RGBA_INTEGER, GL_RGBA), GL_RGBA8I: (GL_BYTE, GL_RGBA_INTEGER, GL_RGBA),
+                      GL_R16UI: (GL_UNSIGNED_SHORT, GL_RED_INTEGER, GL_RED), GL_R16I: (GL_SHORT, GL_RED_INTEGER, GL_RED),
+                      GL_RG16UI: (GL_UNSIGNED_SHORT, GL_RG_INTEGER, GL_RG), GL_RG16I: (GL_SHORT, GL_RG_INTEGER, GL_RG),
+                      GL_RGBA16UI: (GL_UNSIGNED_SHORT, GL_RGBA_INTEGER, GL_RGBA), GL_RGBA16I: (GL_SHORT, GL_RGBA_INTEGER, GL_RGBA),
+                      GL_R32UI: (GL_UNSIGNED_INT, GL_RED_INTEGER, GL_RED), GL_R32I: (GL_INT, GL_RED_INTEGER, GL_RED),
+                      GL_RG32UI: (GL_UNSIGNED_INT, GL_RG_INTEGER, GL_RG), GL_RG32I: (GL_INT, GL_RG_INTEGER, GL_RG),
+                      GL_RGB32UI: (GL_UNSIGNED_INT, GL_RGB_INTEGER, GL_RGB), GL_RGB32I: (GL_INT, GL_RGB_INTEGER, GL_RGB),
+                      GL_RGBA32UI: (GL_UNSIGNED_INT, GL_RGBA_INTEGER, GL_RGBA), GL_RGBA32I: (GL_INT, GL_RGBA_INTEGER, GL_RGBA),
+                      GL_DEPTH_COMPONENT32F: (GL_FLOAT, GL_DEPTH_COMPONENT, GL_DEPTH_COMPONENT) }
+
+
+# A header for the given format and size. height, depth and layers are 0
+# for the dimensions the texture does not have, as in the file
+def ktx_make_header(gltype, glformat, glinternalformat, width, height=0, depth=0, layers=0, faces=1, miplevels=1,
+                    gltypesize=None, glbaseinternalformat=None):
+    h = header()
+    h.identifier = ''.join(chr(c) for c in identifier)
+    h.endianness = KTX_ENDIAN_REF
+    h.gltype = gltype
+    if gltypesize is None:
+        gltypesize = np.dtype(KTX_TYPE_DTYPES[gltype]).itemsize if gltype in KTX_TYPE_DTYPES else 1
+    h.gltypesize = gltypesize
+    h.glformat = glformat
+    h.glinternalformat = glinternalformat
+    # Uncompressed files repeat glFormat; compressed ones name the base format
+    h.glbaseinternalformat = glformat if glbaseinternalformat is None else glbaseinternalformat
+    h.pixelwidth = width
+    h.pixelheight = height
+    h.pixeldepth = depth
+    h.arrayelements = layers
+    h.faces = faces
+    h.miplevels = miplevels
+    h.keypairbytes = 0
+    h.swapped = False
+    return h
+
+
+# A header for a sized internal format, e.g. GL_RGBA32F or GL_R32UI
+def ktx_format_header(glinternalformat, width, height=0, depth=0, layers=0, faces=1, miplevels=1):
+    if glinternalformat not in KTX_SIZED_FORMATS:
+        raise ValueError("no pixel type known for internal format {:#x}".format(glinternalformat))
+    gltype, glformat, glbaseinternalformat = KTX_SIZED_FORMATS[glinternalformat]
+    return ktx_make_header(gltype, glformat, glinternalformat, width, height, depth, layers, faces, miplevels,
+                           glbaseinternalformat=glbaseinternalformat)
+
+
+def ktx_keyvalue_bytes(keyvalues):
+    out = []
+    for key, value in (keyvalues or {}).items():
+        if isinstance(value, str):
+            value = value.encode('utf-8') + b'\0'
+        pair = key.encode('utf-8') + b'\0' + bytes(value)
+        out.append(np.uint32(len(pair)).tobytes())
+        out.append(pair)
+        out.append(b'\0' * (align4(len(pair)) - len(pair)))
+    return b''.join(out)
+
+
+def ktx_header_bytes(h):
+    words = np.array([getattr(h, name) for name in KTX_HEADER_FIELDS], dtype='<u4')
+    return bytes(identifier) + words.tobytes()
+
+
+# Layout of one level in a file being written: size of every image, the
+# tight and padded bytes of its rows and where each image starts
+class KTXWriteLevel:
+    def __init__(self, rows, row_bytes, row_stride, offsets):
+        self.rows = rows
+        self.row_bytes = row_bytes
+        self.row_stride = row_stride
+        self.offsets = offsets
+
+    @property
+    def tight_size(self):
+        return self.rows * self.row_bytes
+
+    @property
+    def image_size(self):
+        return self.rows * self.row_stride
+
+
+# Writes a KTX file one image, or a few rows of one, at a time, so a texture
+# never has to be in memory whole. The header, key/value data and every
+# imageSize go out when the writer is created and the file is sized to its
+# final length; write_image() and write_rows() then put data straight into
+# its place, in any order, converting row padding and byte order a chunk of
+# rows at a time; strided input is only made contiguous a chunk at a time
+# too. A row of a compressed image is a row of blocks; a 3D image
+# has the rows of all of its slices.
+#
+#   h = ktx_make_header(GL_FLOAT, GL_RGBA, GL_RGBA32F, 1024, 1024, miplevels=11)
+#   with KTXStreamWriter("bloom.ktx", h) as w:
+#       for level in range(11):
+#           w.write_image(level, read_level(level))
+class KTXStreamWriter:
+
+    def __init__(self, filename, h, keyvalues=None, chunk_size=KTX_WRITE_CHUNK):
+        if ktx_target(h) == GL_NONE:
+            raise ValueError("header does not describe a texture")
+        self.h = h
+        self.chunk_size = chunk_size
+        self.layers = max(h.arrayelements, 1)
+        self.faces = max(h.faces, 1)
+        cube = h.arrayelements == 0 and self.faces == 6
+
+        kv = ktx_keyvalue_bytes(keyvalues)
+        h.keypairbytes = len(kv)
+        h.miplevels = max(h.miplevels, 1)
+
+        self.levels = []
+        sizes = []
+        ptr = KTX_HEADER_SIZE + len(kv)
+        for level in range(h.miplevels):
+            width = max(h.pixelwidth >> level, 1)
+            height = 1 if h.pixelheight == 0 else max(h.pixelheight >> level, 1)
+            depth = max(h.pixeldepth >> level, 1)
+            padded = ktx_image_size(h, width, height, depth)
+            tight = ktx_image_size(h, width, height, depth, 1)
+            if padded is None:
+                raise ValueError("unknown format: glType {:#x}, glInternalFormat {:#x}".format(h.gltype, h.glinternalformat))
+            if h.gltype == GL_NONE:
+                block_height = KTX_COMPRESSED_BLOCKS[h.glinternalformat][1]
+                rows = depth * ((height + block_height - 1) // block_height)
+            else:
+                rows = depth * height
+
+            # Non-array cube maps give the size of one face, everything else the whole level
+            sizes.append((ptr, padded if cube else padded * self.layers * self.faces))
+            ptr += 4
+            offsets = []
+            for layer in range(self.layers):
+                offsets.append([])
+                for face in range(self.faces):
+                    offsets[layer].append(ptr)
+                    ptr += align4(padded) if cube else padded
+            ptr = align4(ptr)
+            self.levels.append(KTXWriteLevel(rows, tight // rows, padded // rows, offsets))
+        self.size = ptr
+        self.written = [np.zeros((self.layers, self.faces), dtype=np.int64) for _ in self.levels]
+
+        self.file = open(filename, 'wb')
+        self.file.write(ktx_header_bytes(h))
+        self.file.write(kv)
+        for offset, image_size in sizes:
+            self.file.seek(offset)
+            self.file.write(np.uint32(image_size).tobytes())
+        self.file.truncate(self.size)
+
+    # Writes rows first_row onwards of one image from data, an array or any
+    # buffer holding whole, tightly packed rows
+    def write_rows(self, level, first_row, data, layer=0, face=0):
+        lv = self.levels[level]
+        data = np.asarray(data)
+        if data.nbytes % lv.row_bytes:
+            raise ValueError("level {} rows are {} bytes, got {} bytes".format(level, lv.row_bytes, data.nbytes))
+        count = data.nbytes // lv.row_bytes
+        if first_row < 0 or first_row + count > lv.rows:
+            raise ValueError("rows {} to {} are past the {} rows of level {}".format(
+                first_row, first_row + count, lv.rows, level))
+
+        # Rows are cut from the elements of data in C order, so only the rows
+        # being written are copied or byte swapped. Rows that end inside an
+        # element can only be cut from the bytes of the whole input
+        if lv.row_bytes % data.itemsize:
+            if data.dtype.byteorder == '>':
+                data = data.astype(data.dtype.newbyteorder('<'))
+            data = np.ascontiguousarray(data).reshape(-1).view(np.uint8)
+        per_row = lv.row_bytes // data.itemsize
+        elements = data.reshape(-1) if data.flags.c_contiguous else data.flat
+        swap = data.dtype.byteorder == '>'
+
+        chunk = max(self.chunk_size // lv.row_stride, 1)
+        self.file.seek(lv.offsets[layer][face] + first_row * lv.row_stride)
+        for start in range(0, count, chunk):
+            part = np.asarray(elements[start * per_row:min(start + chunk, count) * per_row])
+            if swap:
+                part = part.astype(part.dtype.newbyteorder('<'))
+            part = part.view(np.uint8).reshape(-1, lv.row_bytes)
+            if lv.row_stride != lv.row_bytes:
+                padded = np.zeros((len(part), lv.row_stride), dtype=np.uint8)
+                padded[:, :lv.row_bytes] = part
+                part = padded
+            self.file.write(part.data)
+        self.written[level][layer, face] += count
+
+    # Writes a whole image of level: one face or layer, or all slices of a 3D
+    # texture, tightly packed in any shape
+    def write_image(self, level, data, layer=0, face=0):
+        data = np.asarray(data)
+        lv = self.levels[level]
+        if data.nbytes != lv.tight_size:
+            raise ValueError("level {} image is {} bytes, expected {}".format(level, data.nbytes, lv.tight_size))
+        self.write_rows(level, 0, data, layer, face)
+
+    # (level, layer, face) of every image not written in full yet
+    def missing(self):
+        return [(level, layer, face) for level, lv in enumerate(self.levels)
+                for layer in range(self.layers) for face in range(self.faces)
+                if self.written[level][layer, face] < lv.rows]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Writes filename from h and levels, where levels[i] lists the images of
+# level i, layer by layer with the faces of each layer in order
+def ktx_write(filename, h, levels, keyvalues=None):
+    h.miplevels = len(levels)
+    layers = max(h.arrayelements, 1)
+    faces = max(h.faces, 1)
+    with KTXStreamWriter(filename, h, keyvalues) as w:
+        for level, images in enumerate(levels):
+            if len(images) != layers * faces:
+                raise ValueError("level {} has {} images, expected {}".format(level, len(images), layers * faces))
+            for i, image in enumerate(images):
+                w.write_image(level, image, i // faces, i % faces)
+
+
+def texture_parameter(texture, pname):
+    value = GLint(0)
+    glGetTextureParameteriv(texture, pname, value)
+    return value.value
+
+def texture_level_parameter(texture, level, pname):
+    value = GLint(0)
+    glGetTextureLevelParameteriv(texture, level, pname, value)
+    return value.value
+
+
+# Saves levels of a GL texture to filename, reading back one layer, face or
+# slice at a time into a single buffer, so only that much is ever in client
+# memory. Needs GL 4.5 and an uncompressed internal format from
+# KTX_SIZED_FORMATS
+def ktx_dump_texture(filename, texture, levels=None, keyvalues=None):
+    target = texture_parameter(texture, GL_TEXTURE_TARGET)
+    glinternalformat = texture_level_parameter(texture, 0, GL_TEXTURE_INTERNAL_FORMAT)
+    width = texture_level_parameter(texture, 0, GL_TEXTURE_WIDTH)
+    height = texture_level_parameter(texture, 0, GL_TEXTURE_HEIGHT)
+    depth = texture_level_parameter(texture, 0, GL_TEXTURE_DEPTH)
+    if levels is None:
+        levels = 1
+        if texture_parameter(texture, GL_TEXTURE_IMMUTABLE_FORMAT):
+            levels = texture_parameter(texture, GL_TEXTURE_IMMUTABLE_LEVELS)
+
+    # GL keeps layers and faces in the height or depth; KTX counts them apart
+    layers, faces = 0, 1
+    if target == GL_TEXTURE_1D_ARRAY:
+        layers, height = height, 0
+    elif target == GL_TEXTURE_1D:
+        height = 0
+    elif target == GL_TEXTURE_2D_ARRAY:
+        layers = depth
+    elif target == GL_TEXTURE_CUBE_MAP:
+        faces = 6
+    elif target == GL_TEXTURE_CUBE_MAP_ARRAY:
+        layers, faces = depth // 6, 6
+    if target != GL_TEXTURE_3D:
+        depth = 0
+
+    h = ktx_format_header(glinternalformat, width, height, depth, layers, faces, levels)
+    pixel = np.dtype(KTX_TYPE_DTYPES[h.gltype]).itemsize * KTX_FORMAT_CHANNELS[h.glformat]
+    buffer = np.empty(max(width, 1) * max(height, 1) * pixel, dtype=np.uint8)
+    glPixelStorei(GL_PACK_ALIGNMENT, 1)
+
+    with KTXStreamWriter(filename, h, keyvalues) as w:
+        for level in range(levels):
+            lv = w.levels[level]
+            row_height = lv.rows // max(depth >> level, 1)
+            for layer in range(w.layers):
+                for face in range(w.faces):
+                    for z in range(max(depth >> level, 1)):
+                        # The one slice of GL's layered image this is
+                        y, slice_z, rows = 0, z, row_height
+                        if target == GL_TEXTURE_1D_ARRAY:
+                            y, slice_z = layer, 0
+                        elif target in (GL_TEXTURE_2D_ARRAY, GL_TEXTURE_CUBE_MAP, GL_TEXTURE_CUBE_MAP_ARRAY):
+                            slice_z = layer * w.faces + face
+                        size = rows * lv.row_bytes
+                        rawGetTextureSubImage(texture, level, 0, y, slice_z, lv.row_bytes // pixel, rows, 1,
+                                              h.glformat, h.gltype, size, ctypes.c_void_p(buffer.ctypes.data))
+                        w.write_rows(level, z * rows, buffer[:size], layer, face)
+    return h
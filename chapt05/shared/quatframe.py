@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+
+# Frames of reference kept as an origin and a unit quaternion, for cameras
+# and for many moving objects at once.
+#
+# GLFrame keeps separate forward and up vectors, which drift apart from
+# orthonormal as rotations pile up, and builds a 4x4 matrix to turn one
+# vector. Here the orientation is one quaternion (x, y, z, w, as sbmath's
+# m3dQuaternion44 takes them) that is renormalized after every change.
+# Frames start like GLFrame's: at the origin, forward down -Z and up +Y, and
+# the frame's own axes are x = up cross forward, up and forward.
+#
+# FrameBatch holds N frames in arrays, each with a velocity in world space,
+# a speed along its forward vector and an angular velocity in radians per
+# second about its own axes; step(dt) moves and turns all of them together
+# at a cost that does not grow with Python calls. matrices() gives the N
+# object matrices (GLFrame.GetMatrix) and camera_matrices() the N view
+# matrices, both as sbmath (N, 4, 4) stacks; the orientations can also go to
+# TransformTree.set_rotation as they are.
+#
+#   asteroids = FrameBatch(5000)
+#   asteroids.angular[:] = spin
+#   ...every frame:
+#   asteroids.step(dt)
+#   asteroids.matrices(out=model)
+#
+# QuatFrame is a single frame with the GLFrame method names.
+
+import sys
+
+import numpy as np
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+from sbmath import m3dOut44, m3dQuaternion, m3dQuaternion44, m3dQuatMultiply, m3dQuatRotate, m3dQuatNormalize
+
+# Forward -Z, up +Y: half a turn about Y
+FRAME_ORIENTATION = (0.0, 1.0, 0.0, 0.0)
+FRAME_AXES = np.eye(3, dtype=np.float32)
+
+
+class FrameBatch:
+
+    def __init__(self, count):
+        self.count = count
+        self.origin = np.zeros((count, 3), dtype=np.float32)
+        self.orientation = np.tile(np.array(FRAME_ORIENTATION, dtype=np.float32), (count, 1))
+        # World units per second
+        self.velocity = np.zeros((count, 3), dtype=np.float32)
+        # Along forward, world units per second
+        self.speed = np.zeros(count, dtype=np.float32)
+        # Radians per second about the frames' own x, up and forward axes
+        self.angular = np.zeros((count, 3), dtype=np.float32)
+        self.turn = np.empty((count, 4), dtype=np.float32)
+
+    # The frames' own axes in world space: 0 is x, 1 up and 2 forward
+    def axis(self, axis, frames=slice(None)):
+        return m3dQuatRotate(self.orientation[frames], FRAME_AXES[axis])
+
+    def forward(self, frames=slice(None)):
+        return self.axis(2, frames)
+
+    def up(self, frames=slice(None)):
+        return self.axis(1, frames)
+
+    def right(self, frames=slice(None)):
+        return self.axis(0, frames)
+
+    # Moves frames by offsets (..., 3) along their own x, up and forward axes
+    def move_local(self, offsets, frames=slice(None)):
+        self.origin[frames] += m3dQuatRotate(self.orientation[frames], offsets)
+
+    def move_forward(self, delta, frames=slice(None)):
+        self.origin[frames] += self.forward(frames) * np.asarray(delta, dtype=np.float32)[..., None]
+
+    # Turns frames by angle radians about axis (..., 3) given in their own axes
+    def rotate_local(self, angle, axis, frames=slice(None)):
+        q = m3dQuatMultiply(self.orientation[frames], m3dQuaternion(angle, axis))
+        self.orientation[frames] = m3dQuatNormalize(q, out=q)
+
+    # Turns frames by angle radians about axis (..., 3) given in world space
+    def rotate_world(self, angle, axis, frames=slice(None)):
+        q = m3dQuatMultiply(m3dQuaternion(angle, axis), self.orientation[frames])
+        self.orientation[frames] = m3dQuatNormalize(q, out=q)
+
+    def normalize(self):
+        m3dQuatNormalize(self.orientation, out=self.orientation)
+
+    # Integrates the angular velocities, then the velocities and speeds along
+    # the new forward vectors, over dt seconds
+    def step(self, dt):
+        rate = np.sqrt((self.angular * self.angular).sum(axis=-1))
+        m3dQuaternion(rate * np.float32(dt), self.angular, out=self.turn)
+        m3dQuatMultiply(self.orientation, self.turn, out=self.orientation)
+        m3dQuatNormalize(self.orientation, out=self.orientation)
+
+        move = self.forward()
+        move *= (self.speed * np.float32(dt))[:, None]
+        move += self.velocity * np.float32(dt)
+        self.origin += move
+
+    # Object matrices: the frames' axes and origins as columns
+    def matrices(self, out=None, frames=slice(None), rotation_only=False):
+        q = self.orientation[frames]
+        out = m3dQuaternion44(q, m3dOut44(q.shape[:-1], out))
+        if not rotation_only:
+            out[..., 3, :3] = self.origin[frames]
+        return out
+
+    # View matrices of cameras placed at the frames, looking down forward
+    # with up as up, as m3dLookAt44(origin, origin + forward, up) gives them
+    def camera_matrices(self, out=None, frames=slice(None), rotation_only=False):
+        q = self.orientation[frames]
+        out = m3dQuaternion44(q, m3dOut44(q.shape[:-1], out))
+        # Camera axes -x, up, -forward, as the rows of the rotation
+        out[..., 0, :3] *= -1.0
+        out[..., 2, :3] *= -1.0
+        if rotation_only:
+            t = 0.0
+        else:
+            t = -np.matmul(out[..., :3, :3], self.origin[frames][..., None])[..., 0]
+        out[..., :3, :3] = np.swapaxes(out[..., :3, :3], -1, -2).copy()
+        out[..., 3, :3] = t
+        return out
+
+
+class QuatFrame:
+
+    def __init__(self):
+        self.frames = FrameBatch(1)
+
+    def setOrigin(self, x, y, z):
+        self.frames.origin[0] = (x, y, z)
+
+    def GetOrigin(self):
+        return self.frames.origin[0].copy()
+
+    def GetForwardVector(self):
+        return self.frames.forward()[0]
+
+    def GetUpVector(self):
+        return self.frames.up()[0]
+
+    def GetMatrix(self, bRotationOnly = False):
+        return self.frames.matrices(rotation_only=bRotationOnly)[0]
+
+    def GetCameraOrientation(self):
+        return self.frames.camera_matrices(rotation_only=True)[0]
+
+    def GetCameraMatrix(self, bRotOnly = False):
+        return self.frames.camera_matrices(rotation_only=bRotOnly)[0]
+
+    def ApplyCameraTransform(self, bRotOnly = False):
+        glMultMatrixf(self.GetCameraMatrix(bRotOnly))
+
+    def ApplyActorTransform(self, bRotationOnly = False):
+        glMultMatrixf(self.GetMatrix(bRotationOnly))
+
+    def MoveForward(self, fDelta):
+        self.frames.move_local((0.0, 0.0, fDelta))
+
+    def MoveUp(self, fDelta):
+        self.frames.move_local((0.0, fDelta, 0.0))
+
+    def MoveRight(self, fDelta):
+        self.frames.move_local((fDelta, 0.0, 0.0))
+
+    def RotateLocalX(self, fAngle):
+        self.frames.rotate_local(fAngle, (1.0, 0.0, 0.0))
+
+    def RotateLocalY(self, fAngle):
+        self.frames.rotate_local(fAngle, (0.0, 1.0, 0.0))
+
+    def RotateLocalZ(self, fAngle):
+        self.frames.rotate_local(fAngle, (0.0, 0.0, 1.0))
+
+    def RotateWorld(self, fAngle, x, y, z):
+        self.frames.rotate_world(fAngle, (x, y, z))
+
+    def Normalize(self):
+        self.frames.normalize()
@@ -168,4 +168,449 @@ def m3dLookAt(eye, target, up):
 def scale(s):
     return [s,0,0,0, 0,s,0,0, 0,0,s,0, 0,0,0,1]     
     
-    
\ No newline at end of file
+    
+
+# Batched transforms. A matrix is a (4, 4) float32 array holding the 16
+# floats of the m3d functions above in the same column major order, so
+# m[3, :3] is the translation and a (4, 4) or (N, 4, 4) array goes to
+# glUniformMatrix4fv (or a buffer) as it is. Every function takes scalars or
+# arrays for its arguments, broadcasts them to a batch shape and returns a
+# batch shape + (4, 4) array: plain numbers give one matrix, arrays of N
+# values give N of them. Results are written to out when it is given, which
+# must be float32 and of the result shape; nothing else is allocated then
+# beyond a few (N,) temporaries.
+#
+#   mv = np.empty((24, 4, 4), np.float32)
+#   m3dTranslation44(offsets, out=W)
+#   m3dMultiply44(W, R, out=mv)
+
+def m3dOut44(shape, out):
+    shape = tuple(shape) + (4, 4)
+    if out is None:
+        return np.empty(shape, dtype=np.float32)
+    if out.shape != shape or out.dtype != np.float32:
+        raise ValueError("out is {} {}, expected float32 {}".format(out.dtype, out.shape, shape))
+    return out
+
+# One identity matrix, n of them, or out (any batch shape) set to identity
+def m3dIdentity44(n=None, out=None):
+    if out is None:
+        out = m3dOut44(() if n is None else (n,), None)
+    out[...] = 0.0
+    out[..., 0, 0] = out[..., 1, 1] = out[..., 2, 2] = out[..., 3, 3] = 1.0
+    return out
+
+# t is (..., 3)
+def m3dTranslation44(t, out=None):
+    t = np.asarray(t, dtype=np.float32)
+    out = m3dIdentity44(out=m3dOut44(t.shape[:-1], out))
+    out[..., 3, :3] = t
+    return out
+
+# s is (..., 3), or a scalar for a uniform scale
+def m3dScaling44(s, out=None):
+    s = np.asarray(s, dtype=np.float32)
+    if s.ndim == 0:
+        s = np.full(3, s, dtype=np.float32)
+    elif s.shape[-1] != 3:
+        raise ValueError("scales are {}, expected (..., 3)".format(s.shape))
+    out = m3dOut44(s.shape[:-1], out)
+    out[...] = 0.0
+    out[..., 0, 0] = s[..., 0]
+    out[..., 1, 1] = s[..., 1]
+    out[..., 2, 2] = s[..., 2]
+    out[..., 3, 3] = 1.0
+    return out
+
+# The rotation of m3dRotationMatrix44: angle in radians (...), axis (..., 3).
+# Axes of zero length give the identity
+def m3dRotation44(angle, axis, out=None):
+    angle = np.asarray(angle, dtype=np.float32)
+    axis = np.asarray(axis, dtype=np.float32)
+    shape = np.broadcast_shapes(angle.shape, axis.shape[:-1])
+    out = m3dOut44(shape, out)
+
+    mag = np.sqrt((axis * axis).sum(axis=-1))
+    inv = np.where(mag == 0.0, 0.0, 1.0 / np.where(mag == 0.0, 1.0, mag)).astype(np.float32)
+    x, y, z = axis[..., 0] * inv, axis[..., 1] * inv, axis[..., 2] * inv
+    s = np.sin(angle)
+    c = np.where(mag == 0.0, 1.0, np.cos(angle)).astype(np.float32)
+    s = np.where(mag == 0.0, 0.0, s).astype(np.float32)
+    one_c = 1.0 - c
+
+    out[..., 0, 0] = one_c * x * x + c
+    out[..., 0, 1] = one_c * x * y - z * s
+    out[..., 0, 2] = one_c * z * x + y * s
+    out[..., 1, 0] = one_c * x * y + z * s
+    out[..., 1, 1] = one_c * y * y + c
+    out[..., 1, 2] = one_c * y * z - x * s
+    out[..., 2, 0] = one_c * z * x - y * s
+    out[..., 2, 1] = one_c * y * z + x * s
+    out[..., 2, 2] = one_c * z * z + c
+    out[..., :3, 3] = 0.0
+    out[..., 3, :3] = 0.0
+    out[..., 3, 3] = 1.0
+    return out
+
+# Unit quaternions (..., 4) as x, y, z, w for a rotation of angle radians
+# about axis, turning the same way as m3dRotation44
+def m3dQuaternion(angle, axis, out=None):
+    angle = np.asarray(angle, dtype=np.float32)
+    axis = np.asarray(axis, dtype=np.float32)
+    shape = np.broadcast_shapes(angle.shape, axis.shape[:-1])
+    if out is None:
+        out = np.empty(shape + (4,), dtype=np.float32)
+    mag = np.sqrt((axis * axis).sum(axis=-1))
+    s = np.where(mag == 0.0, 0.0, np.sin(angle * 0.5) / np.where(mag == 0.0, 1.0, mag))
+    out[..., :3] = axis * s[..., None]
+    out[..., 3] = np.where(mag == 0.0, 1.0, np.cos(angle * 0.5))
+    return out
+
+# The rotation of unit quaternions q (..., 4), x, y, z, w
+def m3dQuaternion44(q, out=None):
+    q = np.asarray(q, dtype=np.float32)
+    out = m3dOut44(q.shape[:-1], out)
+    x, y, z, w = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    xx, yy, zz = x * x, y * y, z * z
+    xy, xz, yz = x * y, x * z, y * z
+    wx, wy, wz = w * x, w * y, w * z
+
+    out[..., 0, 0] = 1.0 - 2.0 * (yy + zz)
+    out[..., 0, 1] = 2.0 * (xy - wz)
+    out[..., 0, 2] = 2.0 * (xz + wy)
+    out[..., 1, 0] = 2.0 * (xy + wz)
+    out[..., 1, 1] = 1.0 - 2.0 * (xx + zz)
+    out[..., 1, 2] = 2.0 * (yz - wx)
+    out[..., 2, 0] = 2.0 * (xz - wy)
+    out[..., 2, 1] = 2.0 * (yz + wx)
+    out[..., 2, 2] = 1.0 - 2.0 * (xx + yy)
+    out[..., :3, 3] = 0.0
+    out[..., 3, :3] = 0.0
+    out[..., 3, 3] = 1.0
+    return out
+
+# Quaternions for the rotations of m3dMultiply44 of the matrices of a and b:
+# b first, then a, as the product of the matrices
+def m3dQuatMultiply(a, b, out=None):
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    if out is None:
+        out = np.empty(np.broadcast_shapes(a.shape, b.shape), dtype=np.float32)
+    ax, ay, az, aw = a[..., 0], a[..., 1], a[..., 2], a[..., 3]
+    bx, by, bz, bw = b[..., 0], b[..., 1], b[..., 2], b[..., 3]
+    x = bw * ax + bx * aw + by * az - bz * ay
+    y = bw * ay - bx * az + by * aw + bz * ax
+    z = bw * az + bx * ay - by * ax + bz * aw
+    w = bw * aw - bx * ax - by * ay - bz * az
+    # out may be a or b
+    out[..., 0] = x
+    out[..., 1] = y
+    out[..., 2] = z
+    out[..., 3] = w
+    return out
+
+# Vectors v (..., 3) turned by q as m3dQuaternion44(q) turns them
+def m3dQuatRotate(q, v, out=None):
+    q = np.asarray(q, dtype=np.float32)
+    v = np.asarray(v, dtype=np.float32)
+    if out is None:
+        out = np.empty(np.broadcast_shapes(q.shape[:-1], v.shape[:-1]) + (3,), dtype=np.float32)
+    # v + w t + u x t with t = 2 u x v, for u the conjugate's vector part
+    ux, uy, uz, w = -q[..., 0], -q[..., 1], -q[..., 2], q[..., 3]
+    vx, vy, vz = v[..., 0], v[..., 1], v[..., 2]
+    tx = 2.0 * (uy * vz - uz * vy)
+    ty = 2.0 * (uz * vx - ux * vz)
+    tz = 2.0 * (ux * vy - uy * vx)
+    x = vx + w * tx + uy * tz - uz * ty
+    y = vy + w * ty + uz * tx - ux * tz
+    z = vz + w * tz + ux * ty - uy * tx
+    out[..., 0] = x
+    out[..., 1] = y
+    out[..., 2] = z
+    return out
+
+# q scaled back to unit length; zero quaternions become the identity
+def m3dQuatNormalize(q, out=None):
+    q = np.asarray(q, dtype=np.float32)
+    if out is None:
+        out = np.empty(q.shape, dtype=np.float32)
+    mag = np.sqrt((q * q).sum(axis=-1, keepdims=True))
+    np.divide(q, np.where(mag == 0.0, 1.0, mag), out=out)
+    out[..., 3:] += (mag == 0.0)
+    return out
+
+# Translation (..., 3), quaternion (..., 4) and scale (..., 3, or a scalar
+# for a uniform scale) composed as T * R * S: scale first, then rotate, then
+# move
+def m3dTRS44(t, q, s, out=None):
+    t = np.asarray(t, dtype=np.float32)
+    s = np.asarray(s, dtype=np.float32)
+    if s.ndim == 0:
+        s = np.full(3, s, dtype=np.float32)
+    out = m3dQuaternion44(q, out)
+    out[..., :3, :3] *= s[..., :, None]
+    out[..., 3, :3] = t
+    return out
+
+# As m3dPerspective, fov_y in radians
+def m3dPerspective44(fov_y, aspect, n, f, out=None):
+    fov_y, aspect, n, f = (np.asarray(v, dtype=np.float32) for v in (fov_y, aspect, n, f))
+    out = m3dOut44(np.broadcast_shapes(fov_y.shape, aspect.shape, n.shape, f.shape), out)
+    ta = np.tan(fov_y / 2.0)
+    out[...] = 0.0
+    out[..., 0, 0] = 1.0 / (ta * aspect)
+    out[..., 1, 1] = 1.0 / ta
+    out[..., 2, 2] = -(f + n) / (f - n)
+    out[..., 2, 3] = -1.0
+    out[..., 3, 2] = -2.0 * f * n / (f - n)
+    return out
+
+# As m3dOrtho
+def m3dOrtho44(l, r, t, b, n, f, out=None):
+    l, r, t, b, n, f = (np.asarray(v, dtype=np.float32) for v in (l, r, t, b, n, f))
+    out = m3dOut44(np.broadcast_shapes(l.shape, r.shape, t.shape, b.shape, n.shape, f.shape), out)
+    out[...] = 0.0
+    out[..., 0, 0] = 2.0 / (r - l)
+    out[..., 1, 1] = 2.0 / (t - b)
+    out[..., 2, 2] = -2.0 / (f - n)
+    out[..., 3, 0] = -(r + l) / (r - l)
+    out[..., 3, 1] = -(t + b) / (t - b)
+    out[..., 3, 2] = -(f + n) / (f - n)
+    out[..., 3, 3] = 1.0
+    return out
+
+# A view matrix looking from eye at target, each (..., 3). Unlike m3dLookAt
+# every axis of the translation is -dot(axis, eye), so the eye ends up at
+# the origin whatever its x and y
+def m3dLookAt44(eye, target, up, out=None):
+    eye, target, up = (np.asarray(v, dtype=np.float32) for v in (eye, target, up))
+    shape = np.broadcast_shapes(eye.shape, target.shape, up.shape)
+    out = m3dOut44(shape[:-1], out)
+
+    def unit(v):
+        return v / np.sqrt((v * v).sum(axis=-1, keepdims=True))
+
+    mz = unit(np.broadcast_to(eye - target, shape))
+    mx = unit(np.cross(np.broadcast_to(up, shape), mz))
+    my = np.cross(mz, mx)
+    eye = np.broadcast_to(eye, shape)
+    for i, axis in enumerate((mx, my, mz)):
+        out[..., :3, i] = axis
+        out[..., 3, i] = -(axis * eye).sum(axis=-1)
+    out[..., :3, 3] = 0.0
+    out[..., 3, 3] = 1.0
+    return out
+
+# The product of m3dMultiply(A, B) for every pair of a and b, broadcast.
+# out may be a or b
+def m3dMultiply44(a, b, out=None):
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    out = m3dOut44(np.broadcast_shapes(a.shape[:-2], b.shape[:-2]), out)
+    return np.matmul(b, a, out=out)
+
+# m3dMultiply44(m[0], m3dMultiply44(m[1], ...)) for a list of matrices or
+# batches, as the composition of a transform chain W * T * R
+def m3dChain44(matrices, out=None):
+    result = np.asarray(matrices[-1], dtype=np.float32)
+    if len(matrices) == 1:
+        out = m3dOut44(result.shape[:-2], out)
+        out[...] = result
+        return out
+    for i in range(len(matrices) - 2, -1, -1):
+        result = m3dMultiply44(matrices[i], result, out if i == 0 else None)
+    return result
+
+# Points (..., 3) transformed by m, divided by w
+def m3dTransformPoints44(m, points, out=None):
+    points = np.asarray(points, dtype=np.float32)
+    m = np.asarray(m, dtype=np.float32)
+    p = np.matmul(points[..., None, :], m[..., :3, :])[..., 0, :] + m[..., 3, :]
+    result = p[..., :3] / p[..., 3:]
+    if out is None:
+        return result
+    out[...] = result
+    return out
+
+# Inverses. Inverting the transpose gives the transposed inverse, so the
+# column-major (4, 4) arrays are inverted as they are. The results, and the
+# (..., 3, 4) normal matrices, are laid out as std140 mat4 and mat3 arrays:
+# they can be copied into a uniform block as they are.
+
+# Cross products of a and b, (..., 3)
+def m3dCross3(a, b, out=None):
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    if out is None:
+        out = np.empty(np.broadcast_shapes(a.shape, b.shape), dtype=np.float32)
+    x = a[..., 1] * b[..., 2] - a[..., 2] * b[..., 1]
+    y = a[..., 2] * b[..., 0] - a[..., 0] * b[..., 2]
+    z = a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+    out[..., 0] = x
+    out[..., 1] = y
+    out[..., 2] = z
+    return out
+
+# Where out overlaps m the result is built aside and copied at the end
+def m3dInverseOut(m, out):
+    out = m3dOut44(m.shape[:-2], out)
+    return out, (np.empty(out.shape, dtype=np.float32) if np.may_share_memory(out, m) else out)
+
+def m3dCheckSingular(det):
+    singular = np.count_nonzero(det == 0.0)
+    if singular:
+        raise ValueError("{} singular matrices".format(singular))
+
+# Cofactors of the upper 3x3 of m, (..., 3, 3), and its determinant: the
+# inverse of the 3x3 is the transposed cofactors over the determinant
+def m3dCofactors33(m):
+    r0, r1, r2 = m[..., 0, :3], m[..., 1, :3], m[..., 2, :3]
+    c = np.empty(m.shape[:-2] + (3, 3), dtype=np.float32)
+    m3dCross3(r1, r2, out=c[..., 0, :])
+    m3dCross3(r2, r0, out=c[..., 1, :])
+    m3dCross3(r0, r1, out=c[..., 2, :])
+    det = (r0 * c[..., 0, :]).sum(axis=-1)
+    return c, det
+
+# Any invertible m (..., 4, 4), by cofactor expansion over 2x2 minors as
+# m3dInvertMatrix44 in ../shared/math3d.py does it
+def m3dGeneralInverse44(m, out=None):
+    m = np.asarray(m, dtype=np.float32)
+    out, dst = m3dInverseOut(m, out)
+    a00, a01, a02, a03 = m[..., 0, 0], m[..., 0, 1], m[..., 0, 2], m[..., 0, 3]
+    a10, a11, a12, a13 = m[..., 1, 0], m[..., 1, 1], m[..., 1, 2], m[..., 1, 3]
+    a20, a21, a22, a23 = m[..., 2, 0], m[..., 2, 1], m[..., 2, 2], m[..., 2, 3]
+    a30, a31, a32, a33 = m[..., 3, 0], m[..., 3, 1], m[..., 3, 2], m[..., 3, 3]
+
+    s0 = a00 * a11 - a10 * a01
+    s1 = a00 * a12 - a10 * a02
+    s2 = a00 * a13 - a10 * a03
+    s3 = a01 * a12 - a11 * a02
+    s4 = a01 * a13 - a11 * a03
+    s5 = a02 * a13 - a12 * a03
+    c5 = a22 * a33 - a32 * a23
+    c4 = a21 * a33 - a31 * a23
+    c3 = a21 * a32 - a31 * a22
+    c2 = a20 * a33 - a30 * a23
+    c1 = a20 * a32 - a30 * a22
+    c0 = a20 * a31 - a30 * a21
+
+    det = s0 * c5 - s1 * c4 + s2 * c3 + s3 * c2 - s4 * c1 + s5 * c0
+    m3dCheckSingular(det)
+    inv = 1.0 / det
+
+    dst[..., 0, 0] = (a11 * c5 - a12 * c4 + a13 * c3) * inv
+    dst[..., 0, 1] = (-a01 * c5 + a02 * c4 - a03 * c3) * inv
+    dst[..., 0, 2] = (a31 * s5 - a32 * s4 + a33 * s3) * inv
+    dst[..., 0, 3] = (-a21 * s5 + a22 * s4 - a23 * s3) * inv
+    dst[..., 1, 0] = (-a10 * c5 + a12 * c2 - a13 * c1) * inv
+    dst[..., 1, 1] = (a00 * c5 - a02 * c2 + a03 * c1) * inv
+    dst[..., 1, 2] = (-a30 * s5 + a32 * s2 - a33 * s1) * inv
+    dst[..., 1, 3] = (a20 * s5 - a22 * s2 + a23 * s1) * inv
+    dst[..., 2, 0] = (a10 * c4 - a11 * c2 + a13 * c0) * inv
+    dst[..., 2, 1] = (-a00 * c4 + a01 * c2 - a03 * c0) * inv
+    dst[..., 2, 2] = (a30 * s4 - a31 * s2 + a33 * s0) * inv
+    dst[..., 2, 3] = (-a20 * s4 + a21 * s2 - a23 * s0) * inv
+    dst[..., 3, 0] = (-a10 * c3 + a11 * c1 - a12 * c0) * inv
+    dst[..., 3, 1] = (a00 * c3 - a01 * c1 + a02 * c0) * inv
+    dst[..., 3, 2] = (-a30 * s3 + a31 * s1 - a32 * s0) * inv
+    dst[..., 3, 3] = (a20 * s3 - a21 * s1 + a22 * s0) * inv
+    if dst is not out:
+        out[...] = dst
+    return out
+
+# -t times the inverted 3x3 already in dst, for t the translation of m
+def m3dInverseTranslation(m, dst):
+    t0, t1, t2 = m[..., 3, 0], m[..., 3, 1], m[..., 3, 2]
+    for j in range(3):
+        dst[..., 3, j] = -(t0 * dst[..., 0, j] + t1 * dst[..., 1, j] + t2 * dst[..., 2, j])
+
+# Affine m: 3x3 part and translation, with 0, 0, 0, 1 as the last row
+def m3dAffineInverse44(m, out=None):
+    m = np.asarray(m, dtype=np.float32)
+    out, dst = m3dInverseOut(m, out)
+    a00, a01, a02 = m[..., 0, 0], m[..., 0, 1], m[..., 0, 2]
+    a10, a11, a12 = m[..., 1, 0], m[..., 1, 1], m[..., 1, 2]
+    a20, a21, a22 = m[..., 2, 0], m[..., 2, 1], m[..., 2, 2]
+
+    c00 = a11 * a22 - a12 * a21
+    c01 = a12 * a20 - a10 * a22
+    c02 = a10 * a21 - a11 * a20
+    det = a00 * c00 + a01 * c01 + a02 * c02
+    m3dCheckSingular(det)
+    inv = 1.0 / det
+
+    dst[..., 0, 0] = c00 * inv
+    dst[..., 1, 0] = c01 * inv
+    dst[..., 2, 0] = c02 * inv
+    dst[..., 0, 1] = (a21 * a02 - a22 * a01) * inv
+    dst[..., 1, 1] = (a22 * a00 - a20 * a02) * inv
+    dst[..., 2, 1] = (a20 * a01 - a21 * a00) * inv
+    dst[..., 0, 2] = (a01 * a12 - a02 * a11) * inv
+    dst[..., 1, 2] = (a02 * a10 - a00 * a12) * inv
+    dst[..., 2, 2] = (a00 * a11 - a01 * a10) * inv
+    m3dInverseTranslation(m, dst)
+    dst[..., :3, 3] = 0.0
+    dst[..., 3, 3] = 1.0
+    if dst is not out:
+        out[...] = dst
+    return out
+
+# Rigid m: rotation and translation only, as view matrices and frames are.
+# The rotation is transposed, nothing is divided
+def m3dRigidInverse44(m, out=None):
+    m = np.asarray(m, dtype=np.float32)
+    out, dst = m3dInverseOut(m, out)
+    dst[..., :3, :3] = np.swapaxes(m[..., :3, :3], -1, -2)
+    m3dInverseTranslation(m, dst)
+    dst[..., :3, 3] = 0.0
+    dst[..., 3, 3] = 1.0
+    if dst is not out:
+        out[...] = dst
+    return out
+
+# True where m is affine
+def m3dIsAffine44(m):
+    m = np.asarray(m)
+    return (m[..., :3, 3] == 0.0).all(axis=-1) & (m[..., 3, 3] == 1.0)
+
+# Inverses of m (..., 4, 4): affine matrices through their 3x3, the others
+# in full. rigid=True says they are all rotations and translations
+def m3dInverse44(m, out=None, rigid=False):
+    m = np.asarray(m, dtype=np.float32)
+    if rigid:
+        return m3dRigidInverse44(m, out)
+    # Cheaper than the per matrix test, for the common all affine batch
+    if not m[..., :3, 3].any() and (m[..., 3, 3] == 1.0).all():
+        return m3dAffineInverse44(m, out)
+    affine = m3dIsAffine44(m)
+    if not affine.any():
+        return m3dGeneralInverse44(m, out)
+    out = m3dOut44(m.shape[:-2], out)
+    general = ~affine
+    parts = m[affine], m[general]
+    out[affine] = m3dAffineInverse44(parts[0])
+    out[general] = m3dGeneralInverse44(parts[1])
+    return out
+
+# Normal matrices of m (..., 4, 4): the inverse transpose of the upper 3x3.
+# With std140 each column is padded to a vec4, (..., 3, 4), as a mat3 is in
+# a uniform block; without it they are (..., 3, 3) for glUniformMatrix3fv.
+# rigid=True says the 3x3 parts are rotations, which are their own normal
+# matrices
+def m3dNormalMatrix(m, out=None, std140=True, rigid=False):
+    m = np.asarray(m, dtype=np.float32)
+    shape = m.shape[:-2] + (3, 4 if std140 else 3)
+    if out is None:
+        out = np.empty(shape, dtype=np.float32)
+    elif out.shape != shape or out.dtype != np.float32:
+        raise ValueError("out is {} {}, expected float32 {}".format(out.dtype, out.shape, shape))
+    if rigid:
+        out[..., :3] = m[..., :3, :3]
+    else:
+        c, det = m3dCofactors33(m)
+        m3dCheckSingular(det)
+        np.divide(c, det[..., None, None], out=out[..., :3])
+    if std140:
+        out[..., 3] = 0.0
+    return out
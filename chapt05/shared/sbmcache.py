@@ -0,0 +1,273 @@
+#!/usr/bin/python3
+
+# Preprocessed binary cache for SBM models.
+#
+# The first time a model is loaded through the cache its chunk stream is
+# parsed and validated once, the attributes are interleaved into a single
+# vertex blob and everything SBMObject needs is written out as:
+#
+#   page 0..   SBM_CACHE_HEADER, attribute declarations, sub-object table,
+#              position scale/bias table for quantized models, bounds of
+#              every sub-object followed by those of the whole model
+#   next page  interleaved vertices, indices 16 byte aligned behind them
+#
+# Cache files are named after the SHA-1 of the source contents and
+# SBM_CACHE_VERSION, so editing a model or changing the layout written here
+# simply produces a new file. The hash is kept next to the cache entries in a
+# small stamp file per source with the size and mtime it was taken at, and is
+# only worked out again once either changes, so a warm load stats the source
+# rather than reading it. It then maps the cache, views the tables and uploads
+# vertices and indices with one glBufferData call.
+#
+# SBMObject.load(filename, cache_dir) goes through sbm_cache_read.
+
+import sys
+import os
+import json
+import hashlib
+import numpy as np
+
+from sbmloader import SBMData, sbm_read, SB6M_FOURCC, SB6M_CHUNKS, SB6M_INDEX_DTYPE, SB6M_VERTEX_ATTRIB_DECL, \
+    SB6M_VERTEX_ATTRIB_DECL_DTYPE, SB6M_SUB_OBJECT_DECL_DTYPE, SB6M_POSITION_SCALE_BIAS_DTYPE, SB6M_BOUNDS_DTYPE, \
+    sb6m_view, sb6m_attrib_size, sb6m_attrib_rows, sb6m_compute_bounds, sb6m_payload
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+SBM_CACHE_MAGIC = SB6M_FOURCC('S','B','M','C')
+
+# Bump whenever the cache layout or what the loader stores in it changes
+SBM_CACHE_VERSION = 4
+
+SBM_CACHE_PAGE_SIZE = 4096
+
+# Real path -> (size, mtime, source hash) of the sources seen by this process
+_sbm_source_hashes = {}
+
+SBM_CACHE_HEADER_DTYPE = np.dtype([('magic', '<u4'), ('version', '<u4'), ('source_hash', 'S20'),
+                                   ('total_vertices', '<u4'), ('index_type', '<u4'), ('index_count', '<u4'),
+                                   ('attrib_count', '<u4'), ('sub_object_count', '<u4'),
+                                   ('attrib_offset', '<u4'), ('sub_object_offset', '<u4'),
+                                   ('data_offset', '<u4'), ('data_size', '<u4'), ('index_offset', '<u4'),
+                                   ('quantization_offset', '<u4'), ('quantization_count', '<u4'),
+                                   ('bounds_offset', '<u4')])
+
+
+def align(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+def sbm_source_hash(filename):
+    h = hashlib.sha1()
+    h.update(SBM_CACHE_MAGIC.to_bytes(4, 'little'))
+    h.update(SBM_CACHE_VERSION.to_bytes(4, 'little'))
+    if os.path.getsize(filename) > 0:
+        h.update(memoryview(np.memmap(filename, dtype=np.uint8, mode='r')))
+    return h.digest()
+
+def sbm_stamp_path(path, cache_dir):
+    name = hashlib.sha1(path.encode('utf-8', 'surrogateescape')).hexdigest()[:16]
+    return os.path.join(cache_dir, '{}.{}.sbmk'.format(os.path.basename(path), name))
+
+def sbm_read_stamp(stamp_filename):
+    try:
+        with open(stamp_filename) as f:
+            stamp = json.load(f)
+        if stamp['version'] != SBM_CACHE_VERSION:
+            return None
+        return stamp['size'], stamp['mtime_ns'], bytes.fromhex(stamp['hash'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def sbm_write_stamp(stamp_filename, path, known):
+    os.makedirs(os.path.dirname(stamp_filename) or '.', exist_ok=True)
+    temp_filename = '{}.{}.tmp'.format(stamp_filename, os.getpid())
+    with open(temp_filename, 'w') as f:
+        json.dump({'version': SBM_CACHE_VERSION, 'source': path, 'size': known[0], 'mtime_ns': known[1],
+                   'hash': known[2].hex()}, f)
+    os.replace(temp_filename, stamp_filename)
+
+# sbm_source_hash of filename, hashed again only when its size or mtime is
+# not what it was the last time, in this process or one that left a stamp
+# in cache_dir
+def sbm_source_key(filename, cache_dir):
+    path = os.path.realpath(filename)
+    st = os.stat(path)
+    known = _sbm_source_hashes.get(path)
+    if known is None or known[:2] != (st.st_size, st.st_mtime_ns):
+        stamp_filename = sbm_stamp_path(path, cache_dir)
+        known = sbm_read_stamp(stamp_filename)
+        if known is None or known[:2] != (st.st_size, st.st_mtime_ns):
+            known = (st.st_size, st.st_mtime_ns, sbm_source_hash(path))
+            sbm_write_stamp(stamp_filename, path, known)
+        _sbm_source_hashes[path] = known
+    return known[2]
+
+def sbm_cache_path(filename, cache_dir, source_hash=None):
+    if source_hash is None:
+        source_hash = sbm_source_hash(filename)
+    return os.path.join(cache_dir, '{}.{}.sbmc'.format(os.path.basename(filename), source_hash.hex()))
+
+
+# Parses and validates filename and writes the cache file to cache_filename.
+# Returns False if the model has nothing that could be cached.
+def sbm_cache_build(filename, cache_filename, source_hash=None):
+    if source_hash is None:
+        source_hash = sbm_source_hash(filename)
+
+    data = np.memmap(filename, dtype=np.uint8, mode='r')
+    chunks = SB6M_CHUNKS(data)
+
+    if not (chunks.vertex_data_chunk and chunks.vertex_attrib_chunk):
+        print("{} has no vertex data to cache".format(filename))
+        return False
+
+    total_vertices = chunks.vertex_data_chunk.total_vertices
+    payload = sb6m_payload(data, chunks)
+    start = chunks.vertex_data_chunk.data_offset
+    vertex_data = payload[start:start + chunks.vertex_data_chunk.data_size]
+
+    # Interleave the attributes, keeping every one of them 4 byte aligned
+    attribs = chunks.vertex_attrib_chunk.attrib_data
+    offsets = []
+    stride = 0
+    for attrib in attribs:
+        offsets.append(stride)
+        stride += align(sb6m_attrib_size(attrib), 4)
+
+    vertices = np.zeros((total_vertices, stride), dtype=np.uint8)
+    decls = np.zeros(len(attribs), dtype=SB6M_VERTEX_ATTRIB_DECL_DTYPE)
+    for i, attrib in enumerate(attribs):
+        rows = sb6m_attrib_rows(vertex_data, attrib, total_vertices)
+        vertices[:, offsets[i]:offsets[i] + rows.shape[1]] = rows
+        decls[i] = (attrib.name.encode('ascii', 'replace'), attrib.size, attrib.type, stride, attrib.flags, offsets[i])
+
+    index_type = GL_NONE
+    index_count = 0
+    indices = np.zeros(0, dtype=np.uint8)
+
+    index_data_chunk = chunks.index_data_chunk
+    if index_data_chunk and index_data_chunk.index_type in SB6M_INDEX_DTYPE:
+        index_type = index_data_chunk.index_type
+        index_count = index_data_chunk.index_count
+        index_dtype = SB6M_INDEX_DTYPE[index_type]
+        start = index_data_chunk.index_data_offset
+        indices = payload[start:start + index_count * index_dtype.itemsize].view(index_dtype)
+        if index_count and int(indices.max()) >= total_vertices:
+            raise ValueError("{} has indices past the last vertex".format(filename))
+
+    if chunks.sub_object_chunk:
+        sub_objects = np.array(chunks.sub_object_chunk.sub_object, dtype=SB6M_SUB_OBJECT_DECL_DTYPE)
+    else:
+        sub_objects = np.array([(0, index_count if index_type != GL_NONE else total_vertices)],
+                               dtype=SB6M_SUB_OBJECT_DECL_DTYPE)
+
+    limit = index_count if index_type != GL_NONE else total_vertices
+    if np.any(sub_objects['first'].astype(np.int64) + sub_objects['count'] > limit):
+        raise ValueError("{} has sub-objects past the end of the mesh".format(filename))
+
+    if chunks.quantization_chunk:
+        position_scale_bias = np.array(chunks.quantization_chunk.position_scale_bias)
+    else:
+        position_scale_bias = np.zeros(0, dtype=SB6M_POSITION_SCALE_BIAS_DTYPE)
+
+    sub_object_bounds, model_bounds = sb6m_compute_bounds(
+        vertex_data, attribs, total_vertices, indices if index_type != GL_NONE else None,
+        sub_objects['first'], sub_objects['count'], position_scale_bias)
+    bounds = np.concatenate((sub_object_bounds, model_bounds))
+
+    header = np.zeros(1, dtype=SBM_CACHE_HEADER_DTYPE)
+    h = header[0]
+    h['magic'] = SBM_CACHE_MAGIC
+    h['version'] = SBM_CACHE_VERSION
+    h['source_hash'] = source_hash
+    h['total_vertices'] = total_vertices
+    h['index_type'] = index_type
+    h['index_count'] = index_count
+    h['attrib_count'] = len(decls)
+    h['sub_object_count'] = len(sub_objects)
+    h['attrib_offset'] = SBM_CACHE_HEADER_DTYPE.itemsize
+    h['sub_object_offset'] = h['attrib_offset'] + decls.nbytes
+    h['quantization_offset'] = h['sub_object_offset'] + sub_objects.nbytes
+    h['quantization_count'] = len(position_scale_bias)
+    h['bounds_offset'] = h['quantization_offset'] + position_scale_bias.nbytes
+    h['data_offset'] = align(int(h['bounds_offset']) + bounds.nbytes, SBM_CACHE_PAGE_SIZE)
+    h['index_offset'] = align(vertices.nbytes, 16)
+    h['data_size'] = int(h['index_offset']) + indices.nbytes
+
+    # Write next to the final name and rename, so a crashed or concurrent
+    # build never leaves a half written cache behind
+    os.makedirs(os.path.dirname(cache_filename) or '.', exist_ok=True)
+    temp_filename = '{}.{}.tmp'.format(cache_filename, os.getpid())
+    with open(temp_filename, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(decls.tobytes())
+        f.write(sub_objects.tobytes())
+        f.write(position_scale_bias.tobytes())
+        f.write(bounds.tobytes())
+        f.write(bytes(int(h['data_offset']) - f.tell()))
+        f.write(vertices.tobytes())
+        f.write(bytes(int(h['index_offset']) - vertices.nbytes))
+        f.write(indices.tobytes())
+    os.replace(temp_filename, cache_filename)
+    return True
+
+
+class SBMCache:
+    # A mapped cache file; everything here is a view into the map
+    def __init__(self, cache_filename, source_hash=None):
+        self.map = np.memmap(cache_filename, dtype=np.uint8, mode='r')
+        if self.map.size < SBM_CACHE_HEADER_DTYPE.itemsize:
+            raise ValueError("{} is too small to be an SBM cache".format(cache_filename))
+
+        h = sb6m_view(self.map, 0, SBM_CACHE_HEADER_DTYPE)[0]
+        if int(h['magic']) != SBM_CACHE_MAGIC or int(h['version']) != SBM_CACHE_VERSION:
+            raise ValueError("{} is not a version {} SBM cache".format(cache_filename, SBM_CACHE_VERSION))
+        # NumPy drops the trailing zero bytes of an S20 field when it reads one
+        if source_hash is not None and bytes(h['source_hash']).ljust(len(source_hash), b'\0') != source_hash:
+            raise ValueError("{} was built from different source data".format(cache_filename))
+
+        self.total_vertices = int(h['total_vertices'])
+        self.index_type = int(h['index_type'])
+        self.index_count = int(h['index_count'])
+        self.index_offset = int(h['index_offset'])
+        self.attribs = [SB6M_VERTEX_ATTRIB_DECL(d) for d in
+                        sb6m_view(self.map, int(h['attrib_offset']), SB6M_VERTEX_ATTRIB_DECL_DTYPE, int(h['attrib_count']))]
+        self.sub_object = sb6m_view(self.map, int(h['sub_object_offset']), SB6M_SUB_OBJECT_DECL_DTYPE, int(h['sub_object_count']))
+        self.position_scale_bias = None
+        if int(h['quantization_count']):
+            self.position_scale_bias = sb6m_view(self.map, int(h['quantization_offset']), SB6M_POSITION_SCALE_BIAS_DTYPE,
+                                                 int(h['quantization_count']))
+        bounds = sb6m_view(self.map, int(h['bounds_offset']), SB6M_BOUNDS_DTYPE, int(h['sub_object_count']) + 1)
+        self.sub_object_bounds = bounds[:-1]
+        self.model_bounds = bounds[-1:]
+
+        start = int(h['data_offset'])
+        self.data = self.map[start:start + int(h['data_size'])]
+
+
+# Reads filename through the cache in cache_dir, building the cache entry
+# first if there is none for the current contents. Returns an SBMData
+def sbm_cache_read(filename, cache_dir):
+    source_hash = sbm_source_key(filename, cache_dir)
+    cache_filename = sbm_cache_path(filename, cache_dir, source_hash)
+
+    cache = None
+    if os.path.exists(cache_filename):
+        try:
+            cache = SBMCache(cache_filename, source_hash)
+        except ValueError as e:
+            print(e)
+
+    if cache is None:
+        if not sbm_cache_build(filename, cache_filename, source_hash):
+            return sbm_read(filename)
+        cache = SBMCache(cache_filename, source_hash)
+
+    return SBMData(cache.data, cache.attribs, cache.total_vertices, cache.index_type, cache.index_count,
+                   None, cache.index_offset, cache.sub_object['first'], cache.sub_object['count'],
+                   cache.position_scale_bias, cache.sub_object_bounds, cache.model_bounds)
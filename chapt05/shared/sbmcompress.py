@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+
+# Rewrites an SBM model with its vertices and indices in a compressed DATA
+# chunk of independently decodable blocks.
+#
+# The loader decodes the blocks in parallel, straight into a mapped
+# GL_ARRAY_BUFFER when SBMObject.load is called on the GL thread. The report
+# compares the sizes and the time to get the payload into memory from the
+# original and the compressed file, the decode throughput in MB of decoded
+# data per second and the time to read the raw bytes from disk.
+#
+# usage: python sbmcompress.py input.sbm output.sbm [--encoding zlib|lzma] [--level 6] [--block-kb 256]
+
+import sys
+import os
+import io
+import time
+import argparse
+import contextlib
+
+import numpy as np
+
+from sbmloader import sbm_read, sbm_read_mesh, SB6M_CHUNKS, SB6M_DATA_ENCODING, sb6m_payload
+from sbmoptimize import sbm_write_mesh
+
+SBM_COMPRESS_ENCODINGS = { 'zlib': SB6M_DATA_ENCODING.SB6M_DATA_ENCODING_ZLIB,
+                           'lzma': SB6M_DATA_ENCODING.SB6M_DATA_ENCODING_LZMA }
+
+TIMING_RUNS = 5
+
+
+# Median time to get the payload of filename into memory
+def time_payload(filename):
+    times = []
+    for _ in range(TIMING_RUNS):
+        start = time.perf_counter()
+        data = np.fromfile(filename, dtype=np.uint8)
+        with contextlib.redirect_stdout(io.StringIO()):
+            chunks = SB6M_CHUNKS(data)
+        payload = sb6m_payload(data, chunks)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)), payload.nbytes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compress the vertex and index data of an SBM model.')
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--encoding', choices=sorted(SBM_COMPRESS_ENCODINGS), default='zlib')
+    parser.add_argument('--level', type=int, default=None, help='zlib level or lzma preset')
+    parser.add_argument('--block-kb', type=int, default=256, help='decoded size of each block')
+    args = parser.parse_args(argv)
+
+    mesh = sbm_read_mesh(args.input)
+    if mesh is None:
+        print("{} has no vertex data".format(args.input))
+        return 1
+
+    sbm_write_mesh(args.output, mesh, encoding=SBM_COMPRESS_ENCODINGS[args.encoding],
+                   block_size=args.block_kb * 1024, level=args.level)
+
+    raw_size = os.path.getsize(args.input)
+    size = os.path.getsize(args.output)
+    raw_time, _ = time_payload(args.input)
+    packed_time, decoded = time_payload(args.output)
+
+    print('{:<12} {:>12} {:>12}'.format('', 'bytes', 'load ms'))
+    print('{:<12} {:>12} {:>12.2f}'.format('original', raw_size, raw_time * 1000.0))
+    print('{:<12} {:>12} {:>12.2f}'.format(args.encoding, size, packed_time * 1000.0))
+    print('ratio {:.2f}, decoded {:.1f} MB/s'.format(raw_size / max(size, 1),
+                                                   decoded / (1024.0 * 1024.0) / max(packed_time, 1e-9)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,584 @@
+#!/usr/bin/python3
+
+# Streaming OBJ / PLY to SBM converter.
+#
+# The input is read a chunk at a time and never held in memory as a whole.
+# Corners are welded into an indexed mesh through a hash index (OBJ corners on
+# their position / texcoord / normal indices, PLY vertices on their bytes),
+# new vertices go straight to the output through SBMStreamWriter and indices
+# to a temporary file until the index type is known.
+#
+# Memory is bounded by --memory-mb. The OBJ position, texcoord and normal
+# pools and the PLY vertex remap table are SpillArrays that move to temporary
+# files once they outgrow their share, and the weld index is started over
+# when it does, at the cost of some vertices being written more than once.
+#
+# OBJ groups, objects and material changes and PLY files as a whole become
+# sub-objects. Polygons are triangulated as fans. An OBJ file gets texcoords
+# and normals if any of its faces refers to them, and zeros where a face
+# does not.
+#
+# The output is an ordinary SBM file, so the welded vertices and indices
+# together must stay under 4 GB; past that the conversion stops with an error.
+#
+# usage: python sbmconvert.py input.obj|input.ply output.sbm [--memory-mb 256] [--chunk-mb 16]
+
+import sys
+import os
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from sbmloader import SB6M_VERTEX_ATTRIB_FLAG_NORMALIZED
+from sbmwriter import SBMAttrib, SBMStreamWriter, sbm_vertex_layout, sbm_interleave
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+# Rough cost of one weld index entry, key and dict slot included
+WELD_ENTRY_BYTES = 200
+
+
+def peak_rss():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class SpillArray:
+    # Append only (n, width) array. It lives in memory until it grows past
+    # limit bytes and in a temporary file from then on; take() works either way
+    def __init__(self, width, dtype, limit, tempdir=None):
+        self.width = width
+        self.dtype = np.dtype(dtype)
+        self.limit = limit
+        self.tempdir = tempdir
+        self.count = 0
+        self.data = np.zeros((1024, width), dtype=self.dtype)
+        self.file = None
+        self.filename = None
+        self.map = None
+
+    @property
+    def spilled(self):
+        return self.file is not None
+
+    def append(self, rows):
+        rows = np.asarray(rows, dtype=self.dtype).reshape(-1, self.width)
+        if self.file is None and (self.count + len(rows)) * self.width * self.dtype.itemsize > self.limit:
+            fd, self.filename = tempfile.mkstemp(suffix='.spill', dir=self.tempdir)
+            self.file = os.fdopen(fd, 'w+b')
+            self.file.write(self.data[:self.count].tobytes())
+            self.data = None
+
+        if self.file is not None:
+            self.file.write(rows.tobytes())
+        else:
+            if self.count + len(rows) > len(self.data):
+                grown = np.zeros((max(2 * len(self.data), self.count + len(rows)), self.width), dtype=self.dtype)
+                grown[:self.count] = self.data[:self.count]
+                self.data = grown
+            self.data[self.count:self.count + len(rows)] = rows
+        self.count += len(rows)
+
+    def take(self, index):
+        if self.file is None:
+            return self.data[:self.count][index]
+        if self.map is None or len(self.map) != self.count:
+            self.file.flush()
+            self.map = np.memmap(self.filename, dtype=self.dtype, mode='r', shape=(self.count, self.width))
+        return self.map[index]
+
+    def close(self):
+        self.map = None
+        if self.file is not None:
+            self.file.close()
+            os.remove(self.filename)
+            self.file = None
+
+
+class Welder:
+    # Hash index from a vertex key to its output vertex
+    def __init__(self, limit):
+        self.index = {}
+        self.max_entries = max(limit // WELD_ENTRY_BYTES, 1)
+        self.vertex_count = 0
+        self.resets = 0
+
+    # Returns the output vertex of every key and the positions in keys of
+    # the ones seen for the first time, which are the new vertices in order
+    def weld(self, keys):
+        index = self.index
+        out = np.empty(len(keys), dtype=np.int64)
+        new = []
+        for i, key in enumerate(keys):
+            v = index.get(key)
+            if v is None:
+                if len(index) >= self.max_entries:
+                    index.clear()
+                    self.resets += 1
+                v = self.vertex_count
+                self.vertex_count += 1
+                index[key] = v
+                new.append(i)
+            out[i] = v
+        return out, np.array(new, dtype=np.int64)
+
+
+# Output attributes, in binding order, and how each one is stored
+SBM_CONVERT_ATTRIBS = [('position', 3, GL_FLOAT, np.float32, 0),
+                       ('normal', 3, GL_FLOAT, np.float32, 0),
+                       ('map1', 2, GL_FLOAT, np.float32, 0),
+                       ('color', 4, GL_UNSIGNED_BYTE, np.uint8, SB6M_VERTEX_ATTRIB_FLAG_NORMALIZED)]
+
+class VertexLayout:
+    def __init__(self, names):
+        self.specs = [a for a in SBM_CONVERT_ATTRIBS if a[0] in names]
+        attribs = [SBMAttrib(name, size, type, np.zeros((1, size), dtype=dtype), flags)
+                   for name, size, type, dtype, flags in self.specs]
+        self.decls, self.offsets, self.stride = sbm_vertex_layout(attribs)
+
+    # values maps attribute names to (n, size) arrays; returns (n, stride) bytes
+    def interleave(self, values):
+        attribs = [SBMAttrib(name, size, type, np.ascontiguousarray(values[name], dtype=dtype), flags)
+                   for name, size, type, dtype, flags in self.specs]
+        return sbm_interleave(attribs, self.offsets, self.stride)
+
+
+class ConvertReport:
+    # input_vertices counts what the file lists (OBJ positions, PLY vertices)
+    # and vertices what was written after welding (OBJ corners, PLY vertices)
+    def __init__(self, filename, input_name='vertices', output_name='vertices'):
+        self.filename = filename
+        self.input_name = input_name
+        self.output_name = output_name
+        self.input_bytes = os.path.getsize(filename)
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+        self.input_vertices = 0
+        self.vertices = 0
+        self.triangles = 0
+        self.sub_objects = 0
+        self.weld_resets = 0
+        self.spilled = []
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.start
+
+    def __str__(self):
+        rss = peak_rss()
+        mb = self.input_bytes / (1024.0 * 1024.0)
+        lines = ['{}: {:.1f} MB in {:.2f} s, {:.1f} MB/s, peak RSS {}'.format(
+                     self.filename, mb, self.seconds, mb / max(self.seconds, 1e-9),
+                     'n/a' if rss is None else '{:.1f} MB'.format(rss / (1024.0 * 1024.0))),
+                 '{} {}, {} unique {}, {} triangles, {} sub-objects'.format(
+                     self.input_vertices, self.input_name, self.vertices, self.output_name,
+                     self.triangles, self.sub_objects)]
+        if self.weld_resets:
+            lines.append('weld index restarted {} times to stay under the memory cap'.format(self.weld_resets))
+        if self.spilled:
+            lines.append('spilled to disk: {}'.format(', '.join(self.spilled)))
+        return '\n'.join(lines)
+
+
+# Triangulates polygons given as (count, vertices) rows as fans
+def fan_triangles(polygons):
+    triangles = []
+    for polygon in polygons:
+        for i in range(1, len(polygon) - 1):
+            triangles.append((polygon[0], polygon[i], polygon[i + 1]))
+    return np.array(triangles, dtype=np.int64).reshape(-1, 3)
+
+
+def obj_index(token, count):
+    i = int(token)
+    return i - 1 if i > 0 else count + i
+
+def obj_floats(lines, width):
+    rows = [(l.split()[1:] + ['0'] * width)[:width] for l in lines]
+    return np.array(rows, dtype=np.float32).reshape(-1, width)
+
+# Whether any face of an OBJ file refers to texcoords and to normals. The
+# whole file is scanned up front so that the layout fits every face, and
+# corners without them get zeros
+def obj_face_attributes(filename, chunk_bytes):
+    found = [False, False]
+    with open(filename, 'r', errors='replace') as f:
+        while not all(found):
+            lines = f.readlines(chunk_bytes)
+            if not lines:
+                break
+            for line in lines:
+                if not line.startswith('f ') or '/' not in line:
+                    continue
+                for token in line.split()[1:]:
+                    parts = token.split('/') + ['', '']
+                    found[0] = found[0] or bool(parts[1])
+                    found[1] = found[1] or bool(parts[2])
+    return found
+
+
+def convert_obj(filename, output, memory, chunk_bytes, tempdir=None):
+    report = ConvertReport(filename, 'positions', 'corners')
+    share = memory // 4
+    pools = {'v': SpillArray(3, np.float32, share, tempdir),
+             'vt': SpillArray(2, np.float32, share, tempdir),
+             'vn': SpillArray(3, np.float32, share, tempdir)}
+    welder = Welder(share)
+    pending = {'v': [], 'vt': [], 'vn': []}
+    corners = []
+    texcoords, normals = obj_face_attributes(filename, chunk_bytes)
+    names = ['position'] + (['map1'] if texcoords else []) + (['normal'] if normals else [])
+    state = {'layout': VertexLayout(names), 'writer': None}
+
+    def counts():
+        return [pools[k].count + len(pending[k]) for k in ('v', 'vt', 'vn')]
+
+    def flush():
+        for key, lines in pending.items():
+            if lines:
+                pools[key].append(obj_floats(lines, pools[key].width))
+                lines.clear()
+        if not corners:
+            return
+
+        keys = [tuple(c) for c in corners]
+        corners.clear()
+        if state['writer'] is None:
+            state['writer'] = SBMStreamWriter(output, state['layout'].decls, state['layout'].stride, tempdir)
+            state['writer'].begin_sub_object()
+
+        indices, new = welder.weld(keys)
+        if len(new):
+            k = np.array(keys, dtype=np.int64)[new]
+            values = {'position': pools['v'].take(k[:, 0])}
+            for name, column, pool in (('map1', 1, pools['vt']), ('normal', 2, pools['vn'])):
+                if name not in names:
+                    continue
+                rows = np.zeros((len(k), pool.width), dtype=np.float32)
+                used = k[:, column] >= 0
+                rows[used] = pool.take(k[used, column])
+                values[name] = rows
+            state['writer'].write_vertices(state['layout'].interleave(values))
+        state['writer'].write_indices(indices)
+        report.triangles += len(indices) // 3
+
+    with open(filename, 'r', errors='replace') as f:
+        while True:
+            lines = f.readlines(chunk_bytes)
+            if not lines:
+                break
+            for line in lines:
+                if line.startswith('v '):
+                    pending['v'].append(line)
+                elif line.startswith('vt'):
+                    pending['vt'].append(line)
+                elif line.startswith('vn'):
+                    pending['vn'].append(line)
+                elif line.startswith('f '):
+                    count = counts()
+                    polygon = []
+                    for token in line.split()[1:]:
+                        parts = token.split('/') + ['', '']
+                        polygon.append([obj_index(parts[i], count[i]) if parts[i] else -1 for i in range(3)])
+                    for i in range(1, len(polygon) - 1):
+                        corners += (polygon[0], polygon[i], polygon[i + 1])
+                elif line.startswith(('o ', 'g ', 'usemtl')):
+                    flush()
+                    if state['writer'] is not None:
+                        state['writer'].begin_sub_object()
+            flush()
+
+    if state['writer'] is None:
+        state['writer'] = SBMStreamWriter(output, state['layout'].decls, state['layout'].stride, tempdir)
+
+    report.input_vertices = pools['v'].count
+    report.spilled = [key for key, pool in pools.items() if pool.spilled]
+    for pool in pools.values():
+        pool.close()
+    return finish(report, state['writer'], welder)
+
+
+def finish(report, writer, welder):
+    writer.close()
+    report.vertices = writer.vertex_count
+    report.sub_objects = max(len([s for s in writer.sub_objects if s[1] > 0]), 1)
+    report.weld_resets = welder.resets
+    report.finish()
+    return report
+
+
+PLY_TYPES = {'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1', 'short': 'i2', 'int16': 'i2',
+             'ushort': 'u2', 'uint16': 'u2', 'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+             'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8'}
+
+class PLYElement:
+    def __init__(self, name, count):
+        self.name = name
+        self.count = count
+        # (name, type) or (name, count type, item type) for lists
+        self.properties = []
+
+    def has_lists(self):
+        return any(len(p) == 3 for p in self.properties)
+
+    def dtype(self, order):
+        return np.dtype([(p[0], order + PLY_TYPES[p[1]]) for p in self.properties])
+
+
+def read_ply_header(f):
+    if f.readline().strip() != b'ply':
+        raise ValueError("not a PLY file")
+    format = None
+    elements = []
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError("PLY header has no end_header")
+        words = line.decode('ascii', 'replace').split()
+        if not words or words[0] in ('comment', 'obj_info'):
+            continue
+        if words[0] == 'end_header':
+            break
+        if words[0] == 'format':
+            format = words[1]
+        elif words[0] == 'element':
+            elements.append(PLYElement(words[1], int(words[2])))
+        elif words[0] == 'property':
+            if words[1] == 'list':
+                elements[-1].properties.append((words[4], words[2], words[3]))
+            else:
+                elements[-1].properties.append((words[2], words[1]))
+    if format not in ('ascii', 'binary_little_endian', 'binary_big_endian'):
+        raise ValueError("unsupported PLY format {}".format(format))
+    return format, elements
+
+
+# Reads one record of an element with list properties; returns the values
+# of every property, lists as arrays
+def read_ply_record(f, element, order):
+    values = []
+    for p in element.properties:
+        if len(p) == 3:
+            count_type = np.dtype(order + PLY_TYPES[p[1]])
+            item_type = np.dtype(order + PLY_TYPES[p[2]])
+            n = int(np.frombuffer(f.read(count_type.itemsize), dtype=count_type)[0])
+            values.append(np.frombuffer(f.read(n * item_type.itemsize), dtype=item_type))
+        else:
+            dtype = np.dtype(order + PLY_TYPES[p[1]])
+            values.append(np.frombuffer(f.read(dtype.itemsize), dtype=dtype)[0])
+    return values
+
+
+# Yields the records of element in chunks, as structured arrays for fixed size
+# records and as lists of property values for records with lists
+def read_ply_element(f, element, format, chunk_bytes):
+    order = '>' if format == 'binary_big_endian' else '<'
+    remaining = element.count
+
+    if format == 'ascii':
+        while remaining:
+            lines = []
+            size = 0
+            while remaining and size < chunk_bytes:
+                line = f.readline()
+                lines.append(line.split())
+                size += len(line)
+                remaining -= 1
+            if element.has_lists():
+                yield lines
+            else:
+                yield np.array(lines, dtype=np.float64).reshape(-1, len(element.properties))
+        return
+
+    if not element.has_lists():
+        dtype = element.dtype(order)
+        per_chunk = max(chunk_bytes // dtype.itemsize, 1)
+        while remaining:
+            n = min(per_chunk, remaining)
+            yield np.frombuffer(f.read(n * dtype.itemsize), dtype=dtype)
+            remaining -= n
+        return
+
+    # Lists: try reading a chunk as if every list held three items and fall
+    # back to a record at a time if any of them does not
+    lists = [p for p in element.properties if len(p) == 3]
+    fields = []
+    for p in element.properties:
+        if len(p) == 3:
+            fields += [(p[0] + '_count', order + PLY_TYPES[p[1]]), (p[0], order + PLY_TYPES[p[2]], (3,))]
+        else:
+            fields.append((p[0], order + PLY_TYPES[p[1]]))
+    triangle_dtype = np.dtype(fields)
+    per_chunk = max(chunk_bytes // triangle_dtype.itemsize, 1)
+
+    while remaining:
+        n = min(per_chunk, remaining)
+        block = f.read(n * triangle_dtype.itemsize)
+        records = np.frombuffer(block, dtype=triangle_dtype, count=len(block) // triangle_dtype.itemsize)
+        if len(records) == n and all(np.all(records[p[0] + '_count'] == 3) for p in lists):
+            yield records
+            remaining -= n
+            continue
+        f.seek(-len(block), os.SEEK_CUR)
+        rows = []
+        for _ in range(min(n, remaining)):
+            rows.append(read_ply_record(f, element, order))
+        remaining -= len(rows)
+        yield rows
+
+
+def skip_ply_element(f, element, format, chunk_bytes):
+    for _ in read_ply_element(f, element, format, chunk_bytes):
+        pass
+
+
+# Vertex attribute columns of a PLY vertex element. types maps property
+# names to their PLY types: colours are scaled by what the header declares,
+# since ASCII records are all parsed as floats
+def ply_vertex_values(records, names, types):
+    if records.dtype.names is None:
+        column = {name: records[:, i] for i, name in enumerate(names)}
+    else:
+        column = {name: records[name] for name in names}
+
+    def pick(*candidates):
+        for group in candidates:
+            if all(n in column for n in group):
+                return np.stack([column[n] for n in group], axis=1)
+        return None
+
+    values = {'position': pick(('x', 'y', 'z')).astype(np.float32)}
+    normal = pick(('nx', 'ny', 'nz'))
+    if normal is not None:
+        values['normal'] = normal.astype(np.float32)
+    texcoord = pick(('s', 't'), ('u', 'v'), ('texture_u', 'texture_v'))
+    if texcoord is not None:
+        values['map1'] = texcoord.astype(np.float32)
+    channels = ('red', 'green', 'blue', 'alpha')
+    color = pick(channels, channels[:3])
+    if color is not None:
+        declared = np.dtype(PLY_TYPES[types['red']])
+        if declared.kind == 'f':
+            color = np.clip(color * 255.0 + 0.5, 0, 255)
+        elif declared.itemsize > 1:
+            # Wider integers are scaled down to 8 bits from their full range
+            color = np.clip(color * (255.0 / np.iinfo(declared).max) + 0.5, 0, 255)
+        if color.shape[1] == 3:
+            color = np.concatenate((color, np.full((len(color), 1), 255)), axis=1)
+        values['color'] = color.astype(np.uint8)
+    return values
+
+
+# Polygons of a chunk of PLY face records, from the first list property
+def ply_polygons(records, element):
+    index = [i for i, p in enumerate(element.properties) if len(p) == 3][0]
+    name = element.properties[index][0]
+    if isinstance(records, np.ndarray):
+        return records[name].astype(np.int64)
+    if records and isinstance(records[0][0], bytes):
+        # ASCII rows: the list is the count followed by the items
+        polygons = []
+        for row in records:
+            start = sum(1 if len(p) == 2 else 0 for p in element.properties[:index])
+            n = int(row[start])
+            polygons.append([int(v) for v in row[start + 1:start + 1 + n]])
+        return polygons
+    return [r[index].astype(np.int64) for r in records]
+
+
+def convert_ply(filename, output, memory, chunk_bytes, tempdir=None):
+    report = ConvertReport(filename)
+    share = memory // 2
+    welder = Welder(share)
+    remap = SpillArray(1, np.int64, share, tempdir)
+    writer = None
+    layout = None
+
+    with open(filename, 'rb') as f:
+        format, elements = read_ply_header(f)
+        for element in elements:
+            if element.name == 'vertex':
+                names = [p[0] for p in element.properties]
+                types = {p[0]: p[1] for p in element.properties if len(p) == 2}
+                if element.has_lists() or not all(n in names for n in ('x', 'y', 'z')):
+                    raise ValueError("{}: unsupported vertex element".format(filename))
+                for records in read_ply_element(f, element, format, chunk_bytes):
+                    values = ply_vertex_values(records, names, types)
+                    if writer is None:
+                        layout = VertexLayout(list(values))
+                        writer = SBMStreamWriter(output, layout.decls, layout.stride, tempdir)
+                        writer.begin_sub_object()
+                    rows = layout.interleave(values)
+                    keys = rows.view('S{}'.format(layout.stride)).reshape(-1).tolist()
+                    indices, new = welder.weld(keys)
+                    remap.append(indices)
+                    writer.write_vertices(rows[new])
+                    report.input_vertices += len(rows)
+            elif element.name == 'face' and element.has_lists():
+                if writer is None:
+                    raise ValueError("{}: faces before vertices".format(filename))
+                for records in read_ply_element(f, element, format, chunk_bytes):
+                    polygons = ply_polygons(records, element)
+                    if isinstance(polygons, np.ndarray):
+                        triangles = polygons
+                    else:
+                        triangles = fan_triangles(polygons)
+                    indices = remap.take(triangles.reshape(-1)).reshape(-1)
+                    writer.write_indices(indices)
+                    report.triangles += len(indices) // 3
+            else:
+                skip_ply_element(f, element, format, chunk_bytes)
+
+    if writer is None:
+        layout = VertexLayout(['position'])
+        writer = SBMStreamWriter(output, layout.decls, layout.stride, tempdir)
+    report.spilled = ['vertex remap'] if remap.spilled else []
+    remap.close()
+    return finish(report, writer, welder)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert an OBJ or PLY model to SBM in bounded memory.')
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--memory-mb', type=int, default=256, help='cap on the working set before spilling')
+    parser.add_argument('--chunk-mb', type=int, default=16, help='input read per chunk')
+    parser.add_argument('--tempdir', default=None, help='where spill files go')
+    args = parser.parse_args(argv)
+
+    memory = args.memory_mb << 20
+    chunk_bytes = args.chunk_mb << 20
+    extension = os.path.splitext(args.input)[1].lower()
+    try:
+        if extension == '.obj':
+            report = convert_obj(args.input, args.output, memory, chunk_bytes, args.tempdir)
+        elif extension == '.ply':
+            report = convert_ply(args.input, args.output, memory, chunk_bytes, args.tempdir)
+        else:
+            print("{}: only .obj and .ply are supported".format(args.input))
+            return 1
+    except ValueError as e:
+        print(e)
+        return 1
+
+    print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
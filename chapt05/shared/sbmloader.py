@@ -5,8 +5,11 @@ import time
 import os
 import math
 import ctypes
+import zlib
+import lzma
 import numpy.matlib 
 import numpy as np 
+from concurrent.futures import ThreadPoolExecutor
 try:
     from OpenGL.GLUT import *
     from OpenGL.GL import *
@@ -18,9 +21,6 @@ except:
         ''')
     sys.exit()
 
-sub_object = []
-index_type=GL_NONE
-
 def SB6M_FOURCC(a,b,c,d):
     return ( (ord(a) << 0) | (ord(b) << 8) | (ord(c) << 16) | (ord(d) << 24) )
 
@@ -32,78 +32,294 @@ SB6M_CHUNK_TYPE_VERTEX_ATTRIBS  = SB6M_FOURCC('A','T','R','B')
 SB6M_CHUNK_TYPE_SUB_OBJECT_LIST = SB6M_FOURCC('O','L','S','T')
 SB6M_CHUNK_TYPE_COMMENT         = SB6M_FOURCC('C','M','N','T')
 SB6M_CHUNK_TYPE_DATA            = SB6M_FOURCC('D','A','T','A')
+SB6M_CHUNK_TYPE_QUANTIZATION    = SB6M_FOURCC('Q','N','T','Z')
+
+# On-disk layouts of the SB6M structures. These are viewed directly over the
+# memory-mapped file so nothing is copied out of the page cache while parsing.
+SB6M_HEADER_DTYPE = np.dtype([('magic', '<u4'), ('size', '<u4'), ('num_chunks', '<u4'), ('flags', '<u4')])
+
+SB6M_CHUNK_HEADER_DTYPE = np.dtype([('type', '<u4'), ('size', '<u4')])
+
+SB6M_CHUNK_INDEX_DATA_DTYPE = np.dtype([('type', '<u4'), ('size', '<u4'),
+                                        ('index_type', '<u4'), ('index_count', '<u4'), ('index_data_offset', '<u4')])
+
+SB6M_CHUNK_VERTEX_DATA_DTYPE = np.dtype([('type', '<u4'), ('size', '<u4'),
+                                         ('data_size', '<u4'), ('data_offset', '<u4'), ('total_vertices', '<u4')])
+
+SB6M_VERTEX_ATTRIB_DECL_DTYPE = np.dtype([('name', 'S64'), ('size', '<u4'), ('type', '<u4'),
+                                          ('stride', '<u4'), ('flags', '<u4'), ('data_offset', '<u4')])
+
+SB6M_VERTEX_ATTRIB_CHUNK_DTYPE = np.dtype([('type', '<u4'), ('size', '<u4'), ('attrib_count', '<u4')])
+
+SB6M_DATA_CHUNK_DTYPE = np.dtype([('type', '<u4'), ('size', '<u4'),
+                                  ('encoding', '<u4'), ('data_offset', '<u4'), ('data_length', '<u4')])
+
+# Compressed DATA chunks go on with the decoded size and a table of
+# independently compressed blocks, each decoding to block_size bytes (the
+# last one to whatever is left). Block offsets are from data_offset.
+SB6M_DATA_BLOCKS_DTYPE = np.dtype([('decoded_size', '<u4'), ('block_size', '<u4'), ('block_count', '<u4')])
+
+SB6M_DATA_BLOCK_DTYPE = np.dtype([('offset', '<u4'), ('length', '<u4')])
+
+SB6M_SUB_OBJECT_DECL_DTYPE = np.dtype([('first', '<u4'), ('count', '<u4')])
+
+SB6M_CHUNK_SUB_OBJECT_LIST_DTYPE = np.dtype([('type', '<u4'), ('size', '<u4'), ('count', '<u4')])
+
+# Quantized positions decode to [-1, 1]; the vertex shader gets the model
+# space position back as position * scale + bias, one pair per sub-object
+SB6M_POSITION_SCALE_BIAS_DTYPE = np.dtype([('scale', '<f4', 3), ('bias', '<f4', 3)])
+
+SB6M_CHUNK_QUANTIZATION_DTYPE = np.dtype([('type', '<u4'), ('size', '<u4'), ('count', '<u4')])
+
+# Model space bounding box and sphere of a sub-object or the whole model
+SB6M_BOUNDS_DTYPE = np.dtype([('aabb_min', '<f4', 3), ('aabb_max', '<f4', 3), ('center', '<f4', 3), ('radius', '<f4')])
+
+
+# View count records of dtype starting at byte offset of the mapped file
+def sb6m_view(data, offset, dtype, count=1):
+    return data[offset:offset + dtype.itemsize * count].view(dtype)
 
 class SB6M_HEADER:
     def __init__(self, data):
-        int_data = np.frombuffer(np.array(data[:16], dtype=np.byte), dtype=np.uint32)
-        self.magic, self.size, self.num_chunks, self.flags = int_data 
+        h = sb6m_view(data, 0, SB6M_HEADER_DTYPE)[0]
+        self.magic, self.size, self.num_chunks, self.flags = (int(v) for v in h)
         print(self.magic, self.size, self.num_chunks, self.flags)
 
 class SB6M_CHUNK_HEADER:
     def __init__(self, data, offset):
-        int_data = np.frombuffer(np.array(data[offset:offset+8], dtype=np.byte), dtype=np.uint32)
-        self.type, self.size = int_data
+        h = sb6m_view(data, offset, SB6M_CHUNK_HEADER_DTYPE)[0]
+        self.type, self.size = int(h['type']), int(h['size'])
 
 class SB6M_CHUNK_INDEX_DATA(SB6M_CHUNK_HEADER):
-     def __init__(self, data, offset):
-        global index_type
-        super().__init__(data, offset)
-        int_data = np.frombuffer(np.array(data[offset+8:offset+20], dtype=np.byte), dtype=np.uint32)
-        self.index_type, self.index_count, self.index_data_offset = int_data
-        index_type = self.index_type
-        
-class SB6M_CHUNK_VERTEX_DATA(SB6M_CHUNK_HEADER):
      def __init__(self, data, offset):
         super().__init__(data, offset)
-        int_data = np.frombuffer(np.array(data[offset+8:offset+20], dtype=np.byte), dtype=np.uint32)
-        self.data_size, self.data_offset, self.total_vertices = int_data
+        c = sb6m_view(data, offset, SB6M_CHUNK_INDEX_DATA_DTYPE)[0]
+        self.index_type, self.index_count, self.index_data_offset = \
+            int(c['index_type']), int(c['index_count']), int(c['index_data_offset'])
 
 class SB6M_CHUNK_VERTEX_DATA(SB6M_CHUNK_HEADER):
      def __init__(self, data, offset):
         super().__init__(data, offset)
-        int_data = np.frombuffer(np.array(data[offset+8:offset+20], dtype=np.byte), dtype=np.uint32)
-        self.data_size, self.data_offset, self.total_vertices = int_data
+        c = sb6m_view(data, offset, SB6M_CHUNK_VERTEX_DATA_DTYPE)[0]
+        self.data_size, self.data_offset, self.total_vertices = \
+            int(c['data_size']), int(c['data_offset']), int(c['total_vertices'])
+
+# NumPy element type for each INDX chunk index_type
+SB6M_INDEX_DTYPE = { GL_UNSIGNED_BYTE: np.dtype('<u1'), GL_UNSIGNED_SHORT: np.dtype('<u2'), GL_UNSIGNED_INT: np.dtype('<u4') }
+
+# Bytes per component for each attribute type; the packed types hold all
+# four components in a single word
+SB6M_ATTRIB_TYPE_SIZE = { GL_BYTE: 1, GL_UNSIGNED_BYTE: 1, GL_SHORT: 2, GL_UNSIGNED_SHORT: 2,
+                          GL_INT: 4, GL_UNSIGNED_INT: 4, GL_HALF_FLOAT: 2, GL_FLOAT: 4, GL_DOUBLE: 8 }
+SB6M_ATTRIB_PACKED_TYPES = ( GL_INT_2_10_10_10_REV, GL_UNSIGNED_INT_2_10_10_10_REV )
 
 SB6M_VERTEX_ATTRIB_FLAG_NORMALIZED = 0x00000001
 SB6M_VERTEX_ATTRIB_FLAG_INTEGER    = 0x00000002
 
 class SB6M_VERTEX_ATTRIB_DECL:
-    def __init__(self, data, offset):
-        self.name = ''.join([chr(n) for n in data[offset:offset+64] if n > 30])
-        int_data = np.frombuffer(np.array(data[offset+64:offset+84], dtype=np.byte), dtype=np.uint32)
-        self.size, self.type, self.stride, self.flags, self.data_offset = int_data
+    def __init__(self, decl):
+        self.name = decl['name'].split(b'\0', 1)[0].decode('ascii', 'replace')
+        self.size, self.type, self.stride, self.flags, self.data_offset = \
+            int(decl['size']), int(decl['type']), int(decl['stride']), int(decl['flags']), int(decl['data_offset'])
+
+# Size in bytes of one vertex worth of an attribute
+def sb6m_attrib_size(attrib):
+    if attrib.type in SB6M_ATTRIB_PACKED_TYPES:
+        return 4
+    return attrib.size * SB6M_ATTRIB_TYPE_SIZE[attrib.type]
+
+# Distance between consecutive vertices; a stride of 0 means tightly packed
+def sb6m_attrib_stride(attrib):
+    return attrib.stride if attrib.stride != 0 else sb6m_attrib_size(attrib)
+
+# Returns the bytes of one attribute for every vertex as an (n, size) view
+def sb6m_attrib_rows(vertex_data, attrib, total_vertices):
+    size = sb6m_attrib_size(attrib)
+    stride = sb6m_attrib_stride(attrib)
+    end = attrib.data_offset + (total_vertices - 1) * stride + size
+    if total_vertices and end > vertex_data.size:
+        raise ValueError("attribute '{}' runs past the end of the vertex data".format(attrib.name))
+    return np.lib.stride_tricks.as_strided(vertex_data[attrib.data_offset:], shape=(total_vertices, size),
+                                           strides=(stride, 1), writeable=False)
+
+# NumPy types of the unpacked attribute types and the scale that maps them to
+# [-1, 1] or [0, 1] when the attribute is normalized
+SB6M_ATTRIB_DTYPE = { GL_BYTE: (np.dtype('<i1'), 127.0), GL_UNSIGNED_BYTE: (np.dtype('<u1'), 255.0),
+                      GL_SHORT: (np.dtype('<i2'), 32767.0), GL_UNSIGNED_SHORT: (np.dtype('<u2'), 65535.0),
+                      GL_INT: (np.dtype('<i4'), 2147483647.0), GL_UNSIGNED_INT: (np.dtype('<u4'), 4294967295.0),
+                      GL_HALF_FLOAT: (np.dtype('<f2'), None), GL_FLOAT: (np.dtype('<f4'), None),
+                      GL_DOUBLE: (np.dtype('<f8'), None) }
+
+# Unpacks 2_10_10_10 words to (n, 4) x, y, z, w components
+def sb6m_unpack_2_10_10_10(words, signed):
+    words = words.astype(np.int64)
+    values = np.stack([(words >> shift) & mask for shift, mask in ((0, 0x3FF), (10, 0x3FF), (20, 0x3FF), (30, 0x3))], axis=1)
+    if signed:
+        top = np.array([0x200, 0x200, 0x200, 0x2])
+        values = np.where(values >= top, values - 2 * top, values)
+    return values.astype(np.float32)
+
+# Decodes (n, size) attribute rows to an (n, size) float32 array, the way the
+# vertex shader would see them
+def sb6m_decode_attrib(rows, attrib):
+    rows = np.ascontiguousarray(rows)
+    if attrib.type in SB6M_ATTRIB_PACKED_TYPES:
+        signed = attrib.type == GL_INT_2_10_10_10_REV
+        values = sb6m_unpack_2_10_10_10(rows.view('<u4').reshape(-1), signed)
+        if attrib.flags & SB6M_VERTEX_ATTRIB_FLAG_NORMALIZED:
+            values /= np.array([511.0, 511.0, 511.0, 1.0] if signed else [1023.0, 1023.0, 1023.0, 3.0], dtype=np.float32)
+            np.maximum(values, -1.0, out=values)
+        return values[:, :attrib.size]
+    dtype, scale = SB6M_ATTRIB_DTYPE[attrib.type]
+    values = rows.view(dtype).astype(np.float32)
+    if scale is not None and (attrib.flags & SB6M_VERTEX_ATTRIB_FLAG_NORMALIZED):
+        values /= scale
+        if dtype.kind == 'i':
+            np.maximum(values, -1.0, out=values)
+    return values
+
+def sb6m_attrib_values(vertex_data, attrib, total_vertices):
+    return sb6m_decode_attrib(sb6m_attrib_rows(vertex_data, attrib, total_vertices), attrib)
+
+# Decoded xyz of every vertex; attribute 0 is the position unless one is named so
+def sb6m_positions(vertex_data, attribs, total_vertices):
+    index = next((i for i, attrib in enumerate(attribs) if attrib.name == 'position'), 0)
+    return sb6m_attrib_values(vertex_data, attribs[index], total_vertices)[:, :3]
+
+# Whether ranges sorted by first follow each other with no gaps, empty ranges
+# or overlaps and end within size. Sub-objects normally tile the mesh
+def sb6m_ranges_tile(f, c, size):
+    return bool(np.all(c > 0) and np.array_equal(f[1:], f[:-1] + c[:-1]) and f[-1] + c[-1] <= size)
+
+# Bounds of the points in each range [first, first + count). The box is exact
+# and the sphere is centred on the box with the distance to the farthest point
+def sb6m_range_bounds(points, first, count):
+    bounds = np.zeros(len(first), dtype=SB6M_BOUNDS_DTYPE)
+    if len(first) == 0:
+        return bounds
+
+    order = np.argsort(first, kind='stable')
+    f, c = first[order], count[order]
+    end = f[-1] + c[-1]
+
+    # Tiling ranges are reduceat segments
+    if sb6m_ranges_tile(f, c, len(points)):
+        segment = points[f[0]:end]
+        starts = f - f[0]
+        low = np.minimum.reduceat(segment, starts)
+        high = np.maximum.reduceat(segment, starts)
+        center = (low + high) * 0.5
+        distance = np.linalg.norm(segment - np.repeat(center, c, axis=0), axis=1)
+        bounds['aabb_min'][order] = low
+        bounds['aabb_max'][order] = high
+        bounds['center'][order] = center
+        bounds['radius'][order] = np.maximum.reduceat(distance, starts)
+        return bounds
+
+    for i in range(len(first)):
+        part = points[first[i]:first[i] + count[i]]
+        if len(part):
+            low, high = part.min(axis=0), part.max(axis=0)
+            center = (low + high) * 0.5
+            bounds[i] = (low, high, center, np.linalg.norm(part - center, axis=1).max())
+    return bounds
+
+# Computes the bounds of every sub-object and of the model from the mapped
+# vertex data. Quantized positions are taken back to model space with their
+# sub-object's scale and bias before anything is measured, so their spheres
+# are as tight as those of float positions.
+# Returns (sub-object bounds, 1 element array of model bounds)
+def sb6m_compute_bounds(vertex_data, attribs, total_vertices, indices=None,
+                        sub_object_first=None, sub_object_count=None, position_scale_bias=None):
+    points = sb6m_positions(vertex_data, attribs, total_vertices)
+    if indices is not None:
+        points = points[indices]
+
+    if sub_object_first is None:
+        first = np.zeros(1, dtype=np.int64)
+        count = np.array([len(points)], dtype=np.int64)
+    else:
+        first = np.asarray(sub_object_first, dtype=np.int64)
+        count = np.asarray(sub_object_count, dtype=np.int64)
+
+    measured = points
+    if position_scale_bias is not None and len(position_scale_bias) > 0:
+        transform = np.asarray(position_scale_bias)[np.minimum(np.arange(len(first)), len(position_scale_bias) - 1)]
+        order = np.argsort(first, kind='stable')
+        if len(first) and sb6m_ranges_tile(first[order], count[order], len(points)):
+            # Every point belongs to one sub-object: dequantize them all once
+            start = first[order[0]]
+            measured = np.empty((count.sum(), 3), dtype=np.float32)
+            for i in order:
+                part = measured[first[i] - start:first[i] - start + count[i]]
+                np.multiply(points[first[i]:first[i] + count[i]], transform['scale'][i], out=part)
+                part += transform['bias'][i]
+            bounds = sb6m_range_bounds(measured, first - start, count)
+        else:
+            # Sub-objects can disagree on what a point means; each is
+            # measured in its own space
+            measured = None
+            bounds = np.zeros(len(first), dtype=SB6M_BOUNDS_DTYPE)
+            for i in range(len(first)):
+                part = points[first[i]:first[i] + count[i]] * transform['scale'][i] + transform['bias'][i]
+                bounds[i] = sb6m_range_bounds(part, np.zeros(1, dtype=np.int64), np.array([len(part)]))[0]
+    else:
+        bounds = sb6m_range_bounds(points, first, count)
+
+    # The model encloses every non-empty sub-object. Its sphere is measured
+    # against the points when they have one meaning, and otherwise encloses
+    # the sub-object spheres
+    model = np.zeros(1, dtype=SB6M_BOUNDS_DTYPE)
+    used = bounds[count > 0]
+    if len(used):
+        low, high = used['aabb_min'].min(axis=0), used['aabb_max'].max(axis=0)
+        center = (low + high) * 0.5
+        if measured is None:
+            radius = (np.linalg.norm(used['center'] - center, axis=1) + used['radius']).max()
+        else:
+            radius = np.linalg.norm(measured - center, axis=1).max()
+        model[0] = (low, high, center, radius)
+    return bounds, model
+
+def sb6m_bounds_tuple(b):
+    return tuple(b['aabb_min'].tolist()), tuple(b['aabb_max'].tolist()), tuple(b['center'].tolist()), float(b['radius'])
 
 class SB6M_VERTEX_ATTRIB_CHUNK(SB6M_CHUNK_HEADER):
     def __init__(self, data, offset):
         super().__init__(data, offset)
-        int_data = np.frombuffer(np.array(data[offset+8:offset+12], dtype=np.byte), dtype=np.uint32)
-        self.attrib_count = int_data[0]
-        self.attrib_data = []
-        for i in range(self.attrib_count):
-            self.attrib_data.append(SB6M_VERTEX_ATTRIB_DECL(data, offset+12+i*84))
+        self.attrib_count = int(sb6m_view(data, offset, SB6M_VERTEX_ATTRIB_CHUNK_DTYPE)[0]['attrib_count'])
+        decls = sb6m_view(data, offset + SB6M_VERTEX_ATTRIB_CHUNK_DTYPE.itemsize,
+                          SB6M_VERTEX_ATTRIB_DECL_DTYPE, self.attrib_count)
+        self.attrib_data = [SB6M_VERTEX_ATTRIB_DECL(d) for d in decls]
 
 class SB6M_DATA_CHUNK(SB6M_CHUNK_HEADER):
     def __init__(self, data, offset):
         super().__init__(data, offset)
-        int_data = np.frombuffer(np.array(data[offset+8:offset+20], dtype=np.byte), dtype=np.uint32)
-        self.encoding, self.data_offset, self.data_length = int_data
-
-class SB6M_SUB_OBJECT_DECL:
-    def __init__(self, data, offset):
-        int_data = np.frombuffer(np.array(data[offset:offset+8], dtype=np.byte), dtype=np.uint32)
-        self.first, self.count = int_data
+        c = sb6m_view(data, offset, SB6M_DATA_CHUNK_DTYPE)[0]
+        self.encoding, self.data_offset, self.data_length = \
+            int(c['encoding']), int(c['data_offset']), int(c['data_length'])
+        self.blocks = None
+        if self.encoding != SB6M_DATA_ENCODING.SB6M_DATA_ENCODING_RAW:
+            offset += SB6M_DATA_CHUNK_DTYPE.itemsize
+            b = sb6m_view(data, offset, SB6M_DATA_BLOCKS_DTYPE)[0]
+            self.decoded_size, self.block_size, self.block_count = \
+                int(b['decoded_size']), int(b['block_size']), int(b['block_count'])
+            self.blocks = sb6m_view(data, offset + SB6M_DATA_BLOCKS_DTYPE.itemsize, SB6M_DATA_BLOCK_DTYPE, self.block_count)
 
 class SB6M_CHUNK_SUB_OBJECT_LIST(SB6M_CHUNK_HEADER):
     def __init__(self, data, offset):
-        global sub_object
-    
         super().__init__(data, offset)
-        int_data = np.frombuffer(np.array(data[offset+8:offset+12], dtype=np.byte), dtype=np.uint32)
-        self.count = int_data[0]
-        #self.sub_object = []
-        for i in range(self.count):
+        self.count = int(sb6m_view(data, offset, SB6M_CHUNK_SUB_OBJECT_LIST_DTYPE)[0]['count'])
+        # (first, count) records, still a view into the mapped file
+        self.sub_object = sb6m_view(data, offset + SB6M_CHUNK_SUB_OBJECT_LIST_DTYPE.itemsize,
+                                    SB6M_SUB_OBJECT_DECL_DTYPE, self.count)
 
-            sub_object.append(SB6M_SUB_OBJECT_DECL(data, offset+12+i*8))
+class SB6M_CHUNK_QUANTIZATION(SB6M_CHUNK_HEADER):
+    def __init__(self, data, offset):
+        super().__init__(data, offset)
+        self.count = int(sb6m_view(data, offset, SB6M_CHUNK_QUANTIZATION_DTYPE)[0]['count'])
+        self.position_scale_bias = sb6m_view(data, offset + SB6M_CHUNK_QUANTIZATION_DTYPE.itemsize,
+                                             SB6M_POSITION_SCALE_BIAS_DTYPE, self.count)
 
 class SB6M_CHUNK_HEADER_:
     chunk_type = 0
@@ -112,6 +328,49 @@ class SB6M_CHUNK_HEADER_:
 
 class SB6M_DATA_ENCODING:
     SB6M_DATA_ENCODING_RAW  = 0
+    SB6M_DATA_ENCODING_ZLIB = 1
+    SB6M_DATA_ENCODING_LZMA = 2
+
+SB6M_DATA_DECOMPRESS = { SB6M_DATA_ENCODING.SB6M_DATA_ENCODING_ZLIB: zlib.decompress,
+                         SB6M_DATA_ENCODING.SB6M_DATA_ENCODING_LZMA: lzma.decompress }
+
+# zlib and lzma drop the GIL while they work, so blocks decode in parallel
+sb6m_decode_pool = None
+
+def sb6m_get_decode_pool():
+    global sb6m_decode_pool
+    if sb6m_decode_pool is None:
+        sb6m_decode_pool = ThreadPoolExecutor(thread_name_prefix='sb6mdecode')
+    return sb6m_decode_pool
+
+# Decodes the blocks of a compressed DATA chunk into out, which can be any
+# writable uint8 array of decoded_size bytes, such as a mapped GL buffer
+def sb6m_decode_blocks(data, data_chunk, out=None):
+    if data_chunk.encoding not in SB6M_DATA_DECOMPRESS:
+        raise ValueError("unsupported DATA chunk encoding {}".format(data_chunk.encoding))
+    if out is None:
+        out = np.empty(data_chunk.decoded_size, dtype=np.uint8)
+    decompress = SB6M_DATA_DECOMPRESS[data_chunk.encoding]
+
+    def decode(i):
+        offset, length = (int(v) for v in data_chunk.blocks[i])
+        start = data_chunk.data_offset + offset
+        block = decompress(data[start:start + length])
+        first = i * data_chunk.block_size
+        if len(block) != min(data_chunk.block_size, data_chunk.decoded_size - first):
+            raise ValueError("DATA block {} decodes to {} bytes".format(i, len(block)))
+        out[first:first + len(block)] = np.frombuffer(block, dtype=np.uint8)
+
+    for _ in sb6m_get_decode_pool().map(decode, range(data_chunk.block_count)):
+        pass
+    return out
+
+# The bytes VRTX and INDX offsets point into: the file itself, or the decoded
+# contents of a compressed DATA chunk
+def sb6m_payload(data, chunks, out=None):
+    if chunks.data_chunk is None or chunks.data_chunk.blocks is None:
+        return data
+    return sb6m_decode_blocks(data, chunks.data_chunk, out)
 
 
 class SB6M_CHUNK_COMMENT:
@@ -125,104 +384,383 @@ class SB6M_CHUNK_COMMENT:
 
 
 
-class SBMObject:
-
-    def __init__(self):
-        self.vao = GLuint(0)
-    
-    def render(self, instance_count = 1, base_instance = 0):
-        self.render_sub_object(0, instance_count, base_instance)
-    
-    def get_sub_object_count(self):
-        return len(sub_object)
-
-    def get_sub_object_info(self, index):
-       if (index >= len(sub_object)):
-           return 0, 0
-       return sub_object[index].first, sub_object[index].count
-
-    def get_vao(self):
-        return self.vao
-
-    def load(self, filename):
-
-        vertex_attrib_chunk = None
-        vertex_data_chunk = None
-        index_data_chunk = None
-        sub_object_chunk = None
-        data_chunk = None
-
-        #try:
-        data = numpy.fromfile(filename, dtype=np.byte)
-        filesize = data.size
+class SB6M_CHUNKS:
+    # Walks the chunk list of a mapped SB6M file and keeps the chunks it knows
+    def __init__(self, data):
+        self.header = SB6M_HEADER(data)
+        self.vertex_attrib_chunk = None
+        self.vertex_data_chunk = None
+        self.index_data_chunk = None
+        self.sub_object_chunk = None
+        self.data_chunk = None
+        self.quantization_chunk = None
 
-        header = SB6M_HEADER(data)
-        offset = header.size
+        offset = self.header.size
 
-        for i in range(header.num_chunks):
+        for i in range(self.header.num_chunks):
 
             chunk = SB6M_CHUNK_HEADER(data, offset)
             if chunk.type == SB6M_CHUNK_TYPE_VERTEX_ATTRIBS:
-                vertex_attrib_chunk = SB6M_VERTEX_ATTRIB_CHUNK(data, offset) 
+                self.vertex_attrib_chunk = SB6M_VERTEX_ATTRIB_CHUNK(data, offset)
             elif chunk.type == SB6M_CHUNK_TYPE_VERTEX_DATA:
-                vertex_data_chunk = SB6M_CHUNK_VERTEX_DATA(data, offset)
+                self.vertex_data_chunk = SB6M_CHUNK_VERTEX_DATA(data, offset)
             elif chunk.type == SB6M_CHUNK_TYPE_INDEX_DATA:
-                index_data_chunk = SB6M_CHUNK_INDEX_DATA(data, offset) 
+                self.index_data_chunk = SB6M_CHUNK_INDEX_DATA(data, offset)
             elif chunk.type == SB6M_CHUNK_TYPE_SUB_OBJECT_LIST:
-                sub_object_chunk = SB6M_CHUNK_SUB_OBJECT_LIST(data, offset)
+                self.sub_object_chunk = SB6M_CHUNK_SUB_OBJECT_LIST(data, offset)
             elif chunk.type == SB6M_CHUNK_TYPE_DATA:
-                data_chunk = SB6M_DATA_CHUNK(data, offset) 
+                self.data_chunk = SB6M_DATA_CHUNK(data, offset)
+            elif chunk.type == SB6M_CHUNK_TYPE_QUANTIZATION:
+                self.quantization_chunk = SB6M_CHUNK_QUANTIZATION(data, offset)
             elif chunk.type == SB6M_CHUNK_TYPE_COMMENT:
                 print ('just comment')
             else:
                 print ('am here')
-                pass 
+                pass
                 #raise
-                
 
             offset += chunk.size
 
-        #except:
-        #    print("error reading file {}".format(filename))
 
-        print("finished reading")
+class SBMData:
+    # A parsed model, ready for SBMObject.upload. Arrays are views of the mapped file
+    def __init__(self, buffer_data, attribs, vertexcount, index_type=GL_NONE, index_count=0,
+                 index_data=None, index_offset=0, sub_object_first=None, sub_object_count=None,
+                 position_scale_bias=None, sub_object_bounds=None, model_bounds=None):
+        self.buffer_data = buffer_data
+        self.attribs = attribs
+        self.vertexcount = vertexcount
+        self.index_type = index_type
+        self.index_count = index_count
+        self.index_data = index_data
+        self.index_offset = index_offset
+        self.sub_object_first = sub_object_first
+        self.sub_object_count = sub_object_count
+        self.position_scale_bias = position_scale_bias
+        self.sub_object_bounds = sub_object_bounds
+        self.model_bounds = model_bounds
+        # Set instead of buffer_data when the payload is compressed and left
+        # for upload to decode: (mapped file, DATA chunk)
+        self.encoded = None
+
+    def index_array(self):
+        if self.index_type == GL_NONE:
+            return None
+        dtype = SB6M_INDEX_DTYPE[self.index_type]
+        if self.index_data is not None:
+            return self.index_data.view(dtype)
+        return self.buffer_data[self.index_offset:self.index_offset + self.index_count * dtype.itemsize].view(dtype)
+
+    def compute_bounds(self):
+        self.sub_object_bounds, self.model_bounds = sb6m_compute_bounds(
+            self.buffer_data, self.attribs, self.vertexcount, self.index_array(),
+            self.sub_object_first, self.sub_object_count, self.position_scale_bias)
+
+
+# Parses filename without touching GL. Returns None if there is nothing to draw.
+# A compressed payload is decoded here unless decode is False, in which case
+# SBMObject.upload decodes it straight into the GL buffer
+def sbm_read(filename, cache_dir=None, decode=True):
+
+    # Warm starts come straight from the preprocessed cache without
+    # touching the chunk stream
+    if cache_dir is not None:
+        from sbmcache import sbm_cache_read
+        return sbm_cache_read(filename, cache_dir)
+
+    #try:
+    # Map the file rather than reading it; chunk headers are decoded as
+    # views and vertex data is handed to GL straight from the mapped pages
+    data = np.memmap(filename, dtype=np.uint8, mode='r')
+
+    chunks = SB6M_CHUNKS(data)
+    vertex_attrib_chunk = chunks.vertex_attrib_chunk
+    vertex_data_chunk = chunks.vertex_data_chunk
+    index_data_chunk = chunks.index_data_chunk
+    sub_object_chunk = chunks.sub_object_chunk
+
+    #except:
+    #    print("error reading file {}".format(filename))
+
+    print("finished reading")
+
+    if not (vertex_data_chunk and vertex_attrib_chunk):
+        return None
+
+    # Compressed models keep vertices at the start of the decoded payload and
+    # indices behind them, so the payload is uploaded as one buffer
+    if not decode and chunks.data_chunk and chunks.data_chunk.blocks is not None and vertex_data_chunk.data_offset == 0:
+        mesh = SBMData(None, vertex_attrib_chunk.attrib_data, vertex_data_chunk.total_vertices)
+        mesh.encoded = (data, chunks.data_chunk)
+        if index_data_chunk and index_data_chunk.index_type in SB6M_INDEX_DTYPE:
+            mesh.index_type = index_data_chunk.index_type
+            mesh.index_count = index_data_chunk.index_count
+            mesh.index_offset = index_data_chunk.index_data_offset
+        if sub_object_chunk:
+            mesh.sub_object_first = sub_object_chunk.sub_object['first']
+            mesh.sub_object_count = sub_object_chunk.sub_object['count']
+        if chunks.quantization_chunk:
+            mesh.position_scale_bias = chunks.quantization_chunk.position_scale_bias
+        return mesh
+
+    data = sb6m_payload(data, chunks)
+
+    start = vertex_data_chunk.data_offset
+    end = start + vertex_data_chunk.data_size
+    mesh = SBMData(data[start:end], vertex_attrib_chunk.attrib_data, vertex_data_chunk.total_vertices)
+
+    if index_data_chunk:
+        if index_data_chunk.index_type not in SB6M_INDEX_DTYPE:
+            print("unsupported index type {} in {}".format(hex(index_data_chunk.index_type), filename))
+        else:
+            mesh.index_type = index_data_chunk.index_type
+            mesh.index_count = index_data_chunk.index_count
+            start = index_data_chunk.index_data_offset
+            end = start + mesh.index_count * SB6M_INDEX_DTYPE[mesh.index_type].itemsize
+            mesh.index_data = data[start:end]
+
+    if sub_object_chunk:
+        mesh.sub_object_first = sub_object_chunk.sub_object['first']
+        mesh.sub_object_count = sub_object_chunk.sub_object['count']
+
+    if chunks.quantization_chunk:
+        mesh.position_scale_bias = chunks.quantization_chunk.position_scale_bias
+
+    # Bounds are worked out here, off the GL thread, so nothing has to go
+    # back to the vertices to cull
+    mesh.compute_bounds()
+
+    return mesh
+
+
+class SBMMesh:
+    # A model decoded to plain arrays for the offline tools: the raw bytes of
+    # every attribute, a row per vertex, plus indices and sub-objects if the
+    # file has them
+    def __init__(self, attribs, rows, indices=None, sub_objects=None, position_scale_bias=None):
+        self.attribs = attribs
+        self.rows = rows
+        self.indices = indices
+        self.sub_objects = sub_objects
+        self.position_scale_bias = position_scale_bias
+
+    @property
+    def vertex_count(self):
+        return len(self.rows[0]) if self.rows else 0
+
+    def attrib_index(self, name, default=None):
+        for i, attrib in enumerate(self.attribs):
+            if attrib.name == name:
+                return i
+        return default
+
+    # Attribute 0 is the position unless one is named so
+    def positions(self):
+        i = self.attrib_index('position', 0)
+        return sb6m_decode_attrib(self.rows[i], self.attribs[i])[:, :3]
+
+
+def sbm_read_mesh(filename):
+    mesh = sbm_read(filename)
+    if mesh is None:
+        return None
+
+    rows = [np.array(sb6m_attrib_rows(mesh.buffer_data, attrib, mesh.vertexcount)) for attrib in mesh.attribs]
+
+    indices = None
+    if mesh.index_type != GL_NONE:
+        indices = mesh.index_data.view(SB6M_INDEX_DTYPE[mesh.index_type]).astype(np.int64)
+
+    sub_objects = None
+    if mesh.sub_object_first is not None:
+        sub_objects = np.stack([mesh.sub_object_first, mesh.sub_object_count], axis=1).astype(np.int64)
+
+    position_scale_bias = None
+    if mesh.position_scale_bias is not None:
+        position_scale_bias = np.array(mesh.position_scale_bias)
+
+    return SBMMesh(mesh.attribs, rows, indices, sub_objects, position_scale_bias)
+
+
+class SBMObject:
+
+    def __init__(self):
+        self.vao = GLuint(0)
+        self.index_buffer = GLuint(0)
+        self.index_type = GL_NONE
+        self.index_offset = 0
+        # Sub-object ranges, in indices for indexed models and vertices
+        # otherwise; laid out so they can be passed to glMultiDraw* as is
+        self.sub_object_first = np.zeros(1, dtype=np.int32)
+        self.sub_object_count = np.zeros(1, dtype=np.int32)
+        self.position_scale_bias = None
+        self.sub_object_bounds = np.zeros(1, dtype=SB6M_BOUNDS_DTYPE)
+        self.model_bounds = np.zeros(1, dtype=SB6M_BOUNDS_DTYPE)
+    
+    def render(self, instance_count = 1, base_instance = 0):
+        self.render_sub_object(0, instance_count, base_instance)
+    
+    def get_sub_object_count(self):
+        return len(self.sub_object_first)
+
+    def get_sub_object_info(self, index):
+       if (index >= len(self.sub_object_first)):
+           return 0, 0
+       return int(self.sub_object_first[index]), int(self.sub_object_count[index])
+
+    # Scale and bias that take a quantized position of sub-object index back
+    # to model space; identity for models with float positions
+    def get_sub_object_position_transform(self, index):
+        if self.position_scale_bias is None or index >= len(self.position_scale_bias):
+            return (1.0, 1.0, 1.0), (0.0, 0.0, 0.0)
+        record = self.position_scale_bias[index]
+        return tuple(float(v) for v in record['scale']), tuple(float(v) for v in record['bias'])
+
+    # Bounding box and sphere of sub-object index as
+    # (aabb_min, aabb_max, center, radius) in model space
+    def get_sub_object_bounds(self, index):
+        return sb6m_bounds_tuple(self.sub_object_bounds[index])
+
+    def get_model_bounds(self):
+        return sb6m_bounds_tuple(self.model_bounds[0])
 
-        if vertex_data_chunk and vertex_attrib_chunk:
-            start = vertex_data_chunk.data_offset
-            end = start + vertex_data_chunk.data_size
-            vertex_data = np.frombuffer(np.array(data[start:end], dtype=np.byte), dtype=np.float32)
+    # SB6M_BOUNDS_DTYPE record per sub-object, for culling them all at once
+    def get_sub_object_bounds_array(self):
+        return self.sub_object_bounds
 
-            data_buffer = glGenBuffers(1)
-            glBindBuffer(GL_ARRAY_BUFFER, data_buffer)
-            glBufferData(GL_ARRAY_BUFFER, vertex_data, GL_STATIC_DRAW)
+    def get_sub_object_arrays(self):
+        return self.sub_object_first, self.sub_object_count
 
-            self.vertexcount = vertex_data_chunk.total_vertices
-            self.vao = glGenVertexArrays(1)
-            glBindVertexArray(self.vao)
+    def get_vao(self):
+        return self.vao
+
+    def load(self, filename, cache_dir=None):
+        mesh = sbm_read(filename, cache_dir, decode=False)
+        if mesh:
+            self.upload(mesh)
+
+    # The GL half of load; mesh comes from sbm_read, which may run on any thread
+    def upload(self, mesh):
+        if mesh.buffer_data is None and mesh.encoded is not None:
+            self.upload_encoded(mesh)
+        self.create_buffers(mesh.buffer_data, mesh.attribs, mesh.vertexcount,
+                            mesh.index_type, mesh.index_count, mesh.index_data, mesh.index_offset)
+        self.set_sub_objects(mesh.sub_object_first, mesh.sub_object_count)
+        if mesh.position_scale_bias is not None:
+            self.position_scale_bias = np.array(mesh.position_scale_bias)
+        if mesh.sub_object_bounds is None:
+            mesh.compute_bounds()
+        self.sub_object_bounds = np.array(mesh.sub_object_bounds)
+        self.model_bounds = np.array(mesh.model_bounds)
+
+    # Decodes a compressed payload on the decode pool directly into a mapped
+    # GL_ARRAY_BUFFER, skipping the copy through a NumPy array. The map is
+    # readable too so the bounds can be taken from it before it is unmapped
+    def upload_encoded(self, mesh):
+        data, data_chunk = mesh.encoded
+        size = data_chunk.decoded_size
+
+        self.data_buffer = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.data_buffer)
+        glBufferData(GL_ARRAY_BUFFER, size, None, GL_STATIC_DRAW)
+        if size == 0:
+            mesh.buffer_data = np.zeros(0, dtype=np.uint8)
+            mesh.compute_bounds()
+            mesh.buffer_data = None
+            return
+
+        pointer = glMapBufferRange(GL_ARRAY_BUFFER, 0, size, GL_MAP_READ_BIT | GL_MAP_WRITE_BIT)
+        mapped = np.ctypeslib.as_array(ctypes.cast(pointer, ctypes.POINTER(ctypes.c_ubyte)), shape=(size,))
+        try:
+            sb6m_decode_blocks(data, data_chunk, mapped)
+            mesh.buffer_data = mapped
+            mesh.compute_bounds()
+        finally:
+            mesh.buffer_data = None
+            glUnmapBuffer(GL_ARRAY_BUFFER)
+
+    # Creates the buffers and vertex array object. Indices are either passed in
+    # index_data or, when that is None, already sit in buffer_data at
+    # index_offset so the whole model goes up in a single glBufferData. A
+    # buffer_data of None means data_buffer has already been filled
+    def create_buffers(self, buffer_data, attribs, vertexcount,
+                       index_type=GL_NONE, index_count=0, index_data=None, index_offset=0):
+
+        if buffer_data is not None:
+            self.data_buffer = glGenBuffers(1)
+            glBindBuffer(GL_ARRAY_BUFFER, self.data_buffer)
+            glBufferData(GL_ARRAY_BUFFER, buffer_data.nbytes, buffer_data, GL_STATIC_DRAW)
+        else:
+            glBindBuffer(GL_ARRAY_BUFFER, self.data_buffer)
+
+        self.vertexcount = vertexcount
+        self.vao = glGenVertexArrays(1)
+        glBindVertexArray(self.vao)
 
-            for attrib_i, attrib in enumerate(vertex_attrib_chunk.attrib_data):
+        # Attributes are fetched in the type they are stored in; integer ones
+        # reach the shader as ivec/uvec, the rest as float, normalized or not
+        for attrib_i, attrib in enumerate(attribs):
+                if attrib.flags & SB6M_VERTEX_ATTRIB_FLAG_INTEGER:
+                    glVertexAttribIPointer(attrib_i,
+                        attrib.size, attrib.type,
+                        attrib.stride, ctypes.c_void_p(int(attrib.data_offset)))
+                else:
                     glVertexAttribPointer(attrib_i,
                         attrib.size, attrib.type,
                         GL_TRUE if (attrib.flags & SB6M_VERTEX_ATTRIB_FLAG_NORMALIZED) != 0 else GL_FALSE,
                         attrib.stride, ctypes.c_void_p(int(attrib.data_offset)))
-                    glEnableVertexAttribArray(attrib_i)
+                glEnableVertexAttribArray(attrib_i)
+
+        # Element buffer binding is VAO state, so attach it while the VAO is bound
+        if index_type != GL_NONE:
+            if index_data is None:
+                self.index_buffer = self.data_buffer
+                self.index_offset = index_offset
+                glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.index_buffer)
+            else:
+                self.index_buffer = glGenBuffers(1)
+                self.index_offset = 0
+                glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.index_buffer)
+                glBufferData(GL_ELEMENT_ARRAY_BUFFER, index_data.nbytes, index_data, GL_STATIC_DRAW)
+
+            self.index_type = index_type
+            self.num_indices = index_count
+
+    # With no sub-object list the whole model is a single sub-object
+    def set_sub_objects(self, first=None, count=None):
+        if first is None:
+            self.sub_object_first = np.zeros(1, dtype=np.int32)
+            self.sub_object_count = np.array([self.num_indices if self.index_type != GL_NONE else self.vertexcount], dtype=np.int32)
+        else:
+            self.sub_object_first = np.asarray(first).astype(np.int32)
+            self.sub_object_count = np.asarray(count).astype(np.int32)
 
 
     def render_sub_object(self, object_index, instance_count, base_instance):
-        global index_type
 
         glBindVertexArray(self.vao)
 
-        if instance_count == 0:
-            glDrawArrays(GL_TRIANGLES, 0, self.vertexcount)
+        first = int(self.sub_object_first[object_index])
+        count = int(self.sub_object_count[object_index])
+
+        # Models shipping an INDX chunk are drawn indexed so the post-transform
+        # vertex cache gets reused; everything else falls back to arrays
+        if self.index_type != GL_NONE:
+            offset = ctypes.c_void_p(self.index_offset + first * SB6M_INDEX_DTYPE[self.index_type].itemsize)
+            if instance_count == 0:
+                glDrawElements(GL_TRIANGLES, count, self.index_type, offset)
+            else:
+                glDrawElementsInstancedBaseInstance(GL_TRIANGLES,
+                                                    count,
+                                                    self.index_type,
+                                                    offset,
+                                                    instance_count,
+                                                    base_instance)
+        elif instance_count == 0:
+            glDrawArrays(GL_TRIANGLES, first, count)
         else:
             glDrawArraysInstancedBaseInstance(GL_TRIANGLES,
-                                               0,
-                                               self.vertexcount,
+                                               first,
+                                               count,
                                                instance_count,
                                                base_instance)
-              
-        
-        
-        
-        
\ No newline at end of file
@@ -0,0 +1,262 @@
+#!/usr/bin/python3
+
+# Offline mesh optimizer for SBM files.
+#
+# The model is welded into an indexed mesh (identical vertices are merged),
+# then the triangles of every sub-object are reordered for the post-transform
+# vertex cache with Tipsify, and the resulting clusters are sorted outside-in
+# to reduce overdraw (both from Sander, Nehab and Barczak, "Fast Triangle
+# Reordering for Vertex Locality and Reduced Overdraw", 2007). Finally the
+# vertices are renumbered in the order the index buffer first uses them so
+# vertex fetch walks memory forwards.
+#
+# Cache efficiency is reported as ACMR (vertex shader runs per triangle) and
+# ATVR (vertex shader runs per unique vertex) on a simulated FIFO cache.
+#
+# usage: python sbmoptimize.py input.sbm output.sbm [--cache-size 16]
+
+import sys
+import argparse
+from collections import deque
+
+import numpy as np
+
+from sbmloader import SBMMesh, sbm_read_mesh
+from sbmwriter import SBMAttrib, sbm_write
+
+
+# Merges vertices whose attributes are bit for bit identical. Returns the
+# welded rows and, for every original vertex, the index of its welded copy
+def weld(rows):
+    vertices = np.ascontiguousarray(np.concatenate(rows, axis=1))
+    keys = vertices.view(np.dtype((np.void, vertices.shape[1]))).reshape(-1)
+    _, first, remap = np.unique(keys, return_index=True, return_inverse=True)
+    return [r[first] for r in rows], remap.reshape(-1)
+
+
+# Sub-object of every vertex as (n, 4) bytes, so welding can keep quantized
+# positions, which only mean the same thing within one sub-object, apart
+def sub_object_rows(mesh):
+    ids = np.zeros(mesh.vertex_count, dtype=np.int32)
+    for s, (first, count) in enumerate(mesh.sub_objects.tolist()):
+        if mesh.indices is None:
+            ids[first:first + count] = s
+        else:
+            ids[mesh.indices[first:first + count]] = s
+    return ids.reshape(-1, 1).view(np.uint8)
+
+
+# Number of vertex shader runs for indices on a FIFO post-transform cache
+def cache_misses(indices, cache_size):
+    fifo = deque()
+    cached = set()
+    misses = 0
+    for v in indices.tolist():
+        if v not in cached:
+            misses += 1
+            fifo.append(v)
+            cached.add(v)
+            if len(fifo) > cache_size:
+                cached.discard(fifo.popleft())
+    return misses
+
+def acmr_atvr(indices, cache_size):
+    if len(indices) == 0:
+        return 0.0, 0.0
+    misses = cache_misses(indices, cache_size)
+    return misses / (len(indices) // 3), misses / len(np.unique(indices))
+
+
+# Tipsify. Returns the triangles of indices in cache friendly order and the
+# positions in that order where the cache was effectively flushed, which are
+# the cluster boundaries used for the overdraw pass
+def tipsify(indices, vertex_count, cache_size):
+    triangles = indices.reshape(-1, 3)
+    if len(triangles) == 0:
+        return triangles.reshape(-1), [0]
+
+    # Triangles using each vertex, in compressed row form
+    flat = triangles.reshape(-1)
+    adjacency = (np.argsort(flat, kind='stable') // 3).tolist()
+    live = np.bincount(flat, minlength=vertex_count)
+    start = np.concatenate(([0], np.cumsum(live))).tolist()
+    live = live.tolist()
+
+    triangle_list = triangles.tolist()
+    emitted = [False] * len(triangles)
+    cache_time = [0] * vertex_count
+    time = cache_size + 1
+    dead_end = []
+    cursor = 0
+
+    order = []
+    clusters = [0]
+    fan = int(flat[0])
+
+    while fan >= 0:
+        candidates = []
+        for t in adjacency[start[fan]:start[fan + 1]]:
+            if emitted[t]:
+                continue
+            emitted[t] = True
+            order.append(t)
+            for v in triangle_list[t]:
+                dead_end.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if time - cache_time[v] > cache_size:
+                    cache_time[v] = time
+                    time += 1
+
+        # Prefer a vertex that will still be in the cache after its
+        # remaining triangles have gone through
+        fan = -1
+        best = -1
+        for v in candidates:
+            if live[v] > 0:
+                priority = 0
+                if time - cache_time[v] + 2 * live[v] <= cache_size:
+                    priority = time - cache_time[v]
+                if priority > best:
+                    best = priority
+                    fan = v
+
+        if fan == -1:
+            while dead_end:
+                v = dead_end.pop()
+                if live[v] > 0:
+                    fan = v
+                    break
+            while fan == -1 and cursor < vertex_count:
+                if live[cursor] > 0:
+                    fan = cursor
+                cursor += 1
+            if fan != -1 and time - cache_time[fan] > cache_size and len(order) > clusters[-1]:
+                clusters.append(len(order))
+
+    return triangles[order].reshape(-1), clusters
+
+
+# Sorts the clusters so the ones facing away from the middle of the mesh are
+# drawn first; they tend to occlude the rest
+def reorder_overdraw(indices, clusters, positions):
+    triangles = indices.reshape(-1, 3)
+    if len(clusters) < 2:
+        return indices
+
+    p0, p1, p2 = (positions[triangles[:, i]].astype(np.float64) for i in range(3))
+    normals = np.cross(p1 - p0, p2 - p0)
+    areas = np.linalg.norm(normals, axis=1)
+    centroids = (p0 + p1 + p2) / 3.0
+
+    total_area = max(areas.sum(), 1e-30)
+    mesh_centroid = (centroids * areas[:, None]).sum(axis=0) / total_area
+
+    bounds = np.array(clusters + [len(triangles)])
+    area = np.add.reduceat(areas, bounds[:-1])
+    normal = np.add.reduceat(normals, bounds[:-1])
+    centroid = np.add.reduceat(centroids * areas[:, None], bounds[:-1]) / np.maximum(area, 1e-30)[:, None]
+    normal /= np.maximum(np.linalg.norm(normal, axis=1), 1e-30)[:, None]
+
+    facing = ((centroid - mesh_centroid) * normal).sum(axis=1)
+    cluster_order = np.argsort(-facing, kind='stable')
+
+    order = np.concatenate([np.arange(bounds[c], bounds[c + 1]) for c in cluster_order])
+    return triangles[order].reshape(-1)
+
+
+# Renumbers vertices in order of first use. Returns the new indices and, for
+# every new vertex, the old vertex it came from
+def reorder_fetch(indices, vertex_count):
+    used, first = np.unique(indices, return_index=True)
+    order = used[np.argsort(first, kind='stable')]
+    remap = np.full(vertex_count, -1, dtype=np.int64)
+    remap[order] = np.arange(len(order))
+    return remap[indices], order
+
+
+class OptimizeReport:
+    def __init__(self, cache_size):
+        self.cache_size = cache_size
+        self.rows = []
+
+    def add(self, name, indices, vertex_count):
+        acmr, atvr = acmr_atvr(indices, self.cache_size)
+        self.rows.append((name, vertex_count, len(indices) // 3, acmr, atvr))
+
+    def __str__(self):
+        lines = ['{:<12} {:>10} {:>10} {:>8} {:>8}   (cache size {})'.format(
+            '', 'vertices', 'triangles', 'ACMR', 'ATVR', self.cache_size)]
+        for name, vertices, triangles, acmr, atvr in self.rows:
+            lines.append('{:<12} {:>10} {:>10} {:>8.3f} {:>8.3f}'.format(name, vertices, triangles, acmr, atvr))
+        return '\n'.join(lines)
+
+
+def optimize_mesh(mesh, cache_size=16):
+    report = OptimizeReport(cache_size)
+
+    if mesh.indices is None:
+        indices = np.arange(mesh.vertex_count, dtype=np.int64)
+        # glDrawArrays shades every vertex it is given
+        report.rows.append(('original', mesh.vertex_count, len(indices) // 3, 3.0, 1.0))
+    else:
+        indices = mesh.indices
+        report.add('original', indices, mesh.vertex_count)
+
+    rows = mesh.rows
+    if mesh.position_scale_bias is not None and mesh.sub_objects is not None:
+        rows = rows + [sub_object_rows(mesh)]
+    rows, remap = weld(rows)
+    rows = rows[:len(mesh.rows)]
+    indices = remap[indices]
+    vertex_count = len(rows[0])
+    report.add('welded', indices, vertex_count)
+
+    welded = SBMMesh(mesh.attribs, rows, indices, mesh.sub_objects, mesh.position_scale_bias)
+    positions = welded.positions()
+
+    # Sub-objects keep their ranges; only the triangles inside each move
+    sub_objects = mesh.sub_objects
+    if sub_objects is None:
+        ranges = [(0, len(indices))]
+    else:
+        ranges = [(int(first), int(count)) for first, count in sub_objects]
+
+    optimized = indices.copy()
+    for first, count in ranges:
+        part, clusters = tipsify(indices[first:first + count], vertex_count, cache_size)
+        optimized[first:first + count] = reorder_overdraw(part, clusters, positions)
+
+    optimized, order = reorder_fetch(optimized, vertex_count)
+    rows = [r[order] for r in rows]
+    report.add('optimized', optimized, len(order))
+
+    return SBMMesh(mesh.attribs, rows, optimized, sub_objects, mesh.position_scale_bias), report
+
+
+# options go to sbm_write (encoding, block_size, level)
+def sbm_write_mesh(filename, mesh, **options):
+    attribs = [SBMAttrib(a.name, a.size, a.type, rows, a.flags) for a, rows in zip(mesh.attribs, mesh.rows)]
+    sbm_write(filename, attribs, mesh.indices, mesh.sub_objects, position_scale_bias=mesh.position_scale_bias, **options)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Optimize an SBM model for the vertex cache, overdraw and vertex fetch.')
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--cache-size', type=int, default=16, help='simulated post-transform cache entries')
+    args = parser.parse_args(argv)
+
+    mesh = sbm_read_mesh(args.input)
+    if mesh is None:
+        print("{} has no vertex data".format(args.input))
+        return 1
+
+    optimized, report = optimize_mesh(mesh, args.cache_size)
+    sbm_write_mesh(args.output, optimized)
+    print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+
+# Rewrites an SBM model with compact vertex formats.
+#
+#   normal, tangent, binormal   GL_INT_2_10_10_10_REV, normalized (4 bytes)
+#   texture coordinates         GL_HALF_FLOAT (2 bytes a component)
+#   position (--positions)      GL_SHORT, normalized, with a scale and bias
+#                               per sub-object (8 bytes)
+#
+# Quantized positions decode to [-1, 1] and are written with the scale and
+# bias of their sub-object in a QNTZ chunk; SBMObject hands them out through
+# get_sub_object_position_transform() and the vertex shader applies them:
+#
+#   uniform vec3 position_scale;
+#   uniform vec3 position_bias;
+#   vec4 p = vec4(position.xyz * position_scale + position_bias, 1.0);
+#
+# Vertices shared by several sub-objects of an indexed model can only have one
+# transform, so such models get a single scale and bias for all of them.
+# Normals, tangents and texture coordinates need no shader changes.
+#
+# The report lists bytes per vertex before and after, and the error of the
+# decoded data against the source: position error in model units and as a
+# fraction of the bounding box diagonal, the angle between source and decoded
+# normals and the texture coordinate error.
+#
+# usage: python sbmquantize.py input.sbm output.sbm [--positions]
+
+import sys
+import argparse
+
+import numpy as np
+
+from sbmloader import SBMMesh, sbm_read_mesh, sb6m_decode_attrib, sb6m_attrib_size, \
+    SB6M_VERTEX_ATTRIB_FLAG_NORMALIZED, SB6M_VERTEX_ATTRIB_FLAG_INTEGER, SB6M_POSITION_SCALE_BIAS_DTYPE
+from sbmwriter import SBMAttrib, align
+from sbmoptimize import sbm_write_mesh
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+SBM_QUANTIZE_DIRECTIONS = ('normal', 'tangent', 'binormal', 'bitangent')
+SBM_QUANTIZE_TEXCOORDS = ('map', 'texcoord', 'uv')
+
+
+def is_direction(attrib):
+    return attrib.name.lower() in SBM_QUANTIZE_DIRECTIONS
+
+def is_texcoord(attrib):
+    return attrib.name.lower().startswith(SBM_QUANTIZE_TEXCOORDS)
+
+
+# Packs (n, 3) or (n, 4) values in [-1, 1] to GL_INT_2_10_10_10_REV words.
+# A missing w is stored as 0
+def pack_snorm_2_10_10_10(values):
+    values = np.clip(values, -1.0, 1.0)
+    words = np.zeros(len(values), dtype=np.uint32)
+    for i, (shift, bits) in enumerate(((0, 10), (10, 10), (20, 10), (30, 2))):
+        if i >= values.shape[1]:
+            break
+        top = (1 << (bits - 1)) - 1
+        q = np.rint(values[:, i] * top).astype(np.int64)
+        words |= ((q & ((1 << bits) - 1)) << shift).astype(np.uint32)
+    return words
+
+
+# Vertex ranges of every sub-object, or None if a vertex is shared between
+# sub-objects and the model needs a single position transform
+def sub_object_vertices(mesh):
+    if mesh.sub_objects is None or len(mesh.sub_objects) < 2:
+        return None
+
+    owner = np.full(mesh.vertex_count, -1, dtype=np.int64)
+    vertices = []
+    for s, (first, count) in enumerate(mesh.sub_objects.tolist()):
+        if mesh.indices is None:
+            v = np.arange(first, first + count)
+        else:
+            v = np.unique(mesh.indices[first:first + count])
+        if np.any((owner[v] != -1) & (owner[v] != s)):
+            return None
+        owner[v] = s
+        vertices.append(v)
+
+    # Anything no sub-object draws still has to decode to something sane
+    unused = np.flatnonzero(owner == -1)
+    if len(unused):
+        vertices[0] = np.concatenate((vertices[0], unused))
+    return vertices
+
+
+def position_scale_bias(positions):
+    if len(positions) == 0:
+        return np.ones(3), np.zeros(3)
+    low = positions.min(axis=0)
+    high = positions.max(axis=0)
+    bias = (low + high) * 0.5
+    scale = (high - low) * 0.5
+    scale[scale == 0.0] = 1.0
+    return scale, bias
+
+
+# Quantizes (n, 3) positions to normalized shorts. Returns the shorts, the
+# scale/bias records and the positions the shader will reconstruct
+def quantize_positions(mesh, positions):
+    groups = sub_object_vertices(mesh)
+    if groups is None:
+        groups = [np.arange(len(positions))]
+        count = 1 if mesh.sub_objects is None else len(mesh.sub_objects)
+    else:
+        count = len(groups)
+
+    records = np.zeros(count, dtype=SB6M_POSITION_SCALE_BIAS_DTYPE)
+    quantized = np.zeros((len(positions), 3), dtype=np.int16)
+    decoded = np.zeros((len(positions), 3), dtype=np.float64)
+
+    for s, v in enumerate(groups):
+        scale, bias = position_scale_bias(positions[v])
+        q = np.rint(np.clip((positions[v] - bias) / scale, -1.0, 1.0) * 32767.0)
+        quantized[v] = q
+        # Round trip through float32 the way the shader and QNTZ chunk see it
+        scale, bias = scale.astype(np.float32), bias.astype(np.float32)
+        decoded[v] = (q / 32767.0).astype(np.float32) * scale + bias
+        records[s] = (scale, bias)
+
+    # One shared transform is repeated for every sub-object
+    if len(groups) == 1:
+        records[:] = records[0]
+    return quantized, records, decoded
+
+
+class QuantizeReport:
+    def __init__(self):
+        self.rows = []
+        self.stride_before = 0
+        self.stride_after = 0
+
+    def add(self, name, before, after, error):
+        self.rows.append((name, before, after, error))
+
+    def __str__(self):
+        lines = ['{:<12} {:>28} {:>28}   {}'.format('attribute', 'before', 'after', 'error')]
+        for name, before, after, error in self.rows:
+            lines.append('{:<12} {:>28} {:>28}   {}'.format(name, before, after, error))
+        lines.append('bytes per vertex {} -> {} ({:.1f}%)'.format(
+            self.stride_before, self.stride_after, 100.0 * self.stride_after / max(self.stride_before, 1)))
+        return '\n'.join(lines)
+
+
+def describe(attrib):
+    packed = attrib.type in (GL_INT_2_10_10_10_REV, GL_UNSIGNED_INT_2_10_10_10_REV)
+    type_name = {GL_FLOAT: 'float', GL_HALF_FLOAT: 'half', GL_SHORT: 'short', GL_UNSIGNED_SHORT: 'ushort',
+                 GL_BYTE: 'byte', GL_UNSIGNED_BYTE: 'ubyte', GL_INT: 'int', GL_UNSIGNED_INT: 'uint',
+                 GL_DOUBLE: 'double', GL_INT_2_10_10_10_REV: 'int_2_10_10_10',
+                 GL_UNSIGNED_INT_2_10_10_10_REV: 'uint_2_10_10_10'}.get(attrib.type, hex(attrib.type))
+    norm = ' norm' if attrib.flags & SB6M_VERTEX_ATTRIB_FLAG_NORMALIZED else ''
+    return '{}{}{} ({} B)'.format(type_name, '' if packed else ' x{}'.format(attrib.size), norm, sb6m_attrib_size(attrib))
+
+
+def quantize_mesh(mesh, positions=False):
+    report = QuantizeReport()
+    attribs = []
+    position_index = mesh.attrib_index('position', 0)
+    records = None
+
+    for i, (attrib, rows) in enumerate(zip(mesh.attribs, mesh.rows)):
+        out = SBMAttrib(attrib.name, attrib.size, attrib.type, rows, attrib.flags)
+
+        # Only float data is worth squeezing; integer attributes stay as they are
+        floating = attrib.type in (GL_FLOAT, GL_DOUBLE) or \
+            (attrib.type == GL_HALF_FLOAT and is_direction(attrib))
+        if attrib.flags & SB6M_VERTEX_ATTRIB_FLAG_INTEGER:
+            floating = False
+        values = sb6m_decode_attrib(rows, attrib).astype(np.float64) if floating else None
+
+        error = ''
+        if floating and i == position_index and positions:
+            xyz = values[:, :3]
+            if attrib.size == 4 and np.any(values[:, 3] != 1.0):
+                print("{}: w is not always 1, positions left as they are".format(attrib.name))
+            else:
+                quantized, records, decoded = quantize_positions(mesh, xyz)
+                out = SBMAttrib(attrib.name, 3, GL_SHORT, quantized, SB6M_VERTEX_ATTRIB_FLAG_NORMALIZED)
+                distance = np.linalg.norm(decoded - xyz, axis=1)
+                diagonal = np.linalg.norm(xyz.max(axis=0) - xyz.min(axis=0)) if len(xyz) else 1.0
+                error = 'max {:.3g} rms {:.3g} ({:.2g} of diagonal)'.format(
+                    distance.max(initial=0.0), np.sqrt(np.mean(distance ** 2)) if len(distance) else 0.0,
+                    distance.max(initial=0.0) / max(diagonal, 1e-30))
+        elif floating and is_direction(attrib) and attrib.size in (3, 4):
+            words = pack_snorm_2_10_10_10(values)
+            out = SBMAttrib(attrib.name, 4, GL_INT_2_10_10_10_REV, words, SB6M_VERTEX_ATTRIB_FLAG_NORMALIZED)
+            decoded = sb6m_decode_attrib(out.rows(), out)[:, :3].astype(np.float64)
+            a = values[:, :3]
+            cos = (a * decoded).sum(axis=1) / np.maximum(np.linalg.norm(a, axis=1) * np.linalg.norm(decoded, axis=1), 1e-30)
+            angle = np.degrees(np.arccos(np.clip(cos, -1.0, 1.0)))
+            error = 'max {:.3g} deg mean {:.3g} deg'.format(angle.max(initial=0.0), angle.mean() if len(angle) else 0.0)
+        elif floating and is_texcoord(attrib) and attrib.type != GL_HALF_FLOAT:
+            half = values.astype(np.float16)
+            out = SBMAttrib(attrib.name, attrib.size, GL_HALF_FLOAT, half, attrib.flags)
+            error = 'max {:.3g}'.format(np.abs(half.astype(np.float64) - values).max(initial=0.0))
+
+        attribs.append(out)
+        report.add(attrib.name, describe(attrib), describe(out), error)
+        report.stride_before += align(sb6m_attrib_size(attrib), 4)
+        report.stride_after += align(sb6m_attrib_size(out), 4)
+
+    # Writing an already quantized model again keeps its transforms
+    if records is None:
+        records = mesh.position_scale_bias
+
+    quantized = SBMMesh(attribs, [a.rows() for a in attribs], mesh.indices, mesh.sub_objects, records)
+    return quantized, report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rewrite an SBM model with packed normals, half float texture '
+                                                 'coordinates and optionally 16 bit positions.')
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--positions', action='store_true',
+                        help='store positions as normalized shorts with a scale and bias per sub-object')
+    args = parser.parse_args(argv)
+
+    mesh = sbm_read_mesh(args.input)
+    if mesh is None:
+        print("{} has no vertex data".format(args.input))
+        return 1
+
+    quantized, report = quantize_mesh(mesh, args.positions)
+    sbm_write_mesh(args.output, quantized)
+    print(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,318 @@
+#!/usr/bin/python3
+
+# Writes SB6M (.sbm) files that SBMObject can load.
+#
+# Attributes are interleaved into a single vertex stream, each one 4 byte
+# aligned. Indexed meshes get an INDX chunk using the smallest index type that
+# fits and sub-objects are written as an OLST chunk, in indices for indexed
+# meshes and vertices otherwise. Models with quantized positions carry their
+# per sub-object scale and bias in a QNTZ chunk.
+#
+# SBMStreamWriter writes models too large to hold in memory. The header's
+# size field is where the chunk list starts, so the vertices can go straight
+# to the file as they arrive and the chunks describing them follow at the end.
+# Like any SBM file the result is limited to 4 GB, and it raises ValueError
+# as soon as the data would go past that.
+#
+# sbm_write can also compress the vertices and indices into a DATA chunk of
+# independently decodable zlib or lzma blocks (see SB6M_DATA_BLOCKS_DTYPE).
+
+import sys
+import zlib
+import lzma
+import tempfile
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from sbmloader import SB6M_MAGIC, SB6M_HEADER_DTYPE, SB6M_CHUNK_HEADER_DTYPE, SB6M_CHUNK_INDEX_DATA_DTYPE, \
+    SB6M_CHUNK_VERTEX_DATA_DTYPE, SB6M_VERTEX_ATTRIB_CHUNK_DTYPE, SB6M_VERTEX_ATTRIB_DECL_DTYPE, \
+    SB6M_CHUNK_SUB_OBJECT_LIST_DTYPE, SB6M_SUB_OBJECT_DECL_DTYPE, SB6M_INDEX_DTYPE, \
+    SB6M_CHUNK_TYPE_INDEX_DATA, SB6M_CHUNK_TYPE_VERTEX_DATA, SB6M_CHUNK_TYPE_VERTEX_ATTRIBS, \
+    SB6M_CHUNK_TYPE_SUB_OBJECT_LIST, SB6M_CHUNK_TYPE_COMMENT, SB6M_CHUNK_TYPE_QUANTIZATION, \
+    SB6M_CHUNK_QUANTIZATION_DTYPE, SB6M_POSITION_SCALE_BIAS_DTYPE, SB6M_CHUNK_TYPE_DATA, SB6M_DATA_CHUNK_DTYPE, \
+    SB6M_DATA_BLOCKS_DTYPE, SB6M_DATA_BLOCK_DTYPE, SB6M_DATA_ENCODING
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+# Chunk sizes and offsets are 32 bit, so nothing in a file may end past this
+SBM_MAX_OFFSET = 0xFFFFFFFF
+
+
+class SBMAttrib:
+    # One vertex attribute to write. data has a row per vertex holding the
+    # attribute exactly as it should end up in the file (size components of
+    # type, or one packed word for the 2_10_10_10 types)
+    def __init__(self, name, size, type, data, flags=0):
+        self.name = name
+        self.size = size
+        self.type = type
+        self.flags = flags
+        self.data = data
+
+    def rows(self):
+        data = np.ascontiguousarray(self.data)
+        return data.reshape(len(data), -1).view(np.uint8)
+
+
+def align(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+def sbm_index_type(vertex_count):
+    return GL_UNSIGNED_SHORT if vertex_count <= 0x10000 else GL_UNSIGNED_INT
+
+def sbm_chunk(dtype, *fields):
+    return np.array([fields], dtype=dtype).tobytes()
+
+def sbm_comment_chunk(comment):
+    text = comment.encode('ascii', 'replace') + b'\0'
+    text += bytes(align(len(text), 4) - len(text))
+    return sbm_chunk(SB6M_CHUNK_HEADER_DTYPE, SB6M_CHUNK_TYPE_COMMENT, SB6M_CHUNK_HEADER_DTYPE.itemsize + len(text)) + text
+
+# Lays the attributes out in one interleaved vertex and returns the
+# attribute declarations, the offset of every attribute and the stride
+def sbm_vertex_layout(attribs):
+    offsets = []
+    stride = 0
+    for attrib in attribs:
+        offsets.append(stride)
+        stride += align(attrib.rows().shape[1], 4)
+
+    decls = np.zeros(len(attribs), dtype=SB6M_VERTEX_ATTRIB_DECL_DTYPE)
+    for i, attrib in enumerate(attribs):
+        decls[i] = (attrib.name.encode('ascii', 'replace'), attrib.size, attrib.type, stride, attrib.flags, offsets[i])
+    return decls, offsets, stride
+
+def sbm_interleave(attribs, offsets, stride):
+    vertex_count = len(attribs[0].data)
+    vertices = np.zeros((vertex_count, stride), dtype=np.uint8)
+    for attrib, offset in zip(attribs, offsets):
+        rows = attrib.rows()
+        vertices[:, offset:offset + rows.shape[1]] = rows
+    return vertices
+
+
+# Decoded bytes per DATA block. Small enough to spread a model over the
+# decode threads, large enough for the compressors to find repeats
+SB6M_DATA_BLOCK_SIZE = 256 * 1024
+
+def sbm_compress_block(block, encoding, level=None):
+    if encoding == SB6M_DATA_ENCODING.SB6M_DATA_ENCODING_ZLIB:
+        return zlib.compress(block, 6 if level is None else level)
+    if encoding == SB6M_DATA_ENCODING.SB6M_DATA_ENCODING_LZMA:
+        return lzma.compress(block, preset=6 if level is None else level)
+    raise ValueError("unsupported DATA chunk encoding {}".format(encoding))
+
+# Splits payload into blocks and compresses them on a thread pool. Returns the
+# block table and the compressed bytes laid end to end
+def sbm_compress_blocks(payload, encoding, block_size=SB6M_DATA_BLOCK_SIZE, level=None):
+    payload = memoryview(np.ascontiguousarray(payload).view(np.uint8).reshape(-1))
+    starts = range(0, len(payload), block_size)
+    with ThreadPoolExecutor() as pool:
+        compressed = list(pool.map(lambda start: sbm_compress_block(payload[start:start + block_size], encoding, level), starts))
+
+    blocks = np.zeros(len(compressed), dtype=SB6M_DATA_BLOCK_DTYPE)
+    offset = 0
+    for i, block in enumerate(compressed):
+        blocks[i] = (offset, len(block))
+        offset += len(block)
+    return blocks, b''.join(compressed)
+
+
+def sbm_write(filename, attribs, indices=None, sub_objects=None, comment=None, position_scale_bias=None,
+              encoding=SB6M_DATA_ENCODING.SB6M_DATA_ENCODING_RAW, block_size=SB6M_DATA_BLOCK_SIZE, level=None):
+    decls, offsets, stride = sbm_vertex_layout(attribs)
+    vertices = sbm_interleave(attribs, offsets, stride)
+    vertex_count = len(vertices)
+
+    chunks = []
+    if comment:
+        chunks.append(sbm_comment_chunk(comment))
+
+    atrb_size = SB6M_VERTEX_ATTRIB_CHUNK_DTYPE.itemsize + decls.nbytes
+    chunks.append(sbm_chunk(SB6M_VERTEX_ATTRIB_CHUNK_DTYPE, SB6M_CHUNK_TYPE_VERTEX_ATTRIBS, atrb_size, len(decls)) +
+                  decls.tobytes())
+
+    if indices is not None:
+        index_type = sbm_index_type(vertex_count)
+        indices = np.asarray(indices).reshape(-1).astype(SB6M_INDEX_DTYPE[index_type])
+
+    if sub_objects is not None:
+        sub_objects = np.asarray([tuple(s) for s in sub_objects], dtype=SB6M_SUB_OBJECT_DECL_DTYPE)
+        chunks.append(sbm_chunk(SB6M_CHUNK_SUB_OBJECT_LIST_DTYPE, SB6M_CHUNK_TYPE_SUB_OBJECT_LIST,
+                                SB6M_CHUNK_SUB_OBJECT_LIST_DTYPE.itemsize + sub_objects.nbytes, len(sub_objects)) +
+                      sub_objects.tobytes())
+
+    if position_scale_bias is not None:
+        position_scale_bias = np.asarray(position_scale_bias, dtype=SB6M_POSITION_SCALE_BIAS_DTYPE)
+        chunks.append(sbm_chunk(SB6M_CHUNK_QUANTIZATION_DTYPE, SB6M_CHUNK_TYPE_QUANTIZATION,
+                                SB6M_CHUNK_QUANTIZATION_DTYPE.itemsize + position_scale_bias.nbytes,
+                                len(position_scale_bias)) +
+                      position_scale_bias.tobytes())
+
+    if encoding != SB6M_DATA_ENCODING.SB6M_DATA_ENCODING_RAW:
+        return sbm_write_encoded(filename, chunks, vertices, vertex_count, indices, encoding, block_size, level)
+
+    # Data offsets are from the start of the file, so the payload position has
+    # to be known before the VRTX and INDX chunks are built
+    chunks_size = sum(len(c) for c in chunks) + SB6M_CHUNK_VERTEX_DATA_DTYPE.itemsize
+    if indices is not None:
+        chunks_size += SB6M_CHUNK_INDEX_DATA_DTYPE.itemsize
+    vertex_offset = align(SB6M_HEADER_DTYPE.itemsize + chunks_size, 16)
+    index_offset = align(vertex_offset + vertices.nbytes, 4)
+
+    chunks.append(sbm_chunk(SB6M_CHUNK_VERTEX_DATA_DTYPE, SB6M_CHUNK_TYPE_VERTEX_DATA,
+                            SB6M_CHUNK_VERTEX_DATA_DTYPE.itemsize, vertices.nbytes, vertex_offset, vertex_count))
+    if indices is not None:
+        chunks.append(sbm_chunk(SB6M_CHUNK_INDEX_DATA_DTYPE, SB6M_CHUNK_TYPE_INDEX_DATA,
+                                SB6M_CHUNK_INDEX_DATA_DTYPE.itemsize, index_type, len(indices), index_offset))
+
+    with open(filename, 'wb') as f:
+        f.write(sbm_chunk(SB6M_HEADER_DTYPE, SB6M_MAGIC, SB6M_HEADER_DTYPE.itemsize, len(chunks), 0))
+        for chunk in chunks:
+            f.write(chunk)
+        f.write(bytes(vertex_offset - f.tell()))
+        f.write(vertices.tobytes())
+        if indices is not None:
+            f.write(bytes(index_offset - f.tell()))
+            f.write(indices.tobytes())
+
+
+# With a compressed payload the VRTX and INDX offsets are into the decoded
+# DATA chunk: vertices first, indices 16 byte aligned behind them
+def sbm_write_encoded(filename, chunks, vertices, vertex_count, indices, encoding, block_size, level):
+    payload = [vertices.reshape(-1)]
+    index_offset = align(vertices.nbytes, 16)
+    if indices is not None:
+        payload.append(np.zeros(index_offset - vertices.nbytes, dtype=np.uint8))
+        payload.append(indices.view(np.uint8))
+    payload = np.concatenate(payload)
+    blocks, compressed = sbm_compress_blocks(payload, encoding, block_size, level)
+
+    chunks.append(sbm_chunk(SB6M_CHUNK_VERTEX_DATA_DTYPE, SB6M_CHUNK_TYPE_VERTEX_DATA,
+                            SB6M_CHUNK_VERTEX_DATA_DTYPE.itemsize, vertices.nbytes, 0, vertex_count))
+    if indices is not None:
+        chunks.append(sbm_chunk(SB6M_CHUNK_INDEX_DATA_DTYPE, SB6M_CHUNK_TYPE_INDEX_DATA,
+                                SB6M_CHUNK_INDEX_DATA_DTYPE.itemsize, sbm_index_type(vertex_count), len(indices), index_offset))
+
+    data_size = SB6M_DATA_CHUNK_DTYPE.itemsize + SB6M_DATA_BLOCKS_DTYPE.itemsize + blocks.nbytes
+    chunks_size = sum(len(c) for c in chunks) + data_size
+    data_offset = align(SB6M_HEADER_DTYPE.itemsize + chunks_size, 16)
+    chunks.append(sbm_chunk(SB6M_DATA_CHUNK_DTYPE, SB6M_CHUNK_TYPE_DATA, data_size, encoding, data_offset, len(compressed)) +
+                  sbm_chunk(SB6M_DATA_BLOCKS_DTYPE, payload.nbytes, block_size, len(blocks)) +
+                  blocks.tobytes())
+
+    with open(filename, 'wb') as f:
+        f.write(sbm_chunk(SB6M_HEADER_DTYPE, SB6M_MAGIC, SB6M_HEADER_DTYPE.itemsize, len(chunks), 0))
+        for chunk in chunks:
+            f.write(chunk)
+        f.write(bytes(data_offset - f.tell()))
+        f.write(compressed)
+
+
+class SBMStreamWriter:
+    # Vertices are appended as (n, stride) byte rows laid out by
+    # sbm_vertex_layout, indices as 32 bit values in a temporary file until
+    # close() knows the vertex count and picks the index type
+    BLOCK_SIZE = 1 << 22
+
+    def __init__(self, filename, decls, stride, tempdir=None):
+        self.decls = decls
+        self.stride = stride
+        self.vertex_count = 0
+        self.index_count = 0
+        self.sub_objects = []
+        self.pending = []
+        self.pending_bytes = 0
+
+        self.f = open(filename, 'wb')
+        self.f.write(bytes(SB6M_HEADER_DTYPE.itemsize))
+        self.f.write(bytes(align(self.f.tell(), 16) - self.f.tell()))
+        self.vertex_offset = self.f.tell()
+        self.index_file = tempfile.TemporaryFile(dir=tempdir)
+
+    def write_vertices(self, vertices):
+        vertices = np.ascontiguousarray(vertices, dtype=np.uint8)
+        self.pending.append(vertices)
+        self.pending_bytes += vertices.nbytes
+        self.vertex_count += len(vertices)
+        self.check_offset(self.vertex_offset + self.vertex_count * self.stride, "vertex data")
+        if self.pending_bytes >= self.BLOCK_SIZE:
+            self.flush()
+
+    def write_indices(self, indices):
+        indices = np.asarray(indices, dtype='<u4')
+        self.index_file.write(indices.tobytes())
+        self.index_count += len(indices)
+
+    # Sub-objects are ranges of the index stream; each one starts where the
+    # previous ended
+    def begin_sub_object(self):
+        if self.sub_objects and self.sub_objects[-1][0] == self.index_count:
+            return
+        self.sub_objects.append([self.index_count, 0])
+
+    # Gives up on the file rather than write offsets that would wrap
+    def check_offset(self, offset, what):
+        if offset > SBM_MAX_OFFSET:
+            self.index_file.close()
+            self.f.close()
+            raise ValueError("{}: {} would end at byte {}, past the 4 GB an SBM file can address".format(self.f.name, what, offset))
+
+    def flush(self):
+        for vertices in self.pending:
+            self.f.write(vertices.tobytes())
+        self.pending = []
+        self.pending_bytes = 0
+
+    def close(self):
+        self.flush()
+        vertex_size = self.f.tell() - self.vertex_offset
+
+        index_type = sbm_index_type(self.vertex_count)
+        index_dtype = SB6M_INDEX_DTYPE[index_type]
+        self.f.write(bytes(align(self.f.tell(), 4) - self.f.tell()))
+        index_offset = self.f.tell()
+        # The chunk list follows the indices, and the header points at it
+        self.check_offset(align(index_offset + self.index_count * index_dtype.itemsize, 4), "index data")
+        self.index_file.seek(0)
+        while True:
+            block = self.index_file.read(self.BLOCK_SIZE)
+            if not block:
+                break
+            self.f.write(np.frombuffer(block, dtype='<u4').astype(index_dtype).tobytes())
+        self.index_file.close()
+
+        chunks = []
+        atrb_size = SB6M_VERTEX_ATTRIB_CHUNK_DTYPE.itemsize + self.decls.nbytes
+        chunks.append(sbm_chunk(SB6M_VERTEX_ATTRIB_CHUNK_DTYPE, SB6M_CHUNK_TYPE_VERTEX_ATTRIBS, atrb_size, len(self.decls)) +
+                      self.decls.tobytes())
+
+        for i, sub_object in enumerate(self.sub_objects):
+            end = self.sub_objects[i + 1][0] if i + 1 < len(self.sub_objects) else self.index_count
+            sub_object[1] = end - sub_object[0]
+        sub_objects = [tuple(s) for s in self.sub_objects if s[1] > 0]
+        if len(sub_objects) > 1:
+            sub_objects = np.asarray(sub_objects, dtype=SB6M_SUB_OBJECT_DECL_DTYPE)
+            chunks.append(sbm_chunk(SB6M_CHUNK_SUB_OBJECT_LIST_DTYPE, SB6M_CHUNK_TYPE_SUB_OBJECT_LIST,
+                                    SB6M_CHUNK_SUB_OBJECT_LIST_DTYPE.itemsize + sub_objects.nbytes, len(sub_objects)) +
+                          sub_objects.tobytes())
+
+        chunks.append(sbm_chunk(SB6M_CHUNK_VERTEX_DATA_DTYPE, SB6M_CHUNK_TYPE_VERTEX_DATA,
+                                SB6M_CHUNK_VERTEX_DATA_DTYPE.itemsize, vertex_size, self.vertex_offset, self.vertex_count))
+        chunks.append(sbm_chunk(SB6M_CHUNK_INDEX_DATA_DTYPE, SB6M_CHUNK_TYPE_INDEX_DATA,
+                                SB6M_CHUNK_INDEX_DATA_DTYPE.itemsize, index_type, self.index_count, index_offset))
+
+        self.f.write(bytes(align(self.f.tell(), 4) - self.f.tell()))
+        chunk_offset = self.f.tell()
+        for chunk in chunks:
+            self.f.write(chunk)
+
+        self.f.seek(0)
+        self.f.write(sbm_chunk(SB6M_HEADER_DTYPE, SB6M_MAGIC, chunk_offset, len(chunks), 0))
+        self.f.close()
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+
+# Shared, reference counted KTX textures with least recently used eviction
+# under a video memory budget.
+#
+# acquire(filename) returns a TextureRef for the file. Files are keyed by the
+# SHA-1 of their contents, so loading the same file twice, or two copies of
+# it under different paths, gives the same GL texture; a path is hashed again
+# only when its size or modification time changes. Each texture counts the
+# video memory its KTX header says it needs (ktx_gpu_size), measured before
+# anything is uploaded; formats ktx_gpu_size has no sizes for, such as ASTC,
+# count the size of their image data in the file instead. Released textures stay resident for the next acquire
+# until a load would go over the budget; then the least recently used ones
+# nobody holds are deleted to make room. Textures that are held are never
+# evicted, so the budget can be exceeded while they are; stats counts how
+# often that happens.
+#
+#   cache = TextureCache(budget=256 << 20)
+#   brick = cache.acquire("brick.ktx")
+#   glBindTexture(brick.target, brick.texture)
+#   ...
+#   brick.release()
+#
+# stats.as_dict() gives the hit, miss and eviction counters and the bytes
+# resident for dashboards. Everything here runs on the GL thread.
+
+import sys
+import os
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+from ktxloader import KTXObject, ktx_read, ktx_gpu_size
+
+TEXTURE_CACHE_BUDGET = 256 << 20
+
+
+def ktx_content_hash(filename):
+    h = hashlib.sha1()
+    if os.path.getsize(filename) > 0:
+        h.update(memoryview(np.memmap(filename, dtype=np.uint8, mode='r')))
+    return h.digest()
+
+
+# A shared texture. Every acquire() must be matched by a release()
+class TextureRef:
+    def __init__(self, cache, key, filename, texture, target, gpu_bytes):
+        self.cache = cache
+        self.key = key
+        self.filename = filename
+        self.texture = texture
+        self.target = target
+        self.gpu_bytes = gpu_bytes
+        self.refs = 0
+
+    def release(self):
+        self.cache.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class TextureCacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.over_budget = 0
+        self.textures = 0
+        self.resident_bytes = 0
+        self.peak_bytes = 0
+
+    def hit_rate(self):
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def as_dict(self):
+        return { 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate(),
+                 'evictions': self.evictions, 'evicted_bytes': self.evicted_bytes, 'over_budget': self.over_budget,
+                 'textures': self.textures, 'resident_bytes': self.resident_bytes, 'peak_bytes': self.peak_bytes }
+
+    def __str__(self):
+        return '{} hits, {} misses ({:.0%} hit rate), {} evictions ({:.1f} MB); {} textures, {:.1f} MB resident, ' \
+               '{:.1f} MB peak, {} loads over budget'.format(
+                   self.hits, self.misses, self.hit_rate(), self.evictions, self.evicted_bytes / 1e6, self.textures,
+                   self.resident_bytes / 1e6, self.peak_bytes / 1e6, self.over_budget)
+
+
+class TextureCache:
+
+    def __init__(self, budget=TEXTURE_CACHE_BUDGET):
+        self.budget = budget
+        self.stats = TextureCacheStats()
+        # Content hash -> TextureRef, least recently used first
+        self.entries = OrderedDict()
+        # Real path -> (size, mtime, content hash)
+        self.hashes = {}
+
+    def content_key(self, filename):
+        path = os.path.realpath(filename)
+        st = os.stat(path)
+        known = self.hashes.get(path)
+        if known is None or known[:2] != (st.st_size, st.st_mtime_ns):
+            known = (st.st_size, st.st_mtime_ns, ktx_content_hash(path))
+            self.hashes[path] = known
+        return known[2]
+
+    def acquire(self, filename):
+        key = self.content_key(filename)
+        ref = self.entries.get(key)
+        if ref is not None:
+            self.stats.hits += 1
+            self.entries.move_to_end(key)
+        else:
+            self.stats.misses += 1
+            ref = self.load(filename, key)
+        ref.refs += 1
+        return ref
+
+    def load(self, filename, key):
+        image = ktx_read(filename)
+        gpu_bytes = ktx_gpu_size(image.h)
+        if gpu_bytes is None:
+            gpu_bytes = sum(lv.image_size * len(lv.images) * len(lv.images[0]) for lv in image.levels)
+        self.evict(self.budget - gpu_bytes)
+        if self.stats.resident_bytes + gpu_bytes > self.budget:
+            self.stats.over_budget += 1
+
+        texture = KTXObject().ktx_upload(image)
+        ref = TextureRef(self, key, filename, texture, image.target, gpu_bytes)
+        self.entries[key] = ref
+        self.stats.textures += 1
+        self.stats.resident_bytes += gpu_bytes
+        self.stats.peak_bytes = max(self.stats.peak_bytes, self.stats.resident_bytes)
+        return ref
+
+    def release(self, ref):
+        if ref.refs <= 0:
+            raise ValueError("{} released more often than acquired".format(ref.filename))
+        ref.refs -= 1
+        if ref.refs == 0 and self.stats.resident_bytes > self.budget:
+            self.evict(self.budget)
+
+    # Deletes unreferenced textures, least recently used first, until at
+    # most limit bytes are resident
+    def evict(self, limit):
+        for key in list(self.entries):
+            if self.stats.resident_bytes <= limit:
+                break
+            ref = self.entries[key]
+            if ref.refs > 0:
+                continue
+            del self.entries[key]
+            glDeleteTextures(1, [ref.texture])
+            ref.texture = 0
+            self.stats.evictions += 1
+            self.stats.evicted_bytes += ref.gpu_bytes
+            self.stats.textures -= 1
+            self.stats.resident_bytes -= ref.gpu_bytes
+
+    # Drops every texture nobody holds
+    def trim(self):
+        self.evict(0)
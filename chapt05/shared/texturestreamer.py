@@ -0,0 +1,378 @@
+#!/usr/bin/python3
+
+# Asynchronous KTX texture streaming through a ring of pixel unpack buffers.
+#
+# One GL_PIXEL_UNPACK_BUFFER is allocated with glBufferStorage and mapped
+# persistently and coherently for the life of the streamer; it is split into
+# slots that make up the ring. Worker threads read KTX files (mapped, see
+# ktx_read), cut every level, layer and face into regions that fit a slot,
+# and copy them into free slots, swapping bytes for files of the other
+# endianness. The GL thread calls pump() once a frame: that creates texture
+# storage for new files and issues glTexSubImage* calls whose data pointer is
+# an offset into the buffer, so no client memory is touched on the GL thread.
+# A fence after each pump guards the slots it used; they go back to the
+# workers once the GPU has passed it.
+#
+# pump() stops after frame_budget bytes so a burst of loads is spread across
+# frames instead of stalling one of them. stats keeps the bytes uploaded, the
+# upload rate and the longest time a single pump took.
+#
+#   streamer = TextureStreamer()
+#   grass = streamer.load("grass_color.ktx")
+#   ...every frame:
+#   streamer.pump()
+#   if grass.done(): glBindTexture(GL_TEXTURE_2D, grass.result)
+
+import sys
+import time
+import queue
+import ctypes
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+from ktxloader import ktx_read, ktx_storage, ktx_native, rawCompressedTexSubImage1D, \
+    rawCompressedTexSubImage2D, rawCompressedTexSubImage3D
+from assetloader import AssetHandle
+
+STREAM_SLOT_SIZE = 4 << 20
+STREAM_SLOTS = 8
+STREAM_FRAME_BUDGET = 8 << 20
+# Regions start on this boundary inside a slot
+STREAM_REGION_ALIGN = 16
+
+
+class StreamRegion:
+    # A box of one image: rows y..y+height of slices z..z+depth of level,
+    # layer and face, and the bytes of the file that hold it
+    def __init__(self, level, layer, face, y, z, width, height, depth, offset, size):
+        self.level = level
+        self.layer = layer
+        self.face = face
+        self.y = y
+        self.z = z
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.offset = offset
+        self.size = size
+
+
+# Cuts every image of a KTXData into regions of at most max_bytes: whole
+# images if they fit, otherwise runs of slices (3D) or rows. Compressed
+# images are cut on block rows
+def ktx_regions(image, max_bytes):
+    h = image.h
+    compressed = h.gltype == GL_NONE
+    block = 4 if compressed else 1
+    one_row = h.pixelheight == 0
+
+    for level, lv in enumerate(image.levels):
+        rows = 1 if one_row else (lv.height + block - 1) // block
+        slices = lv.depth
+        row_bytes = lv.image_size // (rows * slices)
+        slice_bytes = row_bytes * rows
+        if row_bytes > max_bytes:
+            raise ValueError("a row of level {} is larger than a stream slot".format(level))
+
+        for layer, faces in enumerate(lv.images):
+            for face, start in enumerate(faces):
+                if slice_bytes <= max_bytes:
+                    step = max_bytes // slice_bytes
+                    for z in range(0, slices, step):
+                        n = min(step, slices - z)
+                        yield StreamRegion(level, layer, face, 0, z, lv.width, lv.height, n,
+                                           start + z * slice_bytes, n * slice_bytes)
+                    continue
+
+                step = max_bytes // row_bytes
+                for z in range(slices):
+                    for row in range(0, rows, step):
+                        n = min(step, rows - row)
+                        y = row * block
+                        yield StreamRegion(level, layer, face, y, z, lv.width, min(n * block, lv.height - y), 1,
+                                           start + z * slice_bytes + row * row_bytes, n * row_bytes)
+
+
+# Issues the upload of region from pointer, which is an offset into the bound
+# unpack buffer
+def ktx_upload_region(h, target, region, pointer):
+    r = region
+    compressed = h.gltype == GL_NONE
+    layers_faces = max(h.faces, 1)
+
+    if target == GL_TEXTURE_1D:
+        if compressed:
+            rawCompressedTexSubImage1D(target, r.level, 0, r.width, h.glinternalformat, r.size, pointer)
+        else:
+            glTexSubImage1D(target, r.level, 0, r.width, h.glformat, h.gltype, pointer)
+    elif target in (GL_TEXTURE_2D, GL_TEXTURE_CUBE_MAP, GL_TEXTURE_1D_ARRAY):
+        face_target, y, height = target, r.y, r.height
+        if target == GL_TEXTURE_CUBE_MAP:
+            face_target = GL_TEXTURE_CUBE_MAP_POSITIVE_X + r.face
+        elif target == GL_TEXTURE_1D_ARRAY:
+            y, height = r.layer, 1
+        if compressed:
+            rawCompressedTexSubImage2D(face_target, r.level, 0, y, r.width, height, h.glinternalformat, r.size, pointer)
+        else:
+            glTexSubImage2D(face_target, r.level, 0, y, r.width, height, h.glformat, h.gltype, pointer)
+    else:
+        z = r.z if target == GL_TEXTURE_3D else r.layer * layers_faces + r.face
+        if compressed:
+            rawCompressedTexSubImage3D(target, r.level, 0, r.y, z, r.width, r.height, r.depth, h.glinternalformat, r.size, pointer)
+        else:
+            glTexSubImage3D(target, r.level, 0, r.y, z, r.width, r.height, r.depth, h.glformat, h.gltype, pointer)
+
+
+class StreamSlot:
+    def __init__(self, index, offset, view):
+        self.index = index
+        self.offset = offset
+        self.view = view
+
+
+class StreamBatch:
+    # The regions a worker copied into one slot. last is set on the final
+    # batch of a texture
+    def __init__(self, job, slot):
+        self.job = job
+        self.slot = slot
+        self.regions = []
+        self.used = 0
+        self.last = False
+
+
+class StreamJob:
+    def __init__(self, filename, tex):
+        self.handle = AssetHandle(filename)
+        self.tex = tex
+        self.image = None
+        self.error = None
+        self.started = False
+
+
+class StreamStats:
+    def __init__(self):
+        self.bytes = 0
+        self.regions = 0
+        self.textures = 0
+        self.pumps = 0
+        self.pump_seconds = 0.0
+        self.worst_pump_seconds = 0.0
+        self.first_request = None
+        self.last_done = None
+
+    # Bytes per second from the first load() to the last finished texture
+    def throughput(self):
+        if self.first_request is None or self.last_done is None or self.last_done <= self.first_request:
+            return 0.0
+        return self.bytes / (self.last_done - self.first_request)
+
+    def __str__(self):
+        return '{} textures, {:.1f} MB in {} regions; {:.1f} MB/s end to end, {:.1f} MB/s while pumping; ' \
+               'worst pump {:.2f} ms over {} pumps'.format(
+                   self.textures, self.bytes / 1e6, self.regions, self.throughput() / 1e6,
+                   self.bytes / max(self.pump_seconds, 1e-9) / 1e6, self.worst_pump_seconds * 1000.0, self.pumps)
+
+
+class TextureStreamer:
+
+    # Has to be created on the thread that owns the GL context
+    def __init__(self, slot_size=STREAM_SLOT_SIZE, slots=STREAM_SLOTS, frame_budget=STREAM_FRAME_BUDGET,
+                 max_workers=None):
+        self.slot_size = slot_size
+        self.frame_budget = frame_budget
+        self.stats = StreamStats()
+
+        size = slot_size * slots
+        self.buffer = glGenBuffers(1)
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, self.buffer)
+        flags = GL_MAP_WRITE_BIT | GL_MAP_PERSISTENT_BIT | GL_MAP_COHERENT_BIT
+        glBufferStorage(GL_PIXEL_UNPACK_BUFFER, size, None, flags)
+        pointer = glMapBufferRange(GL_PIXEL_UNPACK_BUFFER, 0, size, flags)
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+        self.mapped = np.ctypeslib.as_array(ctypes.cast(pointer, ctypes.POINTER(ctypes.c_ubyte)), shape=(size,))
+
+        # Slots the workers may fill; the GL thread returns them once their fence passes
+        self.free = queue.Queue()
+        for i in range(slots):
+            self.free.put(StreamSlot(i, i * slot_size, self.mapped[i * slot_size:(i + 1) * slot_size]))
+
+        self.ready = queue.Queue()
+        self.held = None
+        self.in_flight = []
+        self.pending = []
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='texturestreamer')
+
+    def load(self, filename, tex=0):
+        job = StreamJob(filename, tex)
+        self.pending.append(job)
+        if self.stats.first_request is None:
+            self.stats.first_request = time.perf_counter()
+        self.pool.submit(self.read, job)
+        return job.handle
+
+    # Worker side: fills slots with the regions of one file
+    def read(self, job):
+        batch = None
+        try:
+            job.image = image = ktx_read(job.handle.filename)
+            for region in ktx_regions(image, self.slot_size):
+                start = (batch.used + STREAM_REGION_ALIGN - 1) & ~(STREAM_REGION_ALIGN - 1) if batch else 0
+                if batch is None or start + region.size > self.slot_size:
+                    if batch is not None:
+                        self.ready.put(batch)
+                    batch = StreamBatch(job, self.free.get())
+                    start = 0
+                pixels = ktx_native(image.h, image.data[region.offset:region.offset + region.size])
+                batch.slot.view[start:start + region.size] = pixels
+                batch.regions.append((region, start))
+                batch.used = start + region.size
+            if batch is None:
+                batch = StreamBatch(job, None)
+        except BaseException as e:
+            job.error = e
+            if batch is None:
+                batch = StreamBatch(job, None)
+        batch.last = True
+        self.ready.put(batch)
+
+    def next_batch(self, timeout=None):
+        if self.held is not None:
+            batch, self.held = self.held, None
+            return batch
+        try:
+            return self.ready.get(timeout=timeout) if timeout else self.ready.get_nowait()
+        except queue.Empty:
+            return None
+
+    # Hands slots whose uploads the GPU has finished back to the workers.
+    # With wait, blocks on the oldest fence
+    def recycle(self, wait=False):
+        while self.in_flight:
+            fence, slots = self.in_flight[0]
+            status = glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 1000000 if wait else 0)
+            if status not in (GL_ALREADY_SIGNALED, GL_CONDITION_SATISFIED):
+                break
+            glDeleteSync(fence)
+            for slot in slots:
+                self.free.put(slot)
+            self.in_flight.pop(0)
+            wait = False
+
+    # Runs uploads for up to budget bytes (default frame_budget, None for no
+    # limit); GL thread only. At least one batch goes through when any is
+    # ready, whatever its size. Returns the number of bytes uploaded
+    def pump(self, budget=-1, timeout=None):
+        start = time.perf_counter()
+        if budget == -1:
+            budget = self.frame_budget
+
+        self.recycle()
+        uploaded = 0
+        used = []
+        bound = False
+        while True:
+            batch = self.next_batch(timeout if not used else None)
+            if batch is None:
+                break
+            if used and budget is not None and uploaded + batch.used > budget:
+                self.held = batch
+                break
+            if not bound:
+                glBindBuffer(GL_PIXEL_UNPACK_BUFFER, self.buffer)
+                bound = True
+            self.upload_batch(batch)
+            uploaded += batch.used
+            if batch.slot is not None:
+                used.append(batch.slot)
+
+        if bound:
+            glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+        if used:
+            self.in_flight.append((glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0), used))
+
+        seconds = time.perf_counter() - start
+        self.stats.bytes += uploaded
+        self.stats.pumps += 1
+        self.stats.pump_seconds += seconds
+        self.stats.worst_pump_seconds = max(self.stats.worst_pump_seconds, seconds)
+        return uploaded
+
+    def upload_batch(self, batch):
+        job = batch.job
+        image = job.image
+        if job.error is None and batch.regions:
+            h = image.h
+            self.begin(job)
+            glPixelStorei(GL_UNPACK_ALIGNMENT, image.alignment)
+            for region, start in batch.regions:
+                ktx_upload_region(h, image.target, region, ctypes.c_void_p(batch.slot.offset + start))
+            self.stats.regions += len(batch.regions)
+
+        if batch.last:
+            self.finish(job)
+
+    # Binds the texture of job, creating its storage the first time
+    def begin(self, job):
+        image = job.image
+        if not job.started:
+            if job.tex == 0:
+                job.tex = glGenTextures(1)
+            glBindTexture(image.target, job.tex)
+            ktx_storage(image.h, image.target)
+            job.started = True
+        glBindTexture(image.target, job.tex)
+
+    def finish(self, job):
+        handle = job.handle
+        if job.error is None:
+            image = job.image
+            self.begin(job)
+            # Files without a mip chain get one, as ktx_load does
+            if image.h.miplevels == 1:
+                glGenerateMipmap(image.target)
+            handle.result = job.tex
+            self.stats.textures += 1
+        else:
+            print("error loading {}: {}".format(handle.filename, job.error))
+            handle.error = job.error
+        # Drop the mapping of the file; its data is in the texture now
+        job.image = None
+        handle.uploaded.set()
+        self.pending = [j for j in self.pending if not j.handle.done()]
+        self.stats.last_done = time.perf_counter()
+
+    # Blocks until the given handles (default: everything loading) are
+    # uploaded, ignoring the frame budget; GL thread only
+    def wait(self, handles=None):
+        if handles is None:
+            handles = [j.handle for j in self.pending]
+        while not all(handle.done() for handle in handles):
+            if not self.pump(None, timeout=0.001):
+                self.recycle(wait=True)
+        for handle in handles:
+            handle.get()
+        return [handle.result for handle in handles]
+
+    def shutdown(self):
+        self.wait()
+        self.pool.shutdown(wait=True)
+        self.recycle()
+        for fence, slots in self.in_flight:
+            glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, GL_TIMEOUT_IGNORED)
+            glDeleteSync(fence)
+        self.in_flight = []
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, self.buffer)
+        glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER)
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+        glDeleteBuffers(1, [self.buffer])
+        self.mapped = None
@@ -0,0 +1,266 @@
+#!/usr/bin/python3
+
+# A scene graph of transforms kept in flat arrays, for scenes with thousands
+# of moving parts.
+#
+# Every node has a parent (-1 for roots) and a local translation, rotation
+# (unit quaternion x, y, z, w) and scale, stored in contiguous (N, 3) and
+# (N, 4) arrays. Setting any of them raises the node's dirty flag. update()
+# rebuilds the local matrices of the flagged nodes in one batch, then walks
+# down the tree a depth at a time: the world matrices of the flagged nodes
+# at a depth and of the children of every node changed at the depth above
+# are computed together with one batched product each. Nodes outside the
+# changed subtrees are not touched. A parent must be added before its
+# children, so node indices are already in topological order.
+#
+# World matrices are column-major like sbmath's and go to the shaders from
+# an SSBO (or UBO) of mat4, indexed by node: upload() writes only the
+# ranges that changed since the last upload.
+#
+#   tree = TransformTree()
+#   body = tree.add(translation=(0.0, 0.0, -4.0))
+#   wheels = tree.add_nodes(np.full(4, body), translations=offsets)
+#   ...every frame:
+#   tree.set_rotation(wheels, spin)
+#   tree.update()
+#   tree.upload(GL_SHADER_STORAGE_BUFFER, 0)
+
+import sys
+import ctypes
+
+import numpy as np
+
+try:
+    from OpenGL.GL import *
+except:
+    print ('''
+    ERROR: PyOpenGL not installed properly.
+        ''')
+    sys.exit()
+
+# Takes a size and a pointer, without the wrapper's per call conversions
+from OpenGL.raw.GL.VERSION.GL_1_5 import glBufferSubData as rawBufferSubData
+
+from sbmath import m3dTRS44, m3dMultiply44
+
+TRANSFORM_CAPACITY = 1024
+# Changed nodes closer than this many matrices go up in the same call: a
+# call costs about as much as sending a few hundred matrices more
+TRANSFORM_UPLOAD_GAP = 256
+TRANSFORM_MATRIX_BYTES = 64
+
+
+# nodes as a slice when they are a run of consecutive indices, which numpy
+# copies much faster than it gathers through an index array
+def node_run(nodes):
+    if nodes.size > 1 and nodes[-1] - nodes[0] + 1 == nodes.size and np.all(np.diff(nodes) == 1):
+        return slice(int(nodes[0]), int(nodes[-1]) + 1)
+    return nodes
+
+
+class TransformUpdateStats:
+    def __init__(self):
+        self.updates = 0
+        self.locals = 0
+        self.worlds = 0
+        self.levels = 0
+        self.uploads = 0
+        self.uploaded_bytes = 0
+
+    def __str__(self):
+        return '{} updates: {} local and {} world matrices over {} levels; {} uploads, {:.1f} MB'.format(
+            self.updates, self.locals, self.worlds, self.levels, self.uploads, self.uploaded_bytes / 1e6)
+
+
+class TransformTree:
+
+    def __init__(self, capacity=TRANSFORM_CAPACITY):
+        self.count = 0
+        self.stats = TransformUpdateStats()
+        self.allocate(max(capacity, 1))
+        # Children of every node, rebuilt when nodes are added
+        self.child_order = None
+        self.child_start = None
+        self.child_count = None
+        self.buffer = 0
+        self.buffer_capacity = 0
+
+    def allocate(self, capacity):
+        n = self.count
+        arrays = {
+            'parent': np.full(capacity, -1, dtype=np.int64),
+            'depth': np.zeros(capacity, dtype=np.int32),
+            'translation': np.zeros((capacity, 3), dtype=np.float32),
+            'rotation': np.zeros((capacity, 4), dtype=np.float32),
+            'scale': np.ones((capacity, 3), dtype=np.float32),
+            'dirty': np.zeros(capacity, dtype=bool),
+            # World matrix changed since the last upload
+            'changed': np.zeros(capacity, dtype=bool),
+            # Scratch flags for update()
+            'seen': np.zeros(capacity, dtype=bool),
+            'local': np.empty((capacity, 4, 4), dtype=np.float32),
+            'world': np.empty((capacity, 4, 4), dtype=np.float32),
+        }
+        for name, array in arrays.items():
+            if n:
+                array[:n] = getattr(self, name)[:n]
+            setattr(self, name, array)
+        self.capacity = capacity
+
+    # Adds count nodes under parents (an index or -1 each); returns their indices
+    def add_nodes(self, parents, translations=None, rotations=None, scales=None):
+        parents = np.asarray(parents, dtype=np.int64).reshape(-1)
+        count = parents.size
+        if np.any(parents >= self.count) or np.any(parents < -1):
+            raise ValueError("parents must be -1 or nodes added before")
+        if self.count + count > self.capacity:
+            self.allocate(max(self.capacity * 2, self.count + count))
+
+        nodes = np.arange(self.count, self.count + count)
+        self.count += count
+        self.parent[nodes] = parents
+        self.depth[nodes] = np.where(parents < 0, 0, self.depth[np.maximum(parents, 0)] + 1)
+        self.translation[nodes] = 0.0 if translations is None else translations
+        self.rotation[nodes] = (0.0, 0.0, 0.0, 1.0) if rotations is None else rotations
+        self.scale[nodes] = 1.0 if scales is None else scales
+        self.dirty[nodes] = True
+        self.child_order = None
+        return nodes
+
+    def add(self, parent=-1, translation=None, rotation=None, scale=None):
+        return int(self.add_nodes([parent], translation, rotation, scale)[0])
+
+    def set_translation(self, nodes, translation):
+        self.translation[nodes] = translation
+        self.dirty[nodes] = True
+
+    def set_rotation(self, nodes, rotation):
+        self.rotation[nodes] = rotation
+        self.dirty[nodes] = True
+
+    def set_scale(self, nodes, scale):
+        self.scale[nodes] = scale
+        self.dirty[nodes] = True
+
+    def set_trs(self, nodes, translation, rotation, scale):
+        self.translation[nodes] = translation
+        self.rotation[nodes] = rotation
+        self.scale[nodes] = scale
+        self.dirty[nodes] = True
+
+    def world_matrix(self, node):
+        return self.world[node]
+
+    def build_children(self):
+        n = self.count
+        parents = self.parent[:n]
+        self.child_order = np.argsort(parents, kind='stable')
+        roots = np.count_nonzero(parents < 0)
+        self.child_count = np.bincount(parents[parents >= 0], minlength=n)
+        self.child_start = roots + np.cumsum(self.child_count) - self.child_count
+
+    # All children of nodes, in no particular order
+    def children_of(self, nodes):
+        counts = self.child_count[nodes]
+        total = int(counts.sum())
+        if total == 0:
+            return nodes[:0]
+        ends = np.cumsum(counts)
+        offsets = np.repeat(self.child_start[nodes] - ends + counts, counts) + np.arange(total)
+        return self.child_order[offsets]
+
+    # Recomputes the matrices of dirty nodes and of everything below them;
+    # returns the nodes whose world matrix changed, in no particular order
+    def update(self):
+        marked = np.flatnonzero(self.dirty[:self.count])
+        if marked.size == 0:
+            return marked
+        if self.child_order is None:
+            self.build_children()
+        self.dirty[marked] = False
+
+        run = node_run(marked)
+        self.local[run] = m3dTRS44(self.translation[run], self.rotation[run], self.scale[run])
+        self.stats.updates += 1
+        self.stats.locals += marked.size
+
+        # The flagged nodes grouped by depth, shallowest first
+        depths = self.depth[marked]
+        order = np.argsort(depths, kind='stable')
+        marked, depths = marked[order], depths[order]
+        bounds = np.flatnonzero(np.diff(depths)) + 1
+        groups = dict(zip(depths[np.r_[0, bounds]].tolist(), np.split(marked, bounds)))
+
+        changed = []
+        below = marked[:0]
+        depth = int(depths[0])
+        while True:
+            nodes = below
+            if depth in groups:
+                # Flagged nodes at this depth that are not below a changed one
+                flagged = groups.pop(depth)
+                self.seen[below] = True
+                nodes = np.concatenate((below, flagged[~self.seen[flagged]]))
+                self.seen[below] = False
+            run = node_run(nodes)
+            if depth == 0:
+                self.world[run] = self.local[run]
+            elif isinstance(run, slice):
+                m3dMultiply44(self.world[self.parent[run]], self.local[run], out=self.world[run])
+            else:
+                self.world[run] = m3dMultiply44(self.world[self.parent[run]], self.local[run])
+            changed.append(nodes)
+            self.stats.worlds += nodes.size
+            self.stats.levels += 1
+
+            # On to the children of what changed, or the next flagged depth
+            below = self.children_of(nodes)
+            if below.size:
+                depth += 1
+            elif groups:
+                depth = min(groups)
+            else:
+                break
+
+        changed = np.concatenate(changed)
+        self.changed[changed] = True
+        return changed
+
+    # Runs of changed nodes as (first, last + 1), merging runs less than
+    # gap matrices apart
+    def changed_ranges(self, gap=TRANSFORM_UPLOAD_GAP):
+        changed = np.flatnonzero(self.changed[:self.count])
+        if changed.size == 0:
+            return []
+        breaks = np.flatnonzero(np.diff(changed) > gap)
+        firsts = changed[np.r_[0, breaks + 1]]
+        lasts = changed[np.r_[breaks, changed.size - 1]] + 1
+        return list(zip(firsts.tolist(), lasts.tolist()))
+
+    # Writes the world matrices that changed into the tree's buffer and binds
+    # it to binding of target. The buffer is reallocated, and filled whole,
+    # when the tree outgrows it
+    def upload(self, target=GL_SHADER_STORAGE_BUFFER, binding=0):
+        if self.buffer == 0:
+            self.buffer = glGenBuffers(1)
+        glBindBuffer(target, self.buffer)
+        if self.buffer_capacity < self.count:
+            self.buffer_capacity = self.capacity
+            glBufferData(target, self.capacity * TRANSFORM_MATRIX_BYTES, None, GL_DYNAMIC_DRAW)
+            ranges = [(0, self.count)]
+        else:
+            ranges = self.changed_ranges()
+        for first, last in ranges:
+            size = (last - first) * TRANSFORM_MATRIX_BYTES
+            rawBufferSubData(target, first * TRANSFORM_MATRIX_BYTES, size, ctypes.c_void_p(self.world[first:].ctypes.data))
+            self.stats.uploads += 1
+            self.stats.uploaded_bytes += size
+        self.changed[:self.count] = False
+        glBindBufferBase(target, binding, self.buffer)
+        return ranges
+
+    def delete(self):
+        if self.buffer:
+            glDeleteBuffers(1, [self.buffer])
+            self.buffer = 0
+            self.buffer_capacity = 0
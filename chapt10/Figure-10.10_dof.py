@@ -9,6 +9,12 @@ sys.path.append("./shared")
 
 from sbmloader import SBMObject    # location of sbm file format loader
 from ktxloader import KTXObject    # location of ktx file format loader
+# Older support bundles ship a shared directory without assetloader; the
+# assets then load one after another as they used to
+try:
+    from assetloader import AssetLoader
+except ImportError:
+    AssetLoader = None
 from textoverlay import OVERLAY_
 from shader import shader_load, link_from_shaders
 
@@ -155,8 +161,14 @@ class Scene:
             [0.8, 0.2, 0.1, 1.0],
         ]
 
+        # Models are read on worker threads while the framebuffers are set
+        # up; only their uploads run here
+        loader = AssetLoader() if AssetLoader else None
         for i in range(0, OBJECT_COUNT):
-            objects[i].obj.load(object_names[i])
+            if loader:
+                loader.load_sbm(object_names[i], objects[i].obj)
+            else:
+                objects[i].obj.load(object_names[i])
             objects[i].diffuse_albedo = object_colors[i]
 
         glGenFramebuffers(1, depth_fbo)
@@ -184,6 +196,10 @@ class Scene:
 
         glEnable(GL_DEPTH_TEST)
 
+        if loader:
+            loader.wait()
+            loader.shutdown()
+
         glGenVertexArrays(1, quad_vao)
         glBindVertexArray(quad_vao)
 
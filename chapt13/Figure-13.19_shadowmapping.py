@@ -9,6 +9,12 @@ sys.path.append("./shared")
 
 from sbmloader import SBMObject    # location of sbm file format loader
 from ktxloader import KTXObject    # location of ktx file format loader
+# Older support bundles ship a shared directory without assetloader; the
+# assets then load one after another as they used to
+try:
+    from assetloader import AssetLoader
+except ImportError:
+    AssetLoader = None
 from textoverlay import OVERLAY_
 from shader import shader_load, link_from_shaders
 
@@ -169,8 +175,6 @@ class Scene:
         global depth_debug_tex
         global quad_vao
         
-        load_shaders()
-
         object_names = [
         
             "dragon.sbm",
@@ -179,9 +183,17 @@ class Scene:
             "torus.sbm"
         ]
 
+        # Models are read on worker threads while the shaders compile and the
+        # framebuffers are set up; only their uploads run here
+        loader = AssetLoader() if AssetLoader else None
         for i in range(0, OBJECT_COUNT):
         
-            objects[i].obj.load(object_names[i])
+            if loader:
+                loader.load_sbm(object_names[i], objects[i].obj, cache_dir="__sbmcache__")
+            else:
+                objects[i].obj.load(object_names[i])
+
+        load_shaders()
 
         glGenFramebuffers(1, depth_fbo)
         glBindFramebuffer(GL_FRAMEBUFFER, depth_fbo)
@@ -209,6 +221,10 @@ class Scene:
 
         glEnable(GL_DEPTH_TEST)
 
+        if loader:
+            loader.wait()
+            loader.shutdown()
+
         glGenVertexArrays(1, quad_vao)
         glBindVertexArray(quad_vao)
 
@@ -9,6 +9,12 @@ sys.path.append("./shared")
 
 from sbmloader import SBMObject    # location of sbm file format loader
 from ktxloader import KTXObject    # location of ktx file format loader
+# Older support bundles ship a shared directory without assetloader; the
+# assets then load one after another as they used to
+try:
+    from assetloader import AssetLoader
+except ImportError:
+    AssetLoader = None
 from textoverlay import OVERLAY_
 from shader import shader_load, link_from_shaders
 
@@ -186,9 +192,17 @@ class Scene:
         glGenVertexArrays(1, fs_quad_vao)
         glBindVertexArray(fs_quad_vao)
 
-        myobject.load("ladybug.sbm")
-        tex_nm = ktxobject.ktx_load("ladybug_nm.ktx")
-        tex_diffuse = ktxobject.ktx_load("ladybug_co.ktx")
+        # The model and its textures are read on worker threads while the
+        # shaders compile and the uniform buffers are created
+        loader = AssetLoader() if AssetLoader else None
+        if loader:
+            loader.load_sbm("ladybug.sbm", myobject)
+            nm = loader.load_ktx("ladybug_nm.ktx")
+            diffuse = loader.load_ktx("ladybug_co.ktx")
+        else:
+            myobject.load("ladybug.sbm")
+            tex_nm = ktxobject.ktx_load("ladybug_nm.ktx")
+            tex_diffuse = ktxobject.ktx_load("ladybug_co.ktx")
 
         load_shaders()
 
@@ -203,6 +217,12 @@ class Scene:
         glBindBuffer(GL_UNIFORM_BUFFER, render_transform_ubo)
         glBufferData(GL_UNIFORM_BUFFER, (2 + NUM_INSTANCES) * glm.sizeof(glm.mat4), None, GL_DYNAMIC_DRAW)
 
+        if loader:
+            loader.wait()
+            loader.shutdown()
+            tex_nm = nm.result
+            tex_diffuse = diffuse.result
+
 
 
 
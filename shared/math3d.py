@@ -181,40 +181,53 @@ def m3dGetVectorLength(u):
 def m3dNormalizeVector(u):
     m3dScaleVector3(u, 1.0 / m3dGetVectorLength(u))
     
-# Graceless, but duplicating the one from OpenGL SuperBible would be worse, I think?
-# Adds a dependency on numpy, also, which is a bummer.
+# Invert a 4x4 matrix by cofactor expansion over 2x2 minors, as the SuperBible
+# does. Inverting the transpose gives the transposed inverse, so the column
+# major layout needs no special care. A singular matrix raises ValueError
+# (numpy's LinAlgError, raised by the old numpy.matrix version, is one).
+# chapt05/shared/sbmath.py has m3dInverse44 for whole arrays of matrices.
 def m3dInvertMatrix44(dst, src):
-    try:
-        from numpy import matrix
-    except ImportError:
-        print ("You need Numpy.")
-        import sys
-        sys.exit(1)
-        
-    mat = matrix(   [[src[0], src[1], src[2], src[3]],
-                    [src[4], src[5], src[6], src[7]],
-                    [src[8], src[9], src[10], src[11]],
-                    [src[12], src[13], src[14], src[15]]])
-    mat = mat.I.tolist()                
-    dst[0] = mat[0][0]
-    dst[1] = mat[0][1]
-    dst[2] = mat[0][2]
-    dst[3] = mat[0][3]
-
-    dst[4] = mat[1][0]
-    dst[5] = mat[1][1]
-    dst[6] = mat[1][2]
-    dst[7] = mat[1][3]
-
-    dst[8] = mat[2][0]
-    dst[9] = mat[2][1]
-    dst[10] = mat[2][2]
-    dst[11] = mat[2][3]
-
-    dst[12] = mat[3][0]
-    dst[13] = mat[3][1]
-    dst[14] = mat[3][2]
-    dst[15] = mat[3][3]
+    (a00, a01, a02, a03, a10, a11, a12, a13,
+     a20, a21, a22, a23, a30, a31, a32, a33) = src[0:16]
+
+    s0 = a00 * a11 - a10 * a01
+    s1 = a00 * a12 - a10 * a02
+    s2 = a00 * a13 - a10 * a03
+    s3 = a01 * a12 - a11 * a02
+    s4 = a01 * a13 - a11 * a03
+    s5 = a02 * a13 - a12 * a03
+
+    c5 = a22 * a33 - a32 * a23
+    c4 = a21 * a33 - a31 * a23
+    c3 = a21 * a32 - a31 * a22
+    c2 = a20 * a33 - a30 * a23
+    c1 = a20 * a32 - a30 * a22
+    c0 = a20 * a31 - a30 * a21
+
+    det = s0 * c5 - s1 * c4 + s2 * c3 + s3 * c2 - s4 * c1 + s5 * c0
+    if det == 0.0:
+        raise ValueError("singular matrix")
+    inv = 1.0 / det
+
+    dst[0] = (a11 * c5 - a12 * c4 + a13 * c3) * inv
+    dst[1] = (-a01 * c5 + a02 * c4 - a03 * c3) * inv
+    dst[2] = (a31 * s5 - a32 * s4 + a33 * s3) * inv
+    dst[3] = (-a21 * s5 + a22 * s4 - a23 * s3) * inv
+
+    dst[4] = (-a10 * c5 + a12 * c2 - a13 * c1) * inv
+    dst[5] = (a00 * c5 - a02 * c2 + a03 * c1) * inv
+    dst[6] = (-a30 * s5 + a32 * s2 - a33 * s1) * inv
+    dst[7] = (a20 * s5 - a22 * s2 + a23 * s1) * inv
+
+    dst[8] = (a10 * c4 - a11 * c2 + a13 * c0) * inv
+    dst[9] = (-a00 * c4 + a01 * c2 - a03 * c0) * inv
+    dst[10] = (a30 * s4 - a31 * s2 + a33 * s0) * inv
+    dst[11] = (-a20 * s4 + a21 * s2 - a23 * s0) * inv
+
+    dst[12] = (-a10 * c3 + a11 * c1 - a12 * c0) * inv
+    dst[13] = (a00 * c3 - a01 * c1 + a02 * c0) * inv
+    dst[14] = (-a30 * s3 + a31 * s1 - a32 * s0) * inv
+    dst[15] = (a20 * s3 - a21 * s1 + a22 * s0) * inv
 
 # Dot Product, only for three component vectors
 # return u dot v